@@ -0,0 +1,231 @@
+from typing import Dict, Any, Optional, Set, List, AsyncIterator
+from collections import OrderedDict
+import os
+import string
+import time
+import uuid
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from models import AccessCode, Playlist
+from usage import WriteBehindCounters
+
+CODE_ALPHABET = (string.ascii_uppercase + string.digits).encode()
+# Random bytes at or above the largest multiple of the alphabet size are
+# dropped, so every character is equally likely
+_ACCEPTED_BYTES = 256 - 256 % len(CODE_ALPHABET)
+_CODE_TABLE = bytes(CODE_ALPHABET[i % len(CODE_ALPHABET)] for i in range(256))
+_REJECTED_BYTES = bytes(range(_ACCEPTED_BYTES, 256))
+
+DUPLICATE_KEY_ERROR = 11000
+
+def generate_codes(count: int, length: int = 12) -> List[str]:
+    """count random access codes drawn from os.urandom, mapped in bulk with rejection sampling"""
+    needed = count * length
+    chars = b""
+    while len(chars) < needed:
+        # Request a little extra so one draw nearly always suffices
+        draw = (needed - len(chars)) * 256 // _ACCEPTED_BYTES + 64
+        chars += os.urandom(draw).translate(_CODE_TABLE, _REJECTED_BYTES)
+    text = chars[:needed].decode("ascii")
+    return [text[i:i + length] for i in range(0, needed, length)]
+
+class ResolvedAccessCode:
+    __slots__ = ("access_code", "playlist", "expires_at", "exhausted")
+
+    def __init__(self, access_code: AccessCode, playlist: Optional[Playlist], expires_at: float):
+        self.access_code = access_code
+        self.playlist = playlist
+        self.expires_at = expires_at
+        # Set once a use was refused because max_uses is reached
+        self.exhausted = False
+
+# Access code -> playlist resolution for playlist exports
+class AccessCodeResolver:
+    """Resolve access codes with their playlist in one round trip, caching the result
+
+    A miss runs a single aggregation that joins the playlist onto the code.
+    Resolutions are kept for ``ttl`` seconds; playlist edits made by this
+    worker drop them at once.
+
+    Uses of codes with a ``max_uses`` limit are counted with a conditional
+    update, so the limit is enforced exactly by the database. Uses of
+    unlimited codes are added to ``usage``, when given, and written behind
+    in bulk; revoking such a code takes effect once its resolution expires.
+    """
+    def __init__(self, access_codes, ttl: float = 30.0, max_entries: int = 100000,
+                 usage: Optional[WriteBehindCounters] = None):
+        self.access_codes = access_codes
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.usage = usage
+        self._entries: "OrderedDict[str, ResolvedAccessCode]" = OrderedDict()
+        self._playlist_codes: Dict[str, Set[str]] = {}
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "uses_counted": 0,
+            "uses_buffered": 0,
+            "uses_refused": 0
+        }
+
+    async def resolve(self, code: str) -> Optional[ResolvedAccessCode]:
+        """Active access code and its playlist (None when the playlist is gone); None for unknown codes"""
+        entry = self._entries.get(code)
+        if entry is not None:
+            if entry.expires_at > time.monotonic():
+                self._entries.move_to_end(code)
+                self.stats["hits"] += 1
+                return entry
+            self._remove(code)
+        self.stats["misses"] += 1
+
+        pipeline = [
+            {"$match": {"code": code, "is_active": True}},
+            {"$limit": 1},
+            {"$lookup": {
+                "from": "playlists",
+                "localField": "playlist_id",
+                "foreignField": "id",
+                "as": "playlists"
+            }}
+        ]
+        doc = None
+        async for doc in self.access_codes.aggregate(pipeline):
+            break
+        if doc is None:
+            # Unknown codes are not cached, so guessing cannot flush the cache
+            return None
+
+        playlists = doc.pop("playlists")
+        entry = ResolvedAccessCode(
+            AccessCode(**doc),
+            Playlist(**playlists[0]) if playlists else None,
+            time.monotonic() + self.ttl
+        )
+        self._entries[code] = entry
+        self._playlist_codes.setdefault(entry.access_code.playlist_id, set()).add(code)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+        return entry
+
+    async def count_use(self, resolved: ResolvedAccessCode) -> bool:
+        """Record one use; False when the code was revoked or has reached max_uses"""
+        access_code = resolved.access_code
+        if self.usage is not None and not access_code.max_uses:
+            self.usage.add((("id", access_code.id),), current_uses=1)
+            access_code.current_uses += 1
+            self.stats["uses_buffered"] += 1
+            return True
+
+        updated = await self.access_codes.find_one_and_update(
+            {
+                "id": access_code.id,
+                "is_active": True,
+                "$or": [
+                    # 0, like no limit at all, means unlimited
+                    {"max_uses": {"$in": [None, 0]}},
+                    {"$expr": {"$lt": ["$current_uses", "$max_uses"]}}
+                ]
+            },
+            {"$inc": {"current_uses": 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated is not None:
+            access_code.current_uses = updated["current_uses"]
+            self.stats["uses_counted"] += 1
+            return True
+
+        self.stats["uses_refused"] += 1
+        current = await self.access_codes.find_one(
+            {"id": access_code.id}, {"_id": 0, "is_active": 1, "current_uses": 1}
+        )
+        if current is None or not current.get("is_active", True):
+            self.invalidate(access_code.code)
+        else:
+            # Stays refused from memory until the entry expires
+            access_code.current_uses = current.get("current_uses", access_code.current_uses)
+            resolved.exhausted = True
+        return False
+
+    def invalidate(self, code: str):
+        if code in self._entries:
+            self._remove(code)
+
+    def invalidate_playlist(self, playlist_id: str):
+        """Drop resolutions of every code for playlist_id"""
+        for code in list(self._playlist_codes.get(playlist_id, ())):
+            self._remove(code)
+
+    def _remove(self, code: str):
+        entry = self._entries.pop(code)
+        playlist_id = entry.access_code.playlist_id
+        codes = self._playlist_codes.get(playlist_id)
+        if codes is not None:
+            codes.discard(code)
+            if not codes:
+                del self._playlist_codes[playlist_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries)
+        }
+
+# Bulk creation of access codes for resellers
+class AccessCodeMinter:
+    """Insert many access codes in unordered batches against the unique index on ``code``
+
+    Each batch of ``chunk_size`` codes is written with one
+    insert_many(ordered=False); rows rejected as duplicate codes get fresh
+    codes and are retried, up to ``max_retries`` times per batch.
+    """
+    def __init__(self, access_codes, chunk_size: int = 1000, code_length: int = 12, max_retries: int = 5):
+        self.access_codes = access_codes
+        self.chunk_size = chunk_size
+        self.code_length = code_length
+        self.max_retries = max_retries
+        self.stats = {
+            "minted": 0,
+            "batches": 0,
+            "collisions": 0
+        }
+
+    async def mint(self, template: Dict[str, Any], count: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Insert count copies of template with new ids and codes, yielding each batch once stored"""
+        remaining = count
+        while remaining > 0:
+            size = min(self.chunk_size, remaining)
+            docs = [
+                {**template, "id": str(uuid.uuid4()), "code": code}
+                for code in generate_codes(size, self.code_length)
+            ]
+            await self._insert(docs)
+            remaining -= size
+            self.stats["minted"] += size
+            self.stats["batches"] += 1
+            for doc in docs:
+                # Added by the driver on insert
+                doc.pop("_id", None)
+            yield docs
+
+    async def _insert(self, docs: List[Dict[str, Any]]):
+        pending = docs
+        for _ in range(self.max_retries + 1):
+            try:
+                await self.access_codes.insert_many(pending, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+                    raise
+                pending = [pending[error["index"]] for error in errors]
+            self.stats["collisions"] += len(pending)
+            for doc, code in zip(pending, generate_codes(len(pending), self.code_length)):
+                doc.pop("_id", None)
+                doc["code"] = code
+        raise RuntimeError(f"{len(pending)} access codes still collide after {self.max_retries} retries")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark for serializing large list responses (validated models vs the trusted-document path)
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import List
+from fastapi.routing import serialize_response
+from fastapi.responses import JSONResponse
+from fastapi.utils import create_response_field
+from models import IPTVChannel, Playlist, AccessCode
+from pagination import trusted_list_response
+
+def channel_docs(count: int) -> List[dict]:
+    return [
+        {
+            "id": f"3f1c2a9e-{i:04x}-4c2d-9a8b-0123456789ab",
+            "name": f"Channel {i}",
+            "url": f"http://origin.example.com/live/{i}/index.m3u8",
+            "mirror_urls": [f"http://mirror.example.com/live/{i}/index.m3u8"],
+            "logo_url": f"http://cdn.example.com/logos/{i}.png",
+            "category": "sports",
+            "country": "US",
+            "language": "en",
+            "is_active": True,
+            "quality": "HD",
+            "encryption_key": None,
+            "created_by": "7d2e4b1f-2222-4c2d-9a8b-0123456789ab",
+            "created_at": datetime(2024, 1, 1, 12, 0, 0, 123000)
+        }
+        for i in range(count)
+    ]
+
+def playlist_docs(count: int) -> List[dict]:
+    return [
+        {
+            "id": f"9a8b7c6d-{i:04x}-4c2d-9a8b-0123456789ab",
+            "name": f"Playlist {i}",
+            "description": None,
+            "channels": [f"3f1c2a9e-{j:04x}-4c2d-9a8b-0123456789ab" for j in range(20)],
+            "is_public": False,
+            "created_by": "7d2e4b1f-2222-4c2d-9a8b-0123456789ab",
+            "created_at": datetime(2024, 1, 1, 12, 0, 0, 123000),
+            "access_code": None,
+            "expiry_date": None,
+            "version": 1
+        }
+        for i in range(count)
+    ]
+
+def access_code_docs(count: int) -> List[dict]:
+    return [
+        {
+            "id": f"5b6c7d8e-{i:04x}-4c2d-9a8b-0123456789ab",
+            "code": f"CODE{i:08d}",
+            "playlist_id": "9a8b7c6d-0000-4c2d-9a8b-0123456789ab",
+            "created_by": "7d2e4b1f-2222-4c2d-9a8b-0123456789ab",
+            "created_at": datetime(2024, 1, 1, 12, 0, 0, 123000),
+            "expires_at": datetime(2024, 1, 2, 12, 0, 0),
+            "max_uses": None,
+            "current_uses": 3,
+            "is_active": True
+        }
+        for i in range(count)
+    ]
+
+async def validated(model, docs: List[dict]) -> bytes:
+    """What a response_model endpoint returning Model(**doc) instances costs"""
+    field = create_response_field(name="Response", type_=List[model])
+    content = await serialize_response(field=field, response_content=[model(**doc) for doc in docs])
+    return JSONResponse(content).body
+
+def trusted(model, docs: List[dict]) -> bytes:
+    """The same documents through the trusted-document path of the list endpoints"""
+    return trusted_list_response(model, docs).body
+
+def best_of(func, rounds: int) -> float:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main(count: int = 10000, rounds: int = 5):
+    import json
+    loop = asyncio.new_event_loop()
+    for model, docs in ((IPTVChannel, channel_docs(count)), (Playlist, playlist_docs(count)),
+                        (AccessCode, access_code_docs(count))):
+        slow_body = loop.run_until_complete(validated(model, docs))
+        fast_body = trusted(model, docs)
+        assert json.loads(slow_body) == json.loads(fast_body), f"{model.__name__} responses differ"
+
+        slow = best_of(lambda: loop.run_until_complete(validated(model, docs)), rounds)
+        fast = best_of(lambda: trusted(model, docs), rounds)
+        print(f"{model.__name__:<12} {count} items: validated {slow * 1000:8.1f} ms, "
+              f"trusted {fast * 1000:8.1f} ms ({slow / fast:.1f}x)")
+    loop.close()
+
+if __name__ == "__main__":
+    main()
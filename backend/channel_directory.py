@@ -0,0 +1,208 @@
+from typing import Dict, Any, Optional, List, Set, FrozenSet, Iterable
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import time
+from source_health import SourceSelector
+
+logger = logging.getLogger(__name__)
+
+# Kinds of documents recorded in the deletions collection
+DELETED_CHANNEL = "channel"
+DELETED_PLAYLIST = "playlist"
+
+def stamp(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """doc marked as changed now, for the incremental refresh of every worker's directory"""
+    return {**doc, "updated_at": datetime.utcnow()}
+
+# In-memory view of channels and playlists consulted on every proxied request
+class ChannelDirectory:
+    """Active channel URLs and playlist membership, mirrored from the database
+
+    Lookups are plain dict reads. The view is loaded whole at startup and
+    every ``full_reload_interval`` seconds; in between, every
+    ``refresh_interval`` seconds, it only reads the channels and playlists
+    whose ``updated_at`` moved (set with ``stamp`` on every write) and the
+    ids recorded in ``deletions`` since the previous refresh. This worker's
+    own writes are also patched in place at once. With ``sources``, the
+    mirror set of every channel is kept registered there too; a channel's
+    recent source health survives refreshes that leave its URLs unchanged.
+    """
+    # Each refresh re-reads changes this far before the last one, covering
+    # clock skew between workers and writes still in flight at that time
+    REFRESH_OVERLAP = 30.0
+
+    def __init__(self, channels, playlists, refresh_interval: float = 60.0,
+                 sources: Optional[SourceSelector] = None, deletions=None,
+                 full_reload_interval: float = 3600.0):
+        self.channels = channels
+        self.playlists = playlists
+        self.deletions = deletions
+        self.refresh_interval = refresh_interval
+        self.full_reload_interval = full_reload_interval
+        self.sources = sources
+        # channel id -> primary URL followed by mirrors
+        self._channel_urls: Dict[str, List[str]] = {}
+        # upstream URL -> ids of the channels streaming it
+        self._url_channels: Dict[str, Set[str]] = {}
+        self._playlist_channels: Dict[str, FrozenSet[str]] = {}
+        # Database time the view is known to be current as of
+        self._synced_at: Optional[datetime] = None
+        self._reloaded_at = 0.0
+        self._refresher: Optional[asyncio.Task] = None
+        self.stats = {
+            "reloads": 0,
+            "refreshes": 0,
+            "documents_refreshed": 0,
+            "reload_errors": 0,
+            "last_reload_ms": 0.0,
+            "last_refresh_ms": 0.0
+        }
+
+    async def start(self):
+        """Load the directory and start the periodic refresh"""
+        await self.reload()
+        if self._refresher is None and self.refresh_interval > 0:
+            self._refresher = asyncio.create_task(self._reload_periodically())
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+    async def reload(self):
+        """Replace the directory with the current database contents"""
+        started = time.monotonic()
+        synced_at = datetime.utcnow()
+        channel_urls: Dict[str, List[str]] = {}
+        url_channels: Dict[str, Set[str]] = {}
+        async for doc in self.channels.find(
+            {"is_active": True},
+            {"_id": 0, "id": 1, "url": 1, "mirror_urls": 1}
+        ):
+            urls = channel_urls[doc["id"]] = [doc["url"]] + doc.get("mirror_urls", [])
+            for url in urls:
+                url_channels.setdefault(url, set()).add(doc["id"])
+
+        playlist_channels = {}
+        async for doc in self.playlists.find({}, {"_id": 0, "id": 1, "channels": 1}):
+            playlist_channels[doc["id"]] = frozenset(doc.get("channels", ()))
+
+        if self.sources is not None:
+            for channel_id, urls in channel_urls.items():
+                if self._channel_urls.get(channel_id) != urls:
+                    self.sources.register_channel(channel_id, urls)
+            for channel_id in self._channel_urls.keys() - channel_urls.keys():
+                self.sources.unregister_channel(channel_id)
+
+        # Writes applied while the reload was reading are caught by the next refresh
+        self._channel_urls = channel_urls
+        self._url_channels = url_channels
+        self._playlist_channels = playlist_channels
+        self._synced_at = synced_at
+        self._reloaded_at = time.monotonic()
+        self.stats["reloads"] += 1
+        self.stats["last_reload_ms"] = round((self._reloaded_at - started) * 1000, 2)
+
+    async def refresh(self):
+        """Apply the channel and playlist writes and deletions made since the last load or refresh"""
+        if self._synced_at is None:
+            await self.reload()
+            return
+        started = time.monotonic()
+        synced_at = datetime.utcnow()
+        changed = {"updated_at": {"$gte": self._synced_at - timedelta(seconds=self.REFRESH_OVERLAP)}}
+        count = 0
+        async for doc in self.channels.find(changed, {"_id": 0, "id": 1, "url": 1, "mirror_urls": 1, "is_active": 1}):
+            count += 1
+            if not doc.get("is_active", True):
+                self.remove_channel(doc["id"])
+                continue
+            urls = [doc["url"]] + doc.get("mirror_urls", [])
+            if self._channel_urls.get(doc["id"]) != urls:
+                self.put_channel(doc["id"], urls[0], urls[1:])
+        async for doc in self.playlists.find(changed, {"_id": 0, "id": 1, "channels": 1}):
+            count += 1
+            self.put_playlist(doc["id"], doc.get("channels", ()))
+        if self.deletions is not None:
+            since = {"deleted_at": changed["updated_at"]}
+            async for doc in self.deletions.find(since, {"_id": 0, "kind": 1, "id": 1}):
+                count += 1
+                if doc["kind"] == DELETED_CHANNEL:
+                    self.remove_channel(doc["id"])
+                elif doc["kind"] == DELETED_PLAYLIST:
+                    self.remove_playlist(doc["id"])
+
+        self._synced_at = synced_at
+        self.stats["refreshes"] += 1
+        self.stats["documents_refreshed"] += count
+        self.stats["last_refresh_ms"] = round((time.monotonic() - started) * 1000, 2)
+
+    async def record_deletions(self, kind: str, ids: List[str]):
+        """Drop deleted channels or playlists here and tell the other workers' refreshes about them"""
+        for doc_id in ids:
+            if kind == DELETED_CHANNEL:
+                self.remove_channel(doc_id)
+            else:
+                self.remove_playlist(doc_id)
+        if self.deletions is not None and ids:
+            deleted_at = datetime.utcnow()
+            await self.deletions.insert_many([{"kind": kind, "id": doc_id, "deleted_at": deleted_at} for doc_id in ids])
+
+    async def _reload_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                # Documents written without a stamp are only picked up by a full reload
+                if self.full_reload_interval > 0 and time.monotonic() - self._reloaded_at >= self.full_reload_interval:
+                    await self.reload()
+                else:
+                    await self.refresh()
+            except Exception as e:
+                self.stats["reload_errors"] += 1
+                logger.warning(f"Channel directory refresh failed: {e}")
+
+    def put_channel(self, channel_id: str, url: str, mirror_urls: Iterable[str] = ()):
+        self.remove_channel(channel_id)
+        urls = self._channel_urls[channel_id] = [url] + list(mirror_urls)
+        for channel_url in urls:
+            self._url_channels.setdefault(channel_url, set()).add(channel_id)
+        if self.sources is not None:
+            self.sources.register_channel(channel_id, urls)
+
+    def remove_channel(self, channel_id: str):
+        if self.sources is not None:
+            self.sources.unregister_channel(channel_id)
+        for url in self._channel_urls.pop(channel_id, ()):
+            channel_ids = self._url_channels.get(url)
+            if channel_ids is not None:
+                channel_ids.discard(channel_id)
+                if not channel_ids:
+                    del self._url_channels[url]
+
+    def put_playlist(self, playlist_id: str, channel_ids: Iterable[str]):
+        self._playlist_channels[playlist_id] = frozenset(channel_ids)
+
+    def remove_playlist(self, playlist_id: str):
+        self._playlist_channels.pop(playlist_id, None)
+
+    def channel_url(self, channel_id: str) -> Optional[str]:
+        """Primary upstream URL of an active channel"""
+        urls = self._channel_urls.get(channel_id)
+        return urls[0] if urls else None
+
+    def channels_for_url(self, url: str) -> Set[str]:
+        """Active channels streaming url as their primary or a mirror"""
+        return self._url_channels.get(url, set())
+
+    def in_playlist(self, playlist_id: str, channel_id: str) -> bool:
+        """Whether channel_id is an active member of playlist_id"""
+        return channel_id in self._channel_urls and channel_id in self._playlist_channels.get(playlist_id, ())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "channels": len(self._channel_urls),
+            "urls": len(self._url_channels),
+            "playlists": len(self._playlist_channels)
+        }
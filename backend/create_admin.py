@@ -101,6 +101,7 @@ async def create_admin_user():
     ]
     
     from models import IPTVChannel, ChannelCategory
+    from channel_directory import stamp
     for channel_data in demo_channels:
         existing_channel = await db.channels.find_one({"name": channel_data["name"]})
         if not existing_channel:
@@ -113,7 +114,7 @@ async def create_admin_user():
                 quality=channel_data["quality"],
                 created_by=channel_data["created_by"]
             )
-            await db.channels.insert_one(channel.dict())
+            await db.channels.insert_one(stamp(channel.dict()))
             print(f"✅ Demo channel '{channel_data['name']}' created!")
     
     client.close()
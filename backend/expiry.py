@@ -0,0 +1,162 @@
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import time
+from pymongo.errors import BulkWriteError
+from access_codes import AccessCodeResolver, DUPLICATE_KEY_ERROR
+from channel_directory import ChannelDirectory, DELETED_PLAYLIST
+from playlist_cache import PlaylistCache
+
+logger = logging.getLogger(__name__)
+
+# Background cleanup of expired access codes and playlists
+class ExpirySweeper:
+    """Deactivate, archive and delete expired access codes and playlists in small batches
+
+    Expired codes are deactivated at once. Codes and playlists that have
+    been expired for longer than their grace period are copied to the
+    archive collections (when given) and then deleted. Each pass touches
+    at most ``max_batches`` batches of ``batch_size`` documents per step,
+    pausing ``batch_pause`` seconds between batches, so cleanup never
+    competes with serving traffic; whatever is left waits for the next
+    pass. Caches of this worker are invalidated for every document touched.
+    """
+    def __init__(self, access_codes, playlists, access_codes_archive=None, playlists_archive=None,
+                 interval: float = 300.0, code_grace: float = 7 * 86400, playlist_grace: float = 7 * 86400,
+                 batch_size: int = 500, max_batches: int = 20, batch_pause: float = 0.1,
+                 access_code_resolver: Optional[AccessCodeResolver] = None,
+                 playlist_cache: Optional[PlaylistCache] = None,
+                 channel_directory: Optional[ChannelDirectory] = None):
+        self.access_codes = access_codes
+        self.playlists = playlists
+        self.access_codes_archive = access_codes_archive
+        self.playlists_archive = playlists_archive
+        self.interval = interval
+        self.code_grace = code_grace
+        self.playlist_grace = playlist_grace
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.batch_pause = batch_pause
+        self.access_code_resolver = access_code_resolver
+        self.playlist_cache = playlist_cache
+        self.channel_directory = channel_directory
+        self._sweeper: Optional[asyncio.Task] = None
+        self.stats = {
+            "sweeps": 0,
+            "sweep_errors": 0,
+            "codes_deactivated": 0,
+            "codes_deleted": 0,
+            "playlists_deleted": 0,
+            "documents_archived": 0,
+            "last_sweep_ms": 0.0
+        }
+
+    async def start(self):
+        """Start the periodic sweep"""
+        if self._sweeper is None and self.interval > 0:
+            self._sweeper = asyncio.create_task(self._sweep_periodically())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def sweep(self) -> Dict[str, int]:
+        """One pass over both collections; documents handled per step"""
+        started = time.monotonic()
+        now = datetime.utcnow()
+        result = {
+            "codes_deactivated": await self._deactivate_codes(now),
+            "codes_deleted": await self._purge(
+                self.access_codes, self.access_codes_archive,
+                {"expires_at": {"$lt": now - timedelta(seconds=self.code_grace)}},
+                self._forget_codes
+            ),
+            "playlists_deleted": await self._purge(
+                self.playlists, self.playlists_archive,
+                {"expiry_date": {"$lt": now - timedelta(seconds=self.playlist_grace)}},
+                self._forget_playlists
+            )
+        }
+        for name, count in result.items():
+            self.stats[name] += count
+        self.stats["sweeps"] += 1
+        self.stats["last_sweep_ms"] = round((time.monotonic() - started) * 1000, 2)
+        return result
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                self.stats["sweep_errors"] += 1
+                logger.warning(f"Expiry sweep failed: {e}")
+
+    async def _batches(self, collection, query: Dict[str, Any], projection: Optional[Dict[str, int]] = None):
+        """Up to max_batches batches of matching documents, re-queried after each one is handled"""
+        for batch_number in range(self.max_batches):
+            if batch_number:
+                await asyncio.sleep(self.batch_pause)
+            docs = await collection.find(query, projection).limit(self.batch_size).to_list(self.batch_size)
+            if not docs:
+                return
+            yield docs
+            if len(docs) < self.batch_size:
+                return
+
+    async def _deactivate_codes(self, now: datetime) -> int:
+        query = {"is_active": True, "expires_at": {"$lt": now}}
+        count = 0
+        async for docs in self._batches(self.access_codes, query, {"_id": 0, "id": 1, "code": 1}):
+            await self.access_codes.update_many(
+                {"id": {"$in": [doc["id"] for doc in docs]}, **query},
+                {"$set": {"is_active": False}}
+            )
+            await self._forget_codes(docs)
+            count += len(docs)
+        return count
+
+    async def _purge(self, collection, archive, query: Dict[str, Any],
+                     forget: Callable[[List[Dict[str, Any]]], Awaitable[None]]) -> int:
+        count = 0
+        async for docs in self._batches(collection, query):
+            if archive is not None:
+                await self._archive(archive, docs)
+            await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+            await forget(docs)
+            count += len(docs)
+        return count
+
+    async def _archive(self, archive, docs: List[Dict[str, Any]]):
+        archived_at = datetime.utcnow()
+        try:
+            # Original _id kept, so a batch archived before a failed delete is not copied twice
+            await archive.insert_many([{**doc, "archived_at": archived_at} for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+        self.stats["documents_archived"] += len(docs)
+
+    async def _forget_codes(self, docs: List[Dict[str, Any]]):
+        if self.access_code_resolver is not None:
+            for doc in docs:
+                self.access_code_resolver.invalidate(doc["code"])
+
+    async def _forget_playlists(self, docs: List[Dict[str, Any]]):
+        for doc in docs:
+            if self.playlist_cache is not None:
+                self.playlist_cache.invalidate_playlist(doc["id"])
+            if self.access_code_resolver is not None:
+                self.access_code_resolver.invalidate_playlist(doc["id"])
+        if self.channel_directory is not None:
+            await self.channel_directory.record_deletions(DELETED_PLAYLIST, [doc["id"] for doc in docs])
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "interval": self.interval,
+            "code_grace": self.code_grace,
+            "playlist_grace": self.playlist_grace
+        }
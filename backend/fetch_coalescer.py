@@ -0,0 +1,240 @@
+from typing import Dict, Any, Optional, List, Callable, Awaitable
+import asyncio
+
+class InflightFetch:
+    """One upstream fetch whose body is fanned out to every attached viewer"""
+    def __init__(self, url: str, max_buffer_bytes: int):
+        self.url = url
+        self.max_buffer_bytes = max_buffer_bytes
+        self.media_type = "video/mp2t"
+        self.headers: Dict[str, str] = {}
+        self.content_length: Optional[int] = None
+        # retain_all: every chunk is kept so joiners can replay from byte 0
+        # live: unbounded body kept as a sliding window; joiners start at its head
+        # neither: large finite body, trimmed as the slowest viewer consumes it
+        self.retain_all = True
+        self.live = False
+        self.joinable = True
+        self.chunks: List[bytes] = []
+        self.base_index = 0
+        self.buffered = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.task: Optional[asyncio.Task] = None
+        self._headers_ready = asyncio.get_running_loop().create_future()
+        self._positions: Dict[int, int] = {}
+        self._next_subscriber = 0
+        self._data_event = asyncio.Event()
+        self._drain_event = asyncio.Event()
+        self._on_detach: Optional[Callable[["InflightFetch"], None]] = None
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._positions)
+
+    @property
+    def has_headers(self) -> bool:
+        return self._headers_ready.done()
+
+    # Producer side
+
+    def set_headers(self, media_type: str, headers: Dict[str, str], content_length: Optional[int]):
+        """Publish upstream headers to waiters and pick the buffering mode"""
+        self.media_type = media_type
+        self.headers = headers
+        self.content_length = content_length
+        if content_length is not None and content_length > self.max_buffer_bytes:
+            # Too large to replay for late joiners; current viewers still share it
+            self.retain_all = False
+            self._detach()
+        if not self._headers_ready.done():
+            self._headers_ready.set_result(None)
+
+    async def append(self, chunk: bytes):
+        """Publish a body chunk, applying backpressure or windowing as needed"""
+        self.chunks.append(chunk)
+        self.buffered += len(chunk)
+
+        if self.retain_all and self.buffered > self.max_buffer_bytes:
+            # Body of unknown length outgrew the replay buffer: treat as live
+            self.retain_all = False
+            self.live = True
+
+        if self.live:
+            # Drop the oldest chunks; lagging viewers skip ahead to the window
+            drop = 0
+            while self.buffered > self.max_buffer_bytes and drop < len(self.chunks) - 1:
+                self.buffered -= len(self.chunks[drop])
+                drop += 1
+            if drop:
+                del self.chunks[:drop]
+                self.base_index += drop
+
+        self._notify()
+
+        if not self.retain_all and not self.live:
+            # Wait for the slowest viewer rather than buffer a whole VOD file
+            while self.buffered > self.max_buffer_bytes and self._positions:
+                self._drain_event.clear()
+                await self._drain_event.wait()
+
+    def finish(self, error: Optional[Exception] = None):
+        """Mark the fetch complete; an error is re-raised in every viewer"""
+        self.done = True
+        self.error = error
+        if not self._headers_ready.done():
+            if error is not None:
+                self._headers_ready.set_exception(error)
+            else:
+                self._headers_ready.set_result(None)
+        self._detach()
+        self._notify()
+
+    def body(self) -> bytes:
+        """Complete body of a finished retain-all fetch"""
+        return b"".join(self.chunks)
+
+    # Consumer side
+
+    def subscribe(self) -> int:
+        subscriber_id = self._next_subscriber
+        self._next_subscriber += 1
+        self._positions[subscriber_id] = self.base_index
+        return subscriber_id
+
+    def unsubscribe(self, subscriber_id: int):
+        if self._positions.pop(subscriber_id, None) is None:
+            return
+        if not self._positions and not self.done:
+            # Last viewer left: stop pulling from the upstream
+            self._detach()
+            if self.task is not None:
+                self.task.cancel()
+        else:
+            self._trim_consumed()
+
+    async def wait_headers(self):
+        # Shielded so one cancelled viewer does not fail the shared future
+        await asyncio.shield(self._headers_ready)
+
+    async def next_chunk(self, subscriber_id: int) -> Optional[bytes]:
+        """Next chunk for a viewer, or None at end of body"""
+        while True:
+            position = max(self._positions[subscriber_id], self.base_index)
+            if position < self.base_index + len(self.chunks):
+                self._positions[subscriber_id] = position + 1
+                chunk = self.chunks[position - self.base_index]
+                if not self.retain_all and not self.live:
+                    self._trim_consumed()
+                return chunk
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return None
+            await self._data_event.wait()
+
+    def _trim_consumed(self):
+        if self.retain_all or self.live or not self._positions:
+            return
+        drop = min(self._positions.values()) - self.base_index
+        if drop > 0:
+            for chunk in self.chunks[:drop]:
+                self.buffered -= len(chunk)
+            del self.chunks[:drop]
+            self.base_index += drop
+            self._drain_event.set()
+
+    def _notify(self):
+        event = self._data_event
+        self._data_event = asyncio.Event()
+        event.set()
+
+    def _detach(self):
+        self.joinable = False
+        if self._on_detach is not None:
+            on_detach, self._on_detach = self._on_detach, None
+            on_detach(self)
+
+class Subscription:
+    """Async iterator over a shared fetch for one viewer"""
+    def __init__(self, inflight: InflightFetch):
+        self.inflight = inflight
+        self.subscriber_id = inflight.subscribe()
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        if self._closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self.inflight.next_chunk(self.subscriber_id)
+        except BaseException:
+            self.close()
+            raise
+        if chunk is None:
+            self.close()
+            raise StopAsyncIteration
+        return chunk
+
+    async def aclose(self):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.inflight.unsubscribe(self.subscriber_id)
+
+    def __del__(self):
+        # A response cancelled before it started iterating never reaches
+        # aclose(); release the slot so the shared fetch can stop
+        self.close()
+
+# Single-flight registry for upstream fetches
+class FetchCoalescer:
+    """Share one in-flight upstream fetch between concurrent requests for a URL"""
+    def __init__(self, max_buffer_bytes: int = 8 * 1024 * 1024):
+        self.max_buffer_bytes = max_buffer_bytes
+        self._inflight: Dict[str, InflightFetch] = {}
+        self.stats = {
+            "fetches": 0,
+            "joins": 0
+        }
+
+    def join(self, url: str, fetch: Callable[[InflightFetch], Awaitable[None]]) -> Subscription:
+        """Attach to the running fetch for url, starting one if none is joinable"""
+        inflight = self._inflight.get(url)
+        if inflight is not None and inflight.joinable:
+            self.stats["joins"] += 1
+            return Subscription(inflight)
+
+        inflight = InflightFetch(url, self.max_buffer_bytes)
+        inflight._on_detach = self._forget
+        self._inflight[url] = inflight
+        self.stats["fetches"] += 1
+        subscription = Subscription(inflight)
+        inflight.task = asyncio.create_task(self._run(inflight, fetch))
+        return subscription
+
+    async def _run(self, inflight: InflightFetch, fetch: Callable[[InflightFetch], Awaitable[None]]):
+        try:
+            await fetch(inflight)
+        except asyncio.CancelledError:
+            inflight.finish(ConnectionAbortedError("Upstream fetch cancelled"))
+        except Exception as e:
+            inflight.finish(e)
+        else:
+            inflight.finish()
+
+    def _forget(self, inflight: InflightFetch):
+        if self._inflight.get(inflight.url) is inflight:
+            del self._inflight[inflight.url]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Fetch/join counters and current in-flight fetches"""
+        return {
+            **self.stats,
+            "inflight": len(self._inflight),
+            "subscribers": sum(inflight.subscribers for inflight in self._inflight.values())
+        }
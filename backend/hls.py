@@ -0,0 +1,192 @@
+from typing import Dict, Any, Optional, List
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+import base64
+import re
+import time
+
+HLS_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+HLS_MEDIA_TYPES = (
+    "application/vnd.apple.mpegurl",
+    "application/x-mpegurl",
+    "audio/mpegurl",
+    "audio/x-mpegurl"
+)
+
+# Tags whose URI="..." attribute points at another proxied resource
+URI_ATTRIBUTE = re.compile(r'URI="([^"]*)"')
+
+def is_hls_manifest(media_type: str, url: str) -> bool:
+    """Whether an upstream response is an HLS playlist"""
+    media_type = media_type.split(";", 1)[0].strip().lower()
+    if media_type in HLS_MEDIA_TYPES:
+        return True
+    # Many origins serve playlists as text/plain or octet-stream
+    path = urlsplit(url).path.lower()
+    return path.endswith((".m3u8", ".m3u")) and media_type in ("", "text/plain", "application/octet-stream")
+
+def encode_upstream_url(url: str) -> str:
+    """URL-safe path segment carrying an upstream URL"""
+    return base64.urlsafe_b64encode(url.encode()).decode()
+
+def decode_upstream_url(encoded_url: str) -> str:
+    """Inverse of encode_upstream_url; also accepts standard base64"""
+    return base64.urlsafe_b64decode(encoded_url).decode()
+
+class HLSManifest:
+    """Parsed HLS playlist with every URI rewritten to a proxy path"""
+    def __init__(self, parts: List[str], target_duration: Optional[float], is_master: bool,
+                 is_endlist: bool, segment_urls: List[str], uris: Optional[List[str]] = None):
+        # Even indices are literal text, odd indices are encoded upstream URLs
+        self.parts = parts
+        self.target_duration = target_duration
+        self.is_master = is_master
+        self.is_endlist = is_endlist
+        self.segment_urls = segment_urls
+        # Every rewritten URI (variants, segments, keys, maps) as an absolute URL
+        self.uris = uris or []
+
+    @classmethod
+    def parse(cls, text: str, base_url: str) -> "HLSManifest":
+        """Rewrite variant, segment, key and map URIs relative to base_url"""
+        parts: List[str] = []
+        literal: List[str] = []
+        target_duration = None
+        is_master = False
+        is_endlist = False
+        segment_urls: List[str] = []
+        uris: List[str] = []
+
+        def emit_uri(uri: str) -> bool:
+            absolute = urljoin(base_url, uri.strip())
+            if urlsplit(absolute).scheme not in ("http", "https"):
+                return False
+            parts.append("".join(literal))
+            literal.clear()
+            parts.append(encode_upstream_url(absolute))
+            uris.append(absolute)
+            return True
+
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                literal.append("\n")
+                continue
+
+            if stripped.startswith("#"):
+                if stripped.startswith("#EXT-X-TARGETDURATION:"):
+                    try:
+                        target_duration = float(stripped.split(":", 1)[1])
+                    except ValueError:
+                        pass
+                elif stripped.startswith("#EXT-X-STREAM-INF"):
+                    is_master = True
+                elif stripped.startswith("#EXT-X-ENDLIST"):
+                    is_endlist = True
+
+                # Keys, init maps, alternate renditions, I-frame playlists...
+                position = 0
+                for match in URI_ATTRIBUTE.finditer(stripped):
+                    literal.append(stripped[position:match.start(1)])
+                    if not emit_uri(match.group(1)):
+                        literal.append(match.group(1))
+                    position = match.end(1)
+                literal.append(stripped[position:] + "\n")
+                continue
+
+            # Bare URI line: a variant playlist in a master, a segment otherwise
+            if emit_uri(stripped):
+                if not is_master:
+                    segment_urls.append(urljoin(base_url, stripped))
+                literal.append("\n")
+            else:
+                literal.append(stripped + "\n")
+
+        parts.append("".join(literal))
+        return cls(parts, target_duration, is_master, is_endlist, segment_urls, uris)
+
+    def render(self, prefix: str = "", signatures: Optional[List[str]] = None) -> str:
+        """Manifest text; URIs are emitted as prefix + encoded upstream URL, behind their signature when given"""
+        if signatures is None:
+            return "".join(
+                part if index % 2 == 0 else prefix + part
+                for index, part in enumerate(self.parts)
+            )
+        return "".join(
+            part if index % 2 == 0 else f"{prefix}{signatures[index // 2]}/{part}"
+            for index, part in enumerate(self.parts)
+        )
+
+class CachedManifest:
+    __slots__ = ("manifest", "body", "expires_at", "signatures")
+
+    def __init__(self, manifest: HLSManifest, body: bytes, expires_at: float):
+        self.manifest = manifest
+        self.body = body
+        self.expires_at = expires_at
+        # Channel id -> signatures of manifest.uris, computed once per copy
+        self.signatures: Dict[str, List[str]] = {}
+
+# Rewritten manifest cache shared by every viewer of a channel
+class ManifestCache:
+    """LRU cache of rewritten manifests, each kept for half its target duration"""
+    def __init__(self, max_entries: int = 10000, master_ttl: float = 30.0,
+                 endlist_ttl: float = 300.0, min_ttl: float = 1.0):
+        self.max_entries = max_entries
+        self.master_ttl = master_ttl
+        self.endlist_ttl = endlist_ttl
+        self.min_ttl = min_ttl
+        self._entries: "OrderedDict[str, CachedManifest]" = OrderedDict()
+        # Every lookup goes through here before the segment cache, so only
+        # hits and (re)fetches are counted
+        self.stats = {
+            "hits": 0,
+            "stores": 0,
+            "evictions": 0
+        }
+
+    def ttl_for(self, manifest: HLSManifest) -> float:
+        if manifest.is_master:
+            return self.master_ttl
+        if manifest.is_endlist:
+            return self.endlist_ttl
+        if manifest.target_duration:
+            # A live playlist changes at most once per target duration
+            return max(self.min_ttl, manifest.target_duration / 2)
+        return self.min_ttl
+
+    def get(self, url: str) -> Optional[CachedManifest]:
+        entry = self._entries.get(url)
+        if entry is None or entry.expires_at <= time.monotonic():
+            if entry is not None:
+                del self._entries[url]
+            return None
+        self._entries.move_to_end(url)
+        self.stats["hits"] += 1
+        return entry
+
+    def peek(self, url: str) -> Optional[CachedManifest]:
+        """Entry for url without touching LRU order or stats"""
+        return self._entries.get(url)
+
+    def put(self, url: str, manifest: HLSManifest) -> CachedManifest:
+        entry = CachedManifest(
+            manifest,
+            manifest.render().encode(),
+            time.monotonic() + self.ttl_for(manifest)
+        )
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+        self.stats["stores"] += 1
+        return entry
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["stores"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries)
+        }
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Index registry for Secure IPTV, and a query plan audit of the hot queries
+
+Run directly to ensure the indexes and audit the query plans; exits with
+status 1 when a hot query would scan a whole collection.
+"""
+from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime
+import asyncio
+import logging
+import os
+import sys
+from pymongo.errors import OperationFailure
+from pagination import KEYSET_SORT
+
+logger = logging.getLogger(__name__)
+
+IndexKeys = List[Tuple[str, int]]
+
+class IndexSpec:
+    __slots__ = ("collection", "keys", "options")
+
+    def __init__(self, collection: str, keys: IndexKeys, **options: Any):
+        self.collection = collection
+        self.keys = keys
+        self.options = options
+
+class QueryProbe:
+    __slots__ = ("name", "collection", "filter", "sort")
+
+    def __init__(self, name: str, collection: str, filter: Dict[str, Any], sort: Optional[IndexKeys] = None):
+        self.name = name
+        self.collection = collection
+        self.filter = filter
+        self.sort = sort
+
+def _keyset(*fields: str) -> IndexKeys:
+    """List filter fields followed by the keyset sort"""
+    return [(field, 1) for field in fields] + KEYSET_SORT
+
+# Every index the service relies on; ensured idempotently at startup
+INDEXES: List[IndexSpec] = [
+    IndexSpec("users", [("id", 1)], unique=True),
+    IndexSpec("users", [("username", 1)], unique=True),
+    IndexSpec("users", [("email", 1)], unique=True),
+    IndexSpec("users", _keyset()),
+
+    IndexSpec("channels", [("id", 1)], unique=True),
+    IndexSpec("channels", _keyset("is_active")),
+    IndexSpec("channels", _keyset("is_active", "category")),
+    IndexSpec("channels", _keyset("is_active", "country")),
+    IndexSpec("channels", _keyset("is_active", "category", "country")),
+    IndexSpec("channels", [("updated_at", 1)]),
+
+    IndexSpec("playlists", [("id", 1)], unique=True),
+    IndexSpec("playlists", _keyset()),
+    IndexSpec("playlists", _keyset("created_by")),
+    IndexSpec("playlists", [("expiry_date", 1)]),
+    IndexSpec("playlists", [("channels", 1)]),
+    IndexSpec("playlists", [("updated_at", 1)]),
+
+    # Read by every worker's directory refresh; a worker away for longer reloads in full
+    IndexSpec("directory_deletions", [("deleted_at", 1)], expireAfterSeconds=86400),
+
+    IndexSpec("access_codes", [("id", 1)], unique=True),
+    # Bulk minting relies on it to reject duplicate codes
+    IndexSpec("access_codes", [("code", 1)], unique=True),
+    IndexSpec("access_codes", _keyset()),
+    IndexSpec("access_codes", _keyset("created_by")),
+    IndexSpec("access_codes", [("is_active", 1), ("expires_at", 1)]),
+    IndexSpec("access_codes", [("expires_at", 1)]),
+
+    IndexSpec("usage", [("scope", 1), ("key", 1), ("hour", 1)], unique=True)
+]
+
+_SAMPLE_ID = "00000000-0000-0000-0000-000000000000"
+_SAMPLE_TIME = datetime(2000, 1, 1)
+
+# Representative shapes of the queries made per request by server.py and auth.py
+HOT_QUERIES: List[QueryProbe] = [
+    QueryProbe("current user", "users", {"id": _SAMPLE_ID}),
+    QueryProbe("login", "users", {"username": "admin"}),
+    QueryProbe("register", "users", {"$or": [{"username": "admin"}, {"email": "admin@example.com"}]}),
+    QueryProbe("list users", "users", {}, KEYSET_SORT),
+
+    QueryProbe("channel by id", "channels", {"id": _SAMPLE_ID, "is_active": True}),
+    QueryProbe("list channels", "channels", {"is_active": True}, KEYSET_SORT),
+    QueryProbe("list channels by category", "channels", {"is_active": True, "category": "news"}, KEYSET_SORT),
+    QueryProbe("list channels by country", "channels", {"is_active": True, "country": "US"}, KEYSET_SORT),
+    QueryProbe("list channels by category and country", "channels",
+               {"is_active": True, "category": "news", "country": "US"}, KEYSET_SORT),
+    QueryProbe("playlist channels", "channels", {"id": {"$in": [_SAMPLE_ID]}, "is_active": True}),
+    QueryProbe("changed channels", "channels", {"updated_at": {"$gte": _SAMPLE_TIME}}),
+
+    QueryProbe("playlist by id", "playlists", {"id": _SAMPLE_ID}),
+    QueryProbe("list playlists", "playlists", {}, KEYSET_SORT),
+    QueryProbe("list own playlists", "playlists", {"created_by": _SAMPLE_ID}, KEYSET_SORT),
+    QueryProbe("expired playlists", "playlists", {"expiry_date": {"$lt": _SAMPLE_TIME}}),
+    QueryProbe("playlists containing channel", "playlists", {"channels": _SAMPLE_ID}),
+    QueryProbe("changed playlists", "playlists", {"updated_at": {"$gte": _SAMPLE_TIME}}),
+    QueryProbe("directory deletions", "directory_deletions", {"deleted_at": {"$gte": _SAMPLE_TIME}}),
+
+    QueryProbe("resolve access code", "access_codes", {"code": "SAMPLE", "is_active": True}),
+    QueryProbe("count access code use", "access_codes", {"id": _SAMPLE_ID, "is_active": True}),
+    QueryProbe("list access codes", "access_codes", {}, KEYSET_SORT),
+    QueryProbe("list own access codes", "access_codes", {"created_by": _SAMPLE_ID}, KEYSET_SORT),
+    QueryProbe("expired access codes", "access_codes", {"is_active": True, "expires_at": {"$lt": _SAMPLE_TIME}}),
+    QueryProbe("purgeable access codes", "access_codes", {"expires_at": {"$lt": _SAMPLE_TIME}}),
+
+    QueryProbe("usage report", "usage", {"scope": "user", "hour": {"$gte": _SAMPLE_TIME}})
+]
+
+async def ensure_indexes(db, specs: List[IndexSpec] = INDEXES) -> Dict[str, Any]:
+    """Create every index in specs; existing ones are left alone, failures are logged and reported"""
+    created = []
+    failed = []
+    for spec in specs:
+        try:
+            created.append(await db[spec.collection].create_index(spec.keys, **spec.options))
+        except OperationFailure as e:
+            # Conflicting options or duplicate values for a unique index; the rest still get created
+            logger.warning(f"Index {spec.keys} on {spec.collection} not created: {e}")
+            failed.append({"collection": spec.collection, "keys": spec.keys, "error": str(e)})
+    return {"indexes": created, "failed": failed}
+
+def _plan_nodes(plan: Dict[str, Any]):
+    pending = [plan]
+    while pending:
+        node = pending.pop(0)
+        yield node
+        for key in ("inputStage", "queryPlan"):
+            if isinstance(node.get(key), dict):
+                pending.append(node[key])
+        pending.extend(node.get("inputStages", ()))
+
+def plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """Stages of a winning plan, outermost first"""
+    return [node["stage"] for node in _plan_nodes(plan) if "stage" in node]
+
+def plan_indexes(plan: Dict[str, Any]) -> List[str]:
+    """Names of the indexes a winning plan scans"""
+    return [node["indexName"] for node in _plan_nodes(plan) if "indexName" in node]
+
+async def audit_query_plans(db, probes: List[QueryProbe] = HOT_QUERIES) -> Dict[str, Any]:
+    """explain() every probe and flag the ones planned as a collection scan"""
+    queries = []
+    for probe in probes:
+        cursor = db[probe.collection].find(probe.filter).limit(1)
+        if probe.sort:
+            cursor = cursor.sort(probe.sort)
+        explained = await cursor.explain()
+        plan = explained.get("queryPlanner", {}).get("winningPlan", {})
+        stages = plan_stages(plan)
+        queries.append({
+            "name": probe.name,
+            "collection": probe.collection,
+            "stages": stages,
+            "indexes": plan_indexes(plan),
+            "collscan": "COLLSCAN" in stages
+        })
+    collscans = [query["name"] for query in queries if query["collscan"]]
+    return {"queries": queries, "collscans": collscans}
+
+async def main() -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+
+    ensured = await ensure_indexes(db)
+    print(f"Indexes ensured: {len(ensured['indexes'])}, failed: {len(ensured['failed'])}")
+    for failure in ensured["failed"]:
+        print(f"  {failure['collection']} {failure['keys']}: {failure['error']}")
+
+    audit = await audit_query_plans(db)
+    for query in audit["queries"]:
+        flag = "COLLSCAN" if query["collscan"] else "ok"
+        print(f"{flag:8} {query['collection']:13} {query['name']:40} {' <- '.join(query['stages'])}")
+    client.close()
+    return 1 if audit["collscans"] or ensured["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,107 +1,198 @@
 import secrets
 import string
-from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from urllib.parse import quote
-import base64
-import hashlib
 from models import IPTVChannel, Playlist, AccessCode
 import aiohttp
 import asyncio
+import functools
+import orjson
+import time
+from upstream import UpstreamClient, HostLimiter, UpstreamBusyError
+from stream_cache import SegmentCache, CachedSegment, parse_byte_range
+from fetch_coalescer import FetchCoalescer, InflightFetch
+from segment_store import DiskSegmentStore, DiskSegment
+from source_health import SourceSelector
+from stream_sessions import StreamSessionRegistry
+from stream_tokens import StreamTokenCodec
+from channel_directory import ChannelDirectory
+from hls import HLSManifest, ManifestCache, CachedManifest, HLS_MEDIA_TYPE, is_hls_manifest, encode_upstream_url, decode_upstream_url
 
 class IPTVGenerator:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, upstream: Optional[UpstreamClient] = None,
+                 tokens: Optional[StreamTokenCodec] = None, playlist_tokens: bool = True,
+                 channel_urls: bool = True):
         self.base_url = base_url
+        self.upstream = upstream or UpstreamClient()
+        self.tokens = tokens or StreamTokenCodec()
+        # One playlist-scoped token per export instead of one token per channel
+        self.playlist_tokens = playlist_tokens
+        # Short /stream/c/{token}/{channel_id} URLs instead of embedding the upstream URL
+        self.channel_urls = channel_urls
         
     def generate_access_code(self, length: int = 12) -> str:
         """Generate secure access code"""
         alphabet = string.ascii_uppercase + string.digits
         return ''.join(secrets.choice(alphabet) for _ in range(length))
     
-    def generate_secure_token(self, user_id: str, playlist_id: str, expires_hours: int = 24) -> str:
+    def generate_secure_token(self, user_id: str, playlist_id: str, expires_hours: int = 24,
+                              access_code_id: Optional[str] = None) -> str:
         """Generate secure streaming token"""
-        payload = f"{user_id}:{playlist_id}:{datetime.utcnow().isoformat()}:{expires_hours}"
-        encoded = base64.b64encode(payload.encode()).decode()
-        signature = hashlib.sha256(f"{encoded}:SECRET_STREAM_KEY".encode()).hexdigest()[:16]
-        return f"{encoded}.{signature}"
+        return self.tokens.issue(user_id, playlist_id, expires_in=expires_hours * 3600, access_code_id=access_code_id)
+    
+    def export_token(self, user_id: str, playlist_id: str, access_code_id: Optional[str] = None,
+                     expires_hours: int = 24) -> Optional[str]:
+        """Token shared by every channel of one export, or None when minting per channel"""
+        if not self.playlist_tokens:
+            return None
+        return self.tokens.issue_playlist(user_id, playlist_id, expires_in=expires_hours * 3600,
+                                          access_code_id=access_code_id)
     
     def encrypt_stream_url(self, original_url: str, token: str) -> str:
         """Encrypt and proxy stream URL"""
-        encoded_url = base64.b64encode(original_url.encode()).decode()
+        encoded_url = encode_upstream_url(original_url)
         return f"{self.base_url}/api/stream/proxy/{token}/{quote(encoded_url)}"
     
+    def proxied_channel_url(self, channel: IPTVChannel, token: str) -> str:
+        """Proxy URL of a channel under token"""
+        if self.channel_urls:
+            return f"{self.base_url}/api/stream/c/{token}/{channel.id}"
+        return self.encrypt_stream_url(channel.url, token)
+    
+    def m3u8_header(self) -> str:
+        """Leading #EXTM3U block of a generated playlist"""
+        return (
+            "#EXTM3U\n"
+            "#EXT-X-VERSION:3\n"
+            # No timestamp: exports of an unchanged playlist are byte-identical
+            "#PLAYLIST:Generated by SecureIPTV\n\n"
+        )
+    
+    def m3u8_entry(self, channel: IPTVChannel, user_id: str, secure: bool = True,
+                   access_code_id: Optional[str] = None, token: Optional[str] = None) -> str:
+        """#EXTINF line and stream URL for one channel, under token when one is given"""
+        if secure:
+            if token is None:
+                # Generate secure token for this channel
+                token = self.generate_secure_token(user_id, channel.id, access_code_id=access_code_id)
+            stream_url = self.proxied_channel_url(channel, token)
+        else:
+            stream_url = channel.url
+        
+        attributes = (
+            f'tvg-id="{channel.id}" tvg-name="{channel.name}" tvg-logo="{channel.logo_url or ""}" '
+            f'group-title="{channel.category.value.title()}"'
+        )
+        if channel.country:
+            attributes += f' tvg-country="{channel.country}"'
+        if channel.language:
+            attributes += f' tvg-language="{channel.language}"'
+        
+        return f"#EXTINF:-1 {attributes},{channel.name}\n{stream_url}\n\n"
+    
     async def generate_m3u8_playlist(self, playlist: Playlist, channels: List[IPTVChannel], 
-                                   user_id: str, secure: bool = True) -> str:
+                                   user_id: str, secure: bool = True,
+                                   access_code_id: Optional[str] = None) -> str:
         """Generate M3U8 playlist file"""
-        m3u8_content = "#EXTM3U\n"
-        m3u8_content += "#EXT-X-VERSION:3\n"
-        m3u8_content += f"#PLAYLIST:Generated by SecureIPTV - {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        
-        for channel in channels:
-            if channel.id in playlist.channels:
-                # Generate secure token for this channel
-                token = self.generate_secure_token(user_id, channel.id) if secure else ""
-                
-                # Encrypt URL if security enabled
-                stream_url = self.encrypt_stream_url(channel.url, token) if secure else channel.url
-                
-                # Add channel info
-                m3u8_content += f"#EXTINF:-1 "
-                m3u8_content += f'tvg-id="{channel.id}" '
-                m3u8_content += f'tvg-name="{channel.name}" '
-                m3u8_content += f'tvg-logo="{channel.logo_url or ""}" '
-                m3u8_content += f'group-title="{channel.category.value.title()}"'
-                
-                if channel.country:
-                    m3u8_content += f' tvg-country="{channel.country}"'
-                if channel.language:
-                    m3u8_content += f' tvg-language="{channel.language}"'
-                
-                m3u8_content += f",{channel.name}\n"
-                m3u8_content += f"{stream_url}\n\n"
+        member_ids = set(playlist.channels)
+        token = self.export_token(user_id, playlist.id, access_code_id) if secure else None
+        parts = [self.m3u8_header()]
+        parts.extend(
+            self.m3u8_entry(channel, user_id, secure, access_code_id, token)
+            for channel in channels if channel.id in member_ids
+        )
+        return "".join(parts)
+    
+    async def stream_m3u8_playlist(self, playlist: Playlist, channels: AsyncIterator[IPTVChannel],
+                                   user_id: str, secure: bool = True, access_code_id: Optional[str] = None,
+                                   batch_size: int = 500) -> AsyncIterator[str]:
+        """Generate an M3U8 playlist incrementally, batch_size channels per chunk"""
+        # The header goes out before the first channel is read
+        yield self.m3u8_header()
         
-        return m3u8_content
+        member_ids = set(playlist.channels)
+        token = self.export_token(user_id, playlist.id, access_code_id) if secure else None
+        batch = []
+        async for channel in channels:
+            if channel.id in member_ids:
+                batch.append(self.m3u8_entry(channel, user_id, secure, access_code_id, token))
+                if len(batch) >= batch_size:
+                    yield "".join(batch)
+                    batch = []
+        if batch:
+            yield "".join(batch)
+    
+    def json_info(self, playlist: Playlist, total_channels: int) -> Dict[str, Any]:
+        """playlist_info block of a JSON playlist"""
+        return {
+            "id": playlist.id,
+            "name": playlist.name,
+            "description": playlist.description,
+            "created_at": playlist.created_at.isoformat(),
+            "total_channels": total_channels
+        }
+    
+    def json_entry(self, channel: IPTVChannel, user_id: str, access_code_id: Optional[str] = None,
+                   token: Optional[str] = None) -> Dict[str, Any]:
+        """JSON description of one channel, under token when one is given"""
+        return {
+            "id": channel.id,
+            "name": channel.name,
+            "url": self.proxied_channel_url(
+                channel,
+                token or self.generate_secure_token(user_id, channel.id, access_code_id=access_code_id)
+            ),
+            "logo": channel.logo_url,
+            "category": channel.category.value,
+            "country": channel.country,
+            "language": channel.language,
+            "quality": channel.quality
+        }
     
     async def generate_json_playlist(self, playlist: Playlist, channels: List[IPTVChannel], 
-                                   user_id: str) -> Dict[str, Any]:
+                                   user_id: str, access_code_id: Optional[str] = None) -> Dict[str, Any]:
         """Generate JSON format playlist for API consumption"""
+        token = self.export_token(user_id, playlist.id, access_code_id)
         return {
-            "playlist_info": {
-                "id": playlist.id,
-                "name": playlist.name,
-                "description": playlist.description,
-                "created_at": playlist.created_at.isoformat(),
-                "total_channels": len([c for c in channels if c.id in playlist.channels])
-            },
+            "playlist_info": self.json_info(playlist, len([c for c in channels if c.id in playlist.channels])),
             "channels": [
-                {
-                    "id": channel.id,
-                    "name": channel.name,
-                    "url": self.encrypt_stream_url(
-                        channel.url, 
-                        self.generate_secure_token(user_id, channel.id)
-                    ),
-                    "logo": channel.logo_url,
-                    "category": channel.category.value,
-                    "country": channel.country,
-                    "language": channel.language,
-                    "quality": channel.quality
-                }
+                self.json_entry(channel, user_id, access_code_id, token)
                 for channel in channels if channel.id in playlist.channels
             ]
         }
     
+    async def stream_json_playlist(self, playlist: Playlist, channels: AsyncIterator[IPTVChannel],
+                                   total_channels: int, user_id: str, access_code_id: Optional[str] = None,
+                                   batch_size: int = 500) -> AsyncIterator[bytes]:
+        """Generate a JSON playlist incrementally, batch_size channels per chunk"""
+        token = self.export_token(user_id, playlist.id, access_code_id)
+        yield b'{"playlist_info":' + orjson.dumps(self.json_info(playlist, total_channels)) + b',"channels":['
+        
+        member_ids = set(playlist.channels)
+        separator = b""
+        batch = []
+        async for channel in channels:
+            if channel.id in member_ids:
+                batch.append(orjson.dumps(self.json_entry(channel, user_id, access_code_id, token)))
+                if len(batch) >= batch_size:
+                    yield separator + b",".join(batch)
+                    separator = b","
+                    batch = []
+        if batch:
+            yield separator + b",".join(batch)
+        yield b"]}"
+    
     async def validate_stream_url(self, url: str) -> Dict[str, Any]:
         """Validate if stream URL is accessible"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.head(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    return {
-                        "valid": response.status == 200,
-                        "status_code": response.status,
-                        "content_type": response.headers.get("content-type", ""),
-                        "content_length": response.headers.get("content-length", "0")
-                    }
+            session = await self.upstream.get_session()
+            async with session.head(url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                return {
+                    "valid": response.status == 200,
+                    "status_code": response.status,
+                    "content_type": response.headers.get("content-type", ""),
+                    "content_length": response.headers.get("content-length", "0")
+                }
         except Exception as e:
             return {
                 "valid": False,
@@ -109,34 +200,9 @@ class IPTVGenerator:
                 "status_code": 0
             }
     
-    def decode_stream_token(self, token: str) -> Optional[Dict[str, str]]:
+    def decode_stream_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Decode and validate stream token"""
-        try:
-            encoded_part, signature = token.split('.')
-            payload = base64.b64decode(encoded_part).decode()
-            
-            # Verify signature
-            expected_signature = hashlib.sha256(f"{encoded_part}:SECRET_STREAM_KEY".encode()).hexdigest()[:16]
-            if signature != expected_signature:
-                return None
-            
-            user_id, playlist_id, timestamp, expires_hours = payload.split(':')
-            
-            # Check expiry
-            created_time = datetime.fromisoformat(timestamp)
-            expiry_time = created_time + timedelta(hours=int(expires_hours))
-            
-            if datetime.utcnow() > expiry_time:
-                return None
-            
-            return {
-                "user_id": user_id,
-                "playlist_id": playlist_id,
-                "created_at": timestamp,
-                "expires_hours": expires_hours
-            }
-        except Exception:
-            return None
+        return self.tokens.verify(token)
     
     async def create_bulk_channels(self, channels_data: List[Dict[str, Any]], user_id: str) -> List[IPTVChannel]:
         """Create multiple channels from bulk data"""
@@ -150,6 +216,7 @@ class IPTVGenerator:
                 channel = IPTVChannel(
                     name=channel_data.get("name", "Unknown Channel"),
                     url=channel_data["url"],
+                    mirror_urls=channel_data.get("mirror_urls", []),
                     logo_url=channel_data.get("logo_url"),
                     category=channel_data.get("category", "general"),
                     country=channel_data.get("country"),
@@ -162,32 +229,521 @@ class IPTVGenerator:
         return created_channels
 
 # Proxy Service for Stream URLs
+class StreamProxyError(Exception):
+    """Proxy failure carrying the HTTP status to report to the client"""
+    def __init__(self, message: str, status_code: int = 403, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class ProxiedStream:
+    """Upstream response metadata plus an async iterator relaying its body"""
+    def __init__(self, body: Optional[AsyncIterator[bytes]], media_type: str = "video/mp2t",
+                 status_code: int = 200, headers: Optional[Dict[str, str]] = None):
+        self.body = body
+        self.media_type = media_type
+        self.status_code = status_code
+        self.headers = headers or {}
+
 class StreamProxy:
-    def __init__(self):
-        self.active_sessions = {}
+    # Headers relayed verbatim from the upstream response
+    PASSTHROUGH_HEADERS = ("content-length",)
+    RANGE_PASSTHROUGH_HEADERS = ("content-length", "content-range")
+    # Evicted segments with less lifetime left are not worth a disk write
+    DISK_SPILL_MIN_TTL = 10.0
+    # Disk hits are read in pieces this large, one executor call each; ASGI
+    # under uvicorn offers no sendfile path, so bodies pass through Python
+    DISK_READ_BYTES = 1024 * 1024
+
+    def __init__(self, upstream: Optional[UpstreamClient] = None, cache: Optional[SegmentCache] = None,
+                 coalescer: Optional[FetchCoalescer] = None, manifests: Optional[ManifestCache] = None,
+                 disk: Optional[DiskSegmentStore] = None, sources: Optional[SourceSelector] = None,
+                 sessions: Optional[StreamSessionRegistry] = None, tokens: Optional[StreamTokenCodec] = None,
+                 directory: Optional[ChannelDirectory] = None, chunk_size: int = 64 * 1024):
+        self.upstream = upstream or UpstreamClient()
+        # Must be the codec that issued the playlist tokens
+        self.tokens = tokens or StreamTokenCodec()
+        self.sources = sources or SourceSelector()
+        self.cache = cache
+        self.disk = disk
+        if cache is not None and disk is not None:
+            cache.on_evict = self._spill
+        self.coalescer = coalescer or FetchCoalescer()
+        self.manifests = manifests or ManifestCache()
+        self.chunk_size = chunk_size
+        # Optional SegmentPrefetcher, fed every live playlist served
+        self.prefetcher = None
+        self.sessions = sessions or StreamSessionRegistry()
+        # Tokens are only accepted with a directory to check channels and membership against
+        self.directory = directory
     
-    async def proxy_stream(self, token: str, encoded_url: str) -> bytes:
-        """Proxy stream through our server"""
-        # Decode and validate token
-        generator = IPTVGenerator("")
-        token_data = generator.decode_stream_token(token)
+    async def proxy_stream(self, token: str, encoded_url: str, range_header: Optional[str] = None,
+                           client: str = "", device: str = "") -> ProxiedStream:
+        """Open upstream stream and return it for chunked relay to the client"""
+        # Decode and validate token; repeat requests hit the verified-token cache
+        token_data = self.tokens.verify(token)
         
         if not token_data:
-            raise Exception("Invalid or expired token")
+            raise StreamProxyError("Invalid or expired token")
         
         # Decode original URL
         try:
-            original_url = base64.b64decode(encoded_url).decode()
+            original_url = decode_upstream_url(encoded_url)
         except Exception:
-            raise Exception("Invalid URL encoding")
+            raise StreamProxyError("Invalid URL encoding")
+        
+        if token_data.get("scope") == "playlist":
+            channel_key = self._authorize_playlist_url(token_data["playlist_id"], original_url)
+        else:
+            # Channel tokens carry the channel id in the playlist_id slot
+            channel_key = self._authorize_channel_url(token_data["playlist_id"], original_url)
+        # Manifest URIs are resolved against /stream/proxy/{token}/{encoded_url}
+        stream = await self._open_stream(original_url, channel_key, range_header,
+                                         manifest_prefix=f"../../c/{token}/{channel_key}/")
+        return self._track(token, token_data, channel_key, client, device, stream)
+    
+    async def proxy_channel(self, token: str, channel_id: str, range_header: Optional[str] = None,
+                            client: str = "", device: str = "") -> ProxiedStream:
+        """Open a channel's upstream stream by id; its URL never leaves the server"""
+        token_data = self._authorize_channel(token, channel_id)
+        original_url = self.directory.channel_url(channel_id) if self.directory is not None else None
+        if original_url is None:
+            raise StreamProxyError("Channel not found", status_code=404)
         
-        # Proxy the stream
+        # Manifest URIs are resolved against /stream/c/{token}/{channel_id}
+        stream = await self._open_stream(original_url, channel_id, range_header,
+                                         manifest_prefix=f"{channel_id}/")
+        return self._track(token, token_data, channel_id, client, device, stream)
+    
+    async def proxy_manifest_uri(self, token: str, channel_id: str, signature: str, encoded_url: str,
+                                 range_header: Optional[str] = None, client: str = "", device: str = "") -> ProxiedStream:
+        """Open a variant, segment or key URI that a manifest of channel_id handed out"""
+        token_data = self._authorize_channel(token, channel_id)
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(original_url) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        raise Exception(f"Stream error: {response.status}")
+            original_url = decode_upstream_url(encoded_url)
+        except Exception:
+            raise StreamProxyError("Invalid URL encoding")
+        if not self.tokens.verify_uri(channel_id, original_url, signature):
+            raise StreamProxyError("Invalid stream signature")
+        
+        # Manifest URIs are resolved against /stream/c/{token}/{channel_id}/{signature}/{encoded_url}
+        stream = await self._open_stream(original_url, channel_id, range_header, manifest_prefix="../", derived=True)
+        return self._track(token, token_data, channel_id, client, device, stream)
+    
+    def _authorize_channel(self, token: str, channel_id: str) -> Dict[str, Any]:
+        """Claims of a token valid for channel_id; raises otherwise"""
+        token_data = self.tokens.verify(token)
+        
+        if not token_data:
+            raise StreamProxyError("Invalid or expired token")
+        
+        if token_data.get("scope") == "playlist":
+            authorized = self.directory is not None and self.directory.in_playlist(token_data["playlist_id"], channel_id)
+        else:
+            authorized = token_data["playlist_id"] == channel_id
+        if not authorized:
+            raise StreamProxyError("Stream not in playlist")
+        return token_data
+    
+    def _track(self, token: str, token_data: Dict[str, Any], channel_key: str, client: str, device: str,
+               stream: ProxiedStream) -> ProxiedStream:
+        """Count stream against the viewer's session"""
+        session = self.sessions.open(token, token_data["user_id"], channel_key, client,
+                                     access_code_id=token_data.get("access_code_id"), device=device)
+        if stream.body is not None:
+            stream.body = self.sessions.relay(session, stream.body)
+        elif "content-length" in stream.headers:
+            session.bytes_sent += int(stream.headers["content-length"])
+        return stream
+    
+    def _authorize_channel_url(self, channel_id: str, url: str) -> str:
+        """channel_id when url is its primary or a mirror URL; raises otherwise"""
+        if self.directory is not None and channel_id in self.directory.channels_for_url(url):
+            return channel_id
+        raise StreamProxyError("Stream not in playlist")
+    
+    def _authorize_playlist_url(self, playlist_id: str, url: str) -> str:
+        """Member channel of playlist_id streaming url; raises when there is none"""
+        if self.directory is not None:
+            for channel_id in self.directory.channels_for_url(url):
+                if self.directory.in_playlist(playlist_id, channel_id):
+                    return channel_id
+        raise StreamProxyError("Stream not in playlist")
+    
+    async def _open_stream(self, original_url: str, channel_key: str, range_header: Optional[str],
+                           manifest_prefix: str, derived: bool = False) -> ProxiedStream:
+        """Stream original_url for channel_key; derived marks a URI found in one of its manifests"""
+        # Rewritten playlists are reloaded by every viewer every few seconds
+        cached_manifest = self.manifests.get(original_url)
+        if cached_manifest is not None:
+            if self.prefetcher is not None:
+                self.prefetcher.on_manifest(channel_key, cached_manifest.manifest)
+            return self._manifest_stream(cached_manifest, channel_key, manifest_prefix)
+        
+        # Segments are shared by every viewer of a channel, so the cache is
+        # keyed on the upstream URL rather than the per-user token
+        if self.cache is not None:
+            cached = self.cache.get(original_url)
+            if cached is not None:
+                return self._cached_stream(cached, range_header)
+        if self.disk is not None:
+            stored = self.disk.get(original_url)
+            if stored is not None:
+                disk_stream = await self._disk_stream(original_url, stored, range_header)
+                if disk_stream is not None:
+                    return disk_stream
+        
+        # Seeks in progressive VOD files fetch only the requested bytes
+        if range_header:
+            ranged = await self._fetch_range(original_url, range_header, channel_key, derived)
+            if ranged is not None:
+                return ranged
+        
+        # Concurrent requests for the same URL share one upstream fetch;
+        # late joiners replay what has already arrived
+        subscription = self.coalescer.join(
+            original_url, functools.partial(self._fetch_upstream, channel_key=channel_key, derived=derived)
+        )
+        inflight = subscription.inflight
+        try:
+            await inflight.wait_headers()
+        except UpstreamBusyError as e:
+            subscription.close()
+            raise StreamProxyError(str(e), status_code=503, headers={"Retry-After": str(e.retry_after)})
         except Exception as e:
-            raise Exception(f"Proxy error: {str(e)}")
\ No newline at end of file
+            subscription.close()
+            raise StreamProxyError(f"Proxy error: {str(e)}")
+        
+        headers = dict(inflight.headers)
+        if self.cache is not None:
+            headers["x-cache"] = "MISS"
+        if inflight.media_type != HLS_MEDIA_TYPE:
+            headers["accept-ranges"] = "bytes"
+        else:
+            fresh_manifest = self.manifests.peek(original_url)
+            if fresh_manifest is not None:
+                if self.prefetcher is not None:
+                    self.prefetcher.on_manifest(channel_key, fresh_manifest.manifest)
+                # Every viewer gets the URIs signed for their channel
+                subscription.close()
+                return self._manifest_stream(fresh_manifest, channel_key, manifest_prefix)
+        
+        return ProxiedStream(subscription, media_type=inflight.media_type, headers=headers)
+    
+    async def warm_segment(self, url: str, channel_key: Optional[str] = None) -> int:
+        """Pull a segment of channel_key's manifest into the cache; returns the bytes fetched from upstream"""
+        if self.cache is not None and self.cache.peek(url) is not None:
+            return 0
+        if self.disk is not None and self.disk.get(url) is not None:
+            return 0
+        # Joins any viewer fetch already in flight, and viewers arriving
+        # meanwhile join this one
+        subscription = self.coalescer.join(
+            url, functools.partial(self._fetch_upstream, channel_key=channel_key, derived=channel_key is not None)
+        )
+        transferred = 0
+        try:
+            await subscription.inflight.wait_headers()
+            async for chunk in subscription:
+                transferred += len(chunk)
+        finally:
+            subscription.close()
+        return transferred
+    
+    def _resolve_range(self, range_header: Optional[str], total: int) -> Optional[Tuple[int, int]]:
+        """Byte range to serve from a stored body of total bytes, or None for all of it"""
+        if not range_header:
+            return None
+        try:
+            return parse_byte_range(range_header, total)
+        except ValueError:
+            raise StreamProxyError(
+                "Requested range not satisfiable",
+                status_code=416,
+                headers={"Content-Range": f"bytes */{total}"}
+            )
+    
+    def _cached_stream(self, cached: CachedSegment, range_header: Optional[str] = None) -> ProxiedStream:
+        total = len(cached.body)
+        byte_range = self._resolve_range(range_header, total)
+        
+        if byte_range is None:
+            body_bytes = cached.body
+            status_code = 200
+            headers = {}
+        else:
+            start, end = byte_range
+            body_bytes = cached.body[start:end + 1]
+            status_code = 206
+            headers = {"content-range": f"bytes {start}-{end}/{total}"}
+        
+        async def body() -> AsyncIterator[bytes]:
+            yield body_bytes
+        
+        return ProxiedStream(
+            body(),
+            media_type=cached.media_type,
+            status_code=status_code,
+            headers={
+                **headers,
+                "content-length": str(len(body_bytes)),
+                "accept-ranges": "bytes",
+                "x-cache": "HIT"
+            }
+        )
+    
+    def spill_cache(self) -> int:
+        """Queue every fresh memory-cached segment for the disk tier, e.g. at shutdown; returns the count"""
+        if self.cache is None or self.disk is None:
+            return 0
+        spilled = 0
+        # Least recently used first, so the hottest segments are the last the disk would evict
+        for url, entry in self.cache.fresh_entries():
+            spilled += self._spill(url, entry)
+        return spilled
+    
+    def _spill(self, url: str, entry: CachedSegment) -> bool:
+        """Move a segment evicted from memory to disk while it has long enough left to be reused"""
+        ttl = entry.expires_at - time.monotonic()
+        if ttl < self.DISK_SPILL_MIN_TTL:
+            return False
+        self.disk.put(url, entry.body, entry.media_type, ttl)
+        return True
+    
+    async def _disk_stream(self, url: str, stored: DiskSegment,
+                           range_header: Optional[str] = None) -> Optional[ProxiedStream]:
+        """Stream a stored segment; None when its file is already gone"""
+        byte_range = self._resolve_range(range_header, stored.size)
+        headers = {"accept-ranges": "bytes", "x-cache": "HIT-DISK"}
+        
+        # Opened now, so an eviction unlinking the file meanwhile cannot fail the response
+        loop = asyncio.get_running_loop()
+        try:
+            f = await loop.run_in_executor(None, open, stored.path, "rb")
+        except FileNotFoundError:
+            self.disk.discard(url)
+            return None
+        
+        start, end = byte_range if byte_range is not None else (0, stored.size - 1)
+        
+        async def body() -> AsyncIterator[bytes]:
+            try:
+                if start:
+                    f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = await loop.run_in_executor(None, f.read, min(self.DISK_READ_BYTES, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+            finally:
+                f.close()
+        
+        if byte_range is None:
+            headers["content-length"] = str(stored.size)
+            return ProxiedStream(body(), media_type=stored.media_type, headers=headers)
+        
+        return ProxiedStream(
+            body(),
+            media_type=stored.media_type,
+            status_code=206,
+            headers={
+                **headers,
+                "content-range": f"bytes {start}-{end}/{stored.size}",
+                "content-length": str(end - start + 1)
+            }
+        )
+    
+    async def _fetch_range(self, url: str, range_header: str, channel_key: Optional[str] = None,
+                           derived: bool = False) -> Optional[ProxiedStream]:
+        """Forward a Range request upstream; None when the target turns out to be a playlist"""
+        # Seeks go to the currently best mirror
+        url = self.sources.candidates(url, channel_key, derived)[0]
+        host = HostLimiter.host_of(url)
+        try:
+            await self.upstream.limiter.acquire(host)
+        except UpstreamBusyError as e:
+            raise StreamProxyError(str(e), status_code=503, headers={"Retry-After": str(e.retry_after)})
+        
+        session = await self.upstream.get_session()
+        started = time.monotonic()
+        try:
+            response = await session.get(url, headers={"Accept-Encoding": "identity", "Range": range_header})
+        except Exception as e:
+            self.sources.record(url, time.monotonic() - started, False, channel_key, derived)
+            self.upstream.limiter.release(host)
+            raise StreamProxyError(f"Proxy error: {str(e)}")
+        self.sources.record(url, time.monotonic() - started, response.status < 500, channel_key, derived)
+        
+        media_type = response.headers.get("content-type") or "video/mp2t"
+        if is_hls_manifest(media_type, url):
+            # Playlists must go through the rewriting path whole
+            response.close()
+            self.upstream.limiter.release(host)
+            return None
+        
+        if response.status == 416:
+            response.release()
+            self.upstream.limiter.release(host)
+            headers = {}
+            if "content-range" in response.headers:
+                headers["Content-Range"] = response.headers["content-range"]
+            raise StreamProxyError("Requested range not satisfiable", status_code=416, headers=headers)
+        if response.status not in (200, 206):
+            response.release()
+            self.upstream.limiter.release(host)
+            raise StreamProxyError(f"Proxy error: Stream error: {response.status}")
+        
+        # Origins without range support answer 200 with the full body,
+        # which is relayed as-is
+        headers = {"accept-ranges": "bytes"}
+        for name in self.RANGE_PASSTHROUGH_HEADERS:
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        if "content-encoding" in response.headers:
+            headers["content-encoding"] = response.headers["content-encoding"]
+        
+        return ProxiedStream(
+            self._relay(response, host),
+            media_type=media_type,
+            status_code=response.status,
+            headers=headers
+        )
+    
+    async def _relay(self, response: aiohttp.ClientResponse, host: str) -> AsyncIterator[bytes]:
+        """Yield chunks of an unshared upstream response, closing it when the client goes away"""
+        completed = False
+        try:
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                yield chunk
+            completed = True
+        finally:
+            if completed:
+                response.release()
+            else:
+                response.close()
+            self.upstream.limiter.release(host)
+    
+    def _manifest_stream(self, cached: CachedManifest, channel_key: str, prefix: str) -> ProxiedStream:
+        """Manifest with every URI pointed at the signed route of channel_key"""
+        signatures = cached.signatures.get(channel_key)
+        if signatures is None:
+            signatures = cached.signatures[channel_key] = [
+                self.tokens.sign_uri(channel_key, uri) for uri in cached.manifest.uris
+            ]
+        manifest_body = cached.manifest.render(prefix, signatures).encode()
+        
+        async def body() -> AsyncIterator[bytes]:
+            yield manifest_body
+        
+        return ProxiedStream(
+            body(),
+            media_type=HLS_MEDIA_TYPE,
+            headers={"content-length": str(len(manifest_body)), "x-cache": "HIT"}
+        )
+    
+    async def _fetch_upstream(self, inflight: InflightFetch, channel_key: Optional[str] = None,
+                              derived: bool = False):
+        """Pull one upstream response into a shared fetch, failing over between mirrors"""
+        last_error: Optional[Exception] = None
+        for candidate in self.sources.candidates(inflight.url, channel_key, derived):
+            try:
+                await self._fetch_from(inflight, candidate, channel_key, derived)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+                # Before the first byte any mirror will do; afterwards only a
+                # live body can resume from another source without corruption
+                if inflight.has_headers and not inflight.live:
+                    raise
+        raise last_error
+    
+    async def _fetch_from(self, inflight: InflightFetch, source_url: str, channel_key: Optional[str] = None,
+                          derived: bool = False):
+        """Relay source_url into a shared fetch, filling the cache when complete"""
+        url = inflight.url
+        # Held for the whole transfer: it bounds open upstream sockets
+        host = HostLimiter.host_of(source_url)
+        await self.upstream.limiter.acquire(host)
+        try:
+            session = await self.upstream.get_session()
+            started = time.monotonic()
+            try:
+                response = await session.get(source_url, headers={"Accept-Encoding": "identity"})
+            except Exception:
+                self.sources.record(source_url, time.monotonic() - started, False, channel_key, derived)
+                raise
+            self.sources.record(source_url, time.monotonic() - started, response.status == 200, channel_key, derived)
+            completed = False
+            writer = None
+            try:
+                if response.status != 200:
+                    raise StreamProxyError(f"Stream error: {response.status}")
+                
+                if inflight.has_headers:
+                    # Resuming a live body on another mirror
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        await inflight.append(chunk)
+                    completed = True
+                    return
+                
+                headers = {}
+                for name in self.PASSTHROUGH_HEADERS:
+                    if name in response.headers:
+                        headers[name] = response.headers[name]
+                if "content-encoding" in response.headers:
+                    headers["content-encoding"] = response.headers["content-encoding"]
+                media_type = response.headers.get("content-type") or "video/mp2t"
+                
+                if is_hls_manifest(media_type, url) and "content-encoding" not in response.headers:
+                    # Playlists are small: read whole, point every URI back at
+                    # the proxy, and serve the rewritten copy to all viewers.
+                    # Relative to the final URL in case the origin redirected.
+                    text = (await response.read()).decode("utf-8", "replace")
+                    cached = self.manifests.put(url, HLSManifest.parse(text, str(response.url)))
+                    inflight.set_headers(HLS_MEDIA_TYPE, {"content-length": str(len(cached.body))}, len(cached.body))
+                    await inflight.append(cached.body)
+                    completed = True
+                    return
+                
+                cache_ttl = None
+                if self.cache is not None and "content-encoding" not in response.headers:
+                    cache_ttl = self.cache.ttl_for(url, response.headers.get("cache-control", ""))
+                
+                inflight.set_headers(media_type, headers, response.content_length)
+                if (cache_ttl is not None and cache_ttl >= self.DISK_SPILL_MIN_TTL and self.disk is not None
+                        and not inflight.retain_all):
+                    # Too large for the memory cache (a VOD file): written to disk as it is relayed
+                    writer = self.disk.open_writer(url, media_type, cache_ttl, response.content_length)
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    await inflight.append(chunk)
+                    if writer is not None:
+                        await writer.write(chunk)
+                completed = True
+                if writer is not None and writer.size == response.content_length:
+                    await writer.commit()
+            except Exception:
+                if response.status == 200:
+                    self.sources.record(source_url, time.monotonic() - started, False, channel_key, derived)
+                raise
+            finally:
+                # A fully read response returns its connection to the pool; a
+                # partial one (error, or every viewer gone) must be dropped so
+                # the upstream stops sending
+                if completed:
+                    response.release()
+                else:
+                    response.close()
+                if writer is not None:
+                    # Failed, cancelled or truncated bodies leave nothing behind
+                    await writer.abort()
+            
+            # Only bodies small enough to be kept whole are cacheable
+            if cache_ttl is not None and inflight.retain_all:
+                body = inflight.body()
+                self.cache.put(url, body, media_type, cache_ttl)
+        finally:
+            self.upstream.limiter.release(host)
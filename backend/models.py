@@ -47,6 +47,7 @@ class IPTVChannel(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     url: str
+    mirror_urls: List[str] = []  # fallback sources, in preference order
     logo_url: Optional[str] = None
     category: ChannelCategory
     country: Optional[str] = None
@@ -60,6 +61,7 @@ class IPTVChannel(BaseModel):
 class IPTVChannelCreate(BaseModel):
     name: str
     url: str
+    mirror_urls: List[str] = []
     logo_url: Optional[str] = None
     category: ChannelCategory
     country: Optional[str] = None
@@ -77,6 +79,7 @@ class Playlist(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     access_code: Optional[str] = None
     expiry_date: Optional[datetime] = None
+    version: int = 1  # bumped on every edit
 
 class PlaylistCreate(BaseModel):
     name: str
@@ -85,6 +88,12 @@ class PlaylistCreate(BaseModel):
     is_public: bool = False
     expiry_hours: Optional[int] = None
 
+class PlaylistUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    channels: Optional[List[str]] = None
+    is_public: Optional[bool] = None
+
 # Access Code Models
 class AccessCode(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -102,6 +111,9 @@ class AccessCodeCreate(BaseModel):
     expiry_hours: Optional[int] = 24
     max_uses: Optional[int] = None
 
+class AccessCodeBulkCreate(AccessCodeCreate):
+    count: int = Field(ge=1, le=100000)
+
 # VPN/Proxy Models
 class ProxyConfig(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -131,6 +143,8 @@ class SystemStats(BaseModel):
     total_channels: int
     total_playlists: int
     active_streams: int
+    streams_per_channel: Dict[str, int] = {}
+    streams_per_user: Dict[str, int] = {}
     total_access_codes: int
     server_status: Dict[str, Any]
 
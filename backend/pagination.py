@@ -0,0 +1,70 @@
+from typing import Dict, Any, Optional, List, Tuple, Type, AsyncIterator
+from datetime import datetime
+import base64
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Stable order for keyset pagination; created_at alone has ties
+KEYSET_SORT: List[Tuple[str, int]] = [("created_at", 1), ("id", 1)]
+
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection returning exactly the fields of model"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+def fill_defaults(model: Type[BaseModel], doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Give a document read with model_projection(model) the model defaults it lacks"""
+    fields = model.model_fields
+    if len(doc) != len(fields):
+        for name in fields.keys() - doc.keys():
+            doc[name] = fields[name].get_default(call_default_factory=True)
+    return doc
+
+def trusted_list_response(model: Type[BaseModel], docs: List[Dict[str, Any]]) -> ORJSONResponse:
+    """Documents read with model_projection(model), serialized without validating them again
+
+    Documents written by this service already match their model; fields
+    missing from older documents take the model defaults, so the response
+    schema is unchanged.
+    """
+    for doc in docs:
+        fill_defaults(model, doc)
+    return ORJSONResponse(docs)
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    """Opaque cursor resuming a listing after doc"""
+    return base64.urlsafe_b64encode(f"{doc['created_at'].isoformat()}|{doc['id']}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """(created_at, id) of a cursor; raises ValueError when it is malformed"""
+    try:
+        created_at, _, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().partition("|")
+        return datetime.fromisoformat(created_at), doc_id
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def keyset_query(query: Dict[str, Any], after: Optional[str]) -> Dict[str, Any]:
+    """query restricted to documents sorting after the cursor"""
+    if not after:
+        return query
+    created_at, doc_id = decode_cursor(after)
+    return {"$and": [query, {"$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "id": {"$gt": doc_id}}
+    ]}]}
+
+async def ndjson_rows(model: Type[BaseModel], cursor: AsyncIterator[Dict[str, Any]],
+                      batch_size: int = 500) -> AsyncIterator[bytes]:
+    """One JSON document per line, emitted batch_size rows at a time as the cursor yields them"""
+    batch = []
+    async for doc in cursor:
+        batch.append(orjson.dumps(fill_defaults(model, doc)))
+        if len(batch) >= batch_size:
+            batch.append(b"")
+            yield b"\n".join(batch)
+            batch = []
+    if batch:
+        batch.append(b"")
+        yield b"\n".join(batch)
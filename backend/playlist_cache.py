@@ -0,0 +1,247 @@
+from typing import Dict, Any, Optional, List, Set, Tuple, Iterable, AsyncIterator, Union
+from collections import OrderedDict
+import asyncio
+import gzip
+import hashlib
+import logging
+import time
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# (playlist id, playlist version, format, access code)
+PlaylistKey = Tuple[str, int, str, str]
+
+# Bodies below this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an entity tag"""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def choose_encoding(accept_encoding: Optional[str], available: Iterable[str]) -> Optional[str]:
+    """Best available content coding the client accepts, preferring br over gzip"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+class RenderedPlaylist:
+    __slots__ = ("body", "media_type", "expires_at", "etag", "encodings")
+
+    def __init__(self, body: bytes, media_type: str, expires_at: float, etag: str):
+        self.body = body
+        self.media_type = media_type
+        self.expires_at = expires_at
+        self.etag = etag
+        # Precompressed bodies by content coding, filled in once per render
+        self.encodings: Dict[str, bytes] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(encoded) for encoded in self.encodings.values())
+
+# Rendered playlist bodies served to repeat fetches of an access code
+class PlaylistCache:
+    """Byte-budgeted LRU of rendered M3U8/JSON playlists with precise invalidation
+
+    Entries are keyed on playlist id, playlist version, format and access
+    code. Invalidating a playlist moves it to a new version and drops its
+    entries; a render that started before the invalidation is discarded
+    when it finishes. Channel changes invalidate every cached playlist that
+    contains the channel. Each entry carries a strong ETag and is compressed
+    once, off the event loop, after it is stored.
+
+    Lookups go through version() with the version stored in Mongo, so an
+    edit made on another worker (which bumps that version) is never served
+    from this worker's cache. Channel changes bump the version of every
+    playlist containing the channel in Mongo for the same reason.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 16 * 1024 * 1024,
+                 ttl: float = 3600.0, gzip_level: int = 6, brotli_quality: int = 5):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        # Bodies embed stream tokens, so this must stay well below their lifetime
+        self.ttl = ttl
+        self._entries: "OrderedDict[PlaylistKey, RenderedPlaylist]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._playlist_keys: Dict[str, Set[PlaylistKey]] = {}
+        self._playlist_channels: Dict[str, Set[str]] = {}
+        self._channel_playlists: Dict[str, Set[str]] = {}
+        self._compressing: Set[asyncio.Task] = set()
+        self.size = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "compressions": 0
+        }
+
+    def version(self, playlist_id: str, stored_version: int = 0) -> int:
+        """Version a render of playlist_id starting now should be stored under"""
+        current = max(self._versions.get(playlist_id, 0), stored_version)
+        self._versions[playlist_id] = current
+        return current
+
+    def get(self, playlist_id: str, version: int, fmt: str, access_code: str) -> Optional[RenderedPlaylist]:
+        """Cached render of this version, as returned by version()"""
+        key = (playlist_id, version, fmt, access_code)
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry
+
+    def put(self, playlist_id: str, version: int, fmt: str, access_code: str, body: bytes,
+            media_type: str, channel_ids: Iterable[str]) -> Optional[RenderedPlaylist]:
+        """Store a finished render; refused when the playlist changed meanwhile"""
+        if version != self._versions.get(playlist_id) or len(body) > self.max_entry_bytes:
+            return None
+
+        key = (playlist_id, version, fmt, access_code)
+        if key in self._entries:
+            self._remove(key)
+        self._make_room(len(body))
+
+        # Strong validator: the version plus a digest of these exact bytes
+        etag = f'"{version}-{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        entry = self._entries[key] = RenderedPlaylist(body, media_type, time.monotonic() + self.ttl, etag)
+        self.size += len(body)
+        self._playlist_keys.setdefault(playlist_id, set()).add(key)
+        if playlist_id not in self._playlist_channels:
+            channels = self._playlist_channels[playlist_id] = set(channel_ids)
+            for channel_id in channels:
+                self._channel_playlists.setdefault(channel_id, set()).add(playlist_id)
+        self.stats["stores"] += 1
+
+        if len(body) >= MIN_COMPRESS_BYTES:
+            task = asyncio.get_running_loop().create_task(self._compress(key, entry))
+            self._compressing.add(task)
+            task.add_done_callback(self._compressing.discard)
+        return entry
+
+    def _make_room(self, size: int):
+        while self.size + size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _encode(self, body: bytes) -> Dict[str, bytes]:
+        encodings = {"gzip": gzip.compress(body, compresslevel=self.gzip_level)}
+        if brotli is not None:
+            encodings["br"] = brotli.compress(body, quality=self.brotli_quality)
+        return encodings
+
+    async def _compress(self, key: PlaylistKey, entry: RenderedPlaylist):
+        """Attach precompressed bodies; until then the entry is served uncompressed"""
+        loop = asyncio.get_running_loop()
+        try:
+            encodings = await loop.run_in_executor(None, self._encode, entry.body)
+        except Exception as e:
+            logger.warning(f"Playlist compression failed: {e}")
+            return
+        if self._entries.get(key) is not entry:
+            # Evicted or invalidated meanwhile
+            return
+        added = sum(len(encoded) for encoded in encodings.values())
+        self._entries.move_to_end(key)
+        self._make_room(added)
+        if self._entries.get(key) is entry:
+            entry.encodings = encodings
+            self.size += added
+            self.stats["compressions"] += 1
+
+    async def tee(self, chunks: AsyncIterator[Union[str, bytes]], playlist_id: str, version: int, fmt: str,
+                  access_code: str, media_type: str, channel_ids: Iterable[str]) -> AsyncIterator[bytes]:
+        """Relay a streamed render and store it once complete, unless it outgrows an entry"""
+        parts: Optional[List[bytes]] = []
+        size = 0
+        async for chunk in chunks:
+            data = chunk.encode() if isinstance(chunk, str) else chunk
+            if parts is not None:
+                size += len(data)
+                if size > self.max_entry_bytes:
+                    parts = None
+                else:
+                    parts.append(data)
+            yield data
+        if parts is not None:
+            self.put(playlist_id, version, fmt, access_code, b"".join(parts), media_type, channel_ids)
+
+    def invalidate_playlist(self, playlist_id: str):
+        """Drop every render of a playlist and fence off renders in progress"""
+        self._versions[playlist_id] = self._versions.get(playlist_id, 0) + 1
+        for key in list(self._playlist_keys.get(playlist_id, ())):
+            self._remove(key)
+        self.stats["invalidations"] += 1
+
+    def invalidate_channels(self, channel_ids: Iterable[str]):
+        """Invalidate every cached playlist containing one of channel_ids"""
+        playlist_ids = set()
+        for channel_id in channel_ids:
+            playlist_ids.update(self._channel_playlists.get(channel_id, ()))
+        for playlist_id in playlist_ids:
+            self.invalidate_playlist(playlist_id)
+
+    def _remove(self, key: PlaylistKey):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        playlist_id = key[0]
+        keys = self._playlist_keys.get(playlist_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                # Last render gone: forget its channel membership too
+                del self._playlist_keys[playlist_id]
+                for channel_id in self._playlist_channels.pop(playlist_id, ()):
+                    playlists = self._channel_playlists.get(channel_id)
+                    if playlists is not None:
+                        playlists.discard(playlist_id)
+                        if not playlists:
+                            del self._channel_playlists[channel_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters and current memory use"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "size_bytes": self.size,
+            "max_bytes": self.max_bytes
+        }
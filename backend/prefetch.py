@@ -0,0 +1,148 @@
+from typing import Dict, Any, Optional, Callable, Awaitable, Set
+from collections import OrderedDict
+import asyncio
+import logging
+import time
+from hls import HLSManifest
+
+logger = logging.getLogger(__name__)
+
+class ChannelPrefetchState:
+    __slots__ = ("depth", "last_seen", "seen", "tasks")
+
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.last_seen = time.monotonic()
+        # Segment URLs already scheduled, oldest first
+        self.seen: "OrderedDict[str, None]" = OrderedDict()
+        self.tasks: Set[asyncio.Task] = set()
+
+# Live HLS prefetcher
+class SegmentPrefetcher:
+    """Warm the segment cache with the newest segments of watched live playlists"""
+    def __init__(self, warm: Callable[[str, str], Awaitable[int]], depth: int = 3,
+                 channel_depths: Optional[Dict[str, int]] = None, max_concurrency: int = 16,
+                 max_bytes_per_second: int = 0, idle_timeout: float = 60.0):
+        # warm(url, channel_key) fetches url into the cache and returns the bytes transferred
+        self.warm = warm
+        self.depth = depth
+        self.channel_depths = channel_depths or {}
+        self.max_concurrency = max_concurrency
+        self.max_bytes_per_second = max_bytes_per_second
+        self.idle_timeout = idle_timeout
+        self._channels: Dict[str, ChannelPrefetchState] = {}
+        self._in_flight = 0
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._reaper: Optional[asyncio.Task] = None
+        self.stats = {
+            "scheduled": 0,
+            "completed": 0,
+            "failed": 0,
+            "skipped_budget": 0,
+            "bytes": 0,
+            "channels_reaped": 0
+        }
+
+    async def start(self):
+        """Start the idle-channel reaper"""
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def stop(self):
+        """Stop the reaper and cancel every pending prefetch"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        for channel_key in list(self._channels):
+            self._drop_channel(channel_key)
+
+    def set_channel_depth(self, channel_key: str, depth: int):
+        self.channel_depths[channel_key] = depth
+        if channel_key in self._channels:
+            self._channels[channel_key].depth = depth
+
+    def on_manifest(self, channel_key: str, manifest: HLSManifest):
+        """Record viewer activity and schedule the newest unseen segments"""
+        if manifest.is_master or manifest.is_endlist:
+            return
+
+        state = self._channels.get(channel_key)
+        if state is None:
+            state = ChannelPrefetchState(self.channel_depths.get(channel_key, self.depth))
+            self._channels[channel_key] = state
+        state.last_seen = time.monotonic()
+        if state.depth <= 0:
+            return
+
+        for url in manifest.segment_urls[-state.depth:]:
+            if url in state.seen:
+                continue
+            state.seen[url] = None
+            if not self._within_budget():
+                self.stats["skipped_budget"] += 1
+                continue
+            self._in_flight += 1
+            self.stats["scheduled"] += 1
+            task = asyncio.create_task(self._prefetch(channel_key, url))
+            state.tasks.add(task)
+            task.add_done_callback(state.tasks.discard)
+            task.add_done_callback(self._release_slot)
+
+        # Only the recent window of a live playlist matters
+        while len(state.seen) > state.depth * 4:
+            state.seen.popitem(last=False)
+
+    def _within_budget(self) -> bool:
+        if self._in_flight >= self.max_concurrency:
+            return False
+        if self.max_bytes_per_second:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_bytes = 0
+            if self._window_bytes >= self.max_bytes_per_second:
+                return False
+        return True
+
+    async def _prefetch(self, channel_key: str, url: str):
+        try:
+            transferred = await self.warm(url, channel_key)
+            self._window_bytes += transferred
+            self.stats["bytes"] += transferred
+            self.stats["completed"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.debug(f"Prefetch of {url} failed: {e}")
+
+    def _release_slot(self, task: asyncio.Task):
+        # Done callbacks also run for tasks cancelled before they started
+        self._in_flight -= 1
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 4))
+            cutoff = time.monotonic() - self.idle_timeout
+            for channel_key, state in list(self._channels.items()):
+                if state.last_seen < cutoff:
+                    self._drop_channel(channel_key)
+                    self.stats["channels_reaped"] += 1
+
+    def _drop_channel(self, channel_key: str):
+        state = self._channels.pop(channel_key, None)
+        if state is not None:
+            for task in list(state.tasks):
+                task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Prefetch counters and currently watched channels"""
+        return {
+            **self.stats,
+            "in_flight": self._in_flight,
+            "active_channels": len(self._channels),
+            "depth": self.depth,
+            "max_concurrency": self.max_concurrency,
+            "max_bytes_per_second": self.max_bytes_per_second
+        }
@@ -0,0 +1,320 @@
+from typing import Dict, Any, Optional, List, Set, Tuple
+from collections import OrderedDict
+from pathlib import Path
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class DiskSegment:
+    __slots__ = ("path", "size", "media_type", "expires_at")
+
+    def __init__(self, path: Path, size: int, media_type: str, expires_at: float):
+        self.path = path
+        self.size = size
+        self.media_type = media_type
+        # Wall-clock expiry so it survives restarts
+        self.expires_at = expires_at
+
+class SegmentWriter:
+    """Incremental write of one body too large to hold in memory, committed once complete"""
+    # Chunks are gathered into writes of this size to keep executor round trips few
+    WRITE_BYTES = 1024 * 1024
+
+    def __init__(self, store: "DiskSegmentStore", url: str, media_type: str, expires_at: float):
+        self.store = store
+        self.url = url
+        self.media_type = media_type
+        self.expires_at = expires_at
+        self.size = 0
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._file = None
+        self._tmp_path: Optional[Path] = None
+        self._failed = False
+        self._committed = False
+
+    async def write(self, chunk: bytes):
+        if self._failed:
+            return
+        self._buffer.append(chunk)
+        self._buffered += len(chunk)
+        self.size += len(chunk)
+        if self.size > self.store.max_bytes:
+            await self.abort()
+        elif self._buffered >= self.WRITE_BYTES:
+            await self._drain()
+
+    async def _drain(self):
+        data = b"".join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        loop = asyncio.get_running_loop()
+        try:
+            if self._file is None:
+                self._tmp_path, self._file = await loop.run_in_executor(None, self.store._open_tmp, self.url)
+            await loop.run_in_executor(None, self._file.write, data)
+        except OSError as e:
+            self.store.stats["write_errors"] += 1
+            logger.warning(f"Segment store write failed for {self.url}: {e}")
+            await self.abort()
+
+    async def commit(self):
+        """Make the body durable and visible; the entry is dropped if any write failed"""
+        if self._failed:
+            return
+        await self._drain()
+        if self._failed:
+            return
+        if self._file is None:
+            # Empty body
+            await self.abort()
+            return
+        body_path, meta_path = self.store._paths(self.url)
+        meta = {"url": self.url, "media_type": self.media_type, "size": self.size, "expires_at": self.expires_at}
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.store._finish_files, self._file, self._tmp_path,
+                                       body_path, meta_path, meta)
+        except OSError as e:
+            self.store.stats["write_errors"] += 1
+            logger.warning(f"Segment store write failed for {self.url}: {e}")
+            await self.abort()
+            return
+        self._file = None
+        self._committed = True
+        self.store._writers.discard(self.url)
+        await self.store._add(self.url, DiskSegment(body_path, self.size, self.media_type, self.expires_at))
+
+    async def abort(self):
+        """Give up on the entry and remove what was written; no-op once committed"""
+        if self._failed or self._committed:
+            return
+        self._failed = True
+        self._buffer, self._buffered = [], 0
+        self.store._writers.discard(self.url)
+        if self._file is not None:
+            f, self._file = self._file, None
+            await asyncio.get_running_loop().run_in_executor(None, self.store._discard_tmp, f, self._tmp_path)
+
+# Second cache tier behind the in-memory SegmentCache
+class DiskSegmentStore:
+    """Content-addressed on-disk segment store with LRU eviction and warm restart
+
+    Each entry is two files named after the SHA-256 of its URL: the raw body
+    (``.seg``), served straight from disk, and a JSON sidecar (``.meta``).
+    Both are written to a temporary name, fsynced and renamed into place,
+    body first, so a ``.meta`` file only ever describes a complete body.
+    Only segments the memory cache evicts while still fresh, or still holds
+    at shutdown, are written here, so short-lived live segments rarely
+    touch the disk while hot content survives a restart. Cacheable bodies
+    too large for the memory cache (VOD files) are written through with a
+    ``SegmentWriter`` as they are relayed.
+    """
+    def __init__(self, root: str, max_bytes: int = 10 * 1024 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, DiskSegment]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        # URLs with a SegmentWriter in progress
+        self._writers: Set[str] = set()
+        self.size = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "write_errors": 0,
+            "recovered": 0
+        }
+
+    async def start(self):
+        """Rebuild the index from disk; call once from application startup"""
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(None, self._scan)
+        for url, entry in entries:
+            self._index[url] = entry
+            self.size += entry.size
+        self.stats["recovered"] = len(self._index)
+        await self._evict()
+        logger.info(f"Segment store at {self.root}: recovered {len(self._index)} entries, {self.size} bytes")
+
+    async def close(self):
+        """Wait for in-progress writes so nothing is left half renamed"""
+        if self._pending:
+            await asyncio.gather(*self._pending.values(), return_exceptions=True)
+
+    def _scan(self) -> List[Tuple[str, DiskSegment]]:
+        """Recover complete entries, oldest first so recent ones are evicted last"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        entries = []
+        for path in self.root.rglob("*"):
+            if not path.is_file():
+                continue
+            if path.name.startswith(".tmp-"):
+                # Interrupted write
+                path.unlink(missing_ok=True)
+                continue
+            if path.suffix != ".meta":
+                continue
+            body_path = path.with_suffix(".seg")
+            try:
+                meta = json.loads(path.read_text())
+                body_stat = body_path.stat()
+                size = body_stat.st_size
+            except (OSError, ValueError):
+                path.unlink(missing_ok=True)
+                body_path.unlink(missing_ok=True)
+                continue
+            if meta.get("expires_at", 0) <= now or size != meta.get("size"):
+                path.unlink(missing_ok=True)
+                body_path.unlink(missing_ok=True)
+                continue
+            entries.append((body_stat.st_mtime, meta["url"], DiskSegment(body_path, size, meta["media_type"], meta["expires_at"])))
+        entries.sort(key=lambda item: item[0])
+
+        # Bodies whose sidecar never made it to disk
+        indexed = {entry.path for _, _, entry in entries}
+        for body_path in self.root.rglob("*.seg"):
+            if body_path not in indexed:
+                body_path.unlink(missing_ok=True)
+        return [(url, entry) for _, url, entry in entries]
+
+    def _paths(self, url: str) -> Tuple[Path, Path]:
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        directory = self.root / digest[:2]
+        return directory / f"{digest}.seg", directory / f"{digest}.meta"
+
+    def get(self, url: str) -> Optional[DiskSegment]:
+        """Fresh entry for url, marked most recently used"""
+        entry = self._index.get(url)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if entry.expires_at <= time.time():
+            self._forget(url)
+            self._schedule_unlink(entry)
+            self.stats["misses"] += 1
+            return None
+        self._index.move_to_end(url)
+        self.stats["hits"] += 1
+        return entry
+
+    def discard(self, url: str):
+        """Drop the entry for url, e.g. when its file turned out to be missing"""
+        if url in self._index:
+            self._schedule_unlink(self._forget(url))
+
+    def put(self, url: str, body: bytes, media_type: str, ttl: float):
+        """Write a segment in the background; the entry is visible once durable"""
+        if url in self._index or url in self._pending or url in self._writers or len(body) > self.max_bytes:
+            return
+        task = asyncio.create_task(self._write(url, body, media_type, time.time() + ttl))
+        self._pending[url] = task
+        task.add_done_callback(lambda _: self._pending.pop(url, None))
+
+    async def _write(self, url: str, body: bytes, media_type: str, expires_at: float):
+        body_path, meta_path = self._paths(url)
+        meta = {"url": url, "media_type": media_type, "size": len(body), "expires_at": expires_at}
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self._write_files, body_path, meta_path, body, meta)
+        except OSError as e:
+            self.stats["write_errors"] += 1
+            logger.warning(f"Segment store write failed for {url}: {e}")
+            return
+
+        await self._add(url, DiskSegment(body_path, len(body), media_type, expires_at))
+
+    def open_writer(self, url: str, media_type: str, ttl: float, size: Optional[int] = None) -> Optional[SegmentWriter]:
+        """Writer for a body relayed chunk by chunk; None when url is stored, being written or too large"""
+        if url in self._index or url in self._pending or url in self._writers:
+            return None
+        if size is not None and size > self.max_bytes:
+            return None
+        self._writers.add(url)
+        return SegmentWriter(self, url, media_type, time.time() + ttl)
+
+    async def _add(self, url: str, entry: DiskSegment):
+        self._index[url] = entry
+        self.size += entry.size
+        self.stats["stores"] += 1
+        await self._evict()
+
+    @staticmethod
+    def _write_files(body_path: Path, meta_path: Path, body: bytes, meta: Dict[str, Any]):
+        body_path.parent.mkdir(parents=True, exist_ok=True)
+        for path, data in ((body_path, body), (meta_path, json.dumps(meta).encode())):
+            tmp_path = path.parent / f".tmp-{uuid.uuid4().hex}"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+    def _open_tmp(self, url: str):
+        body_path, _ = self._paths(url)
+        body_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = body_path.parent / f".tmp-{uuid.uuid4().hex}"
+        return tmp_path, open(tmp_path, "wb")
+
+    @staticmethod
+    def _finish_files(f, tmp_path: Path, body_path: Path, meta_path: Path, meta: Dict[str, Any]):
+        # Same order as _write_files: durable body, then its sidecar
+        with f:
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, body_path)
+        meta_tmp_path = meta_path.parent / f".tmp-{uuid.uuid4().hex}"
+        with open(meta_tmp_path, "wb") as meta_file:
+            meta_file.write(json.dumps(meta).encode())
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.replace(meta_tmp_path, meta_path)
+
+    @staticmethod
+    def _discard_tmp(f, tmp_path: Path):
+        f.close()
+        tmp_path.unlink(missing_ok=True)
+
+    async def _evict(self):
+        victims = []
+        while self.size > self.max_bytes and self._index:
+            url = next(iter(self._index))
+            victims.append(self._forget(url))
+            self.stats["evictions"] += 1
+        if victims:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._unlink, victims)
+
+    def _forget(self, url: str) -> DiskSegment:
+        entry = self._index.pop(url)
+        self.size -= entry.size
+        return entry
+
+    def _schedule_unlink(self, entry: DiskSegment):
+        asyncio.get_running_loop().run_in_executor(None, self._unlink, [entry])
+
+    @staticmethod
+    def _unlink(entries: List[DiskSegment]):
+        # Sidecar first: a body without one is discarded on the next scan
+        for entry in entries:
+            entry.path.with_suffix(".meta").unlink(missing_ok=True)
+            entry.path.unlink(missing_ok=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters and current disk use"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._index),
+            "size_bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "pending_writes": len(self._pending) + len(self._writers)
+        }
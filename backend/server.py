@@ -1,21 +1,45 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Response
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Response, Header, Request, Query
 from fastapi.responses import StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
 import os
 import logging
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Type
 import uuid
 from datetime import datetime, timedelta
 import base64
+import hashlib
+import hmac
+import csv
+import io
+import orjson
 from urllib.parse import unquote
 
 # Import our custom modules
 from models import *
 from auth import *
-from iptv_generator import IPTVGenerator, StreamProxy
+from iptv_generator import IPTVGenerator, StreamProxy, StreamProxyError
+from upstream import UpstreamClient
+from stream_cache import SegmentCache
+from fetch_coalescer import FetchCoalescer
+from hls import ManifestCache
+from prefetch import SegmentPrefetcher
+from segment_store import DiskSegmentStore
+from source_health import SourceSelector
+from stream_sessions import StreamSessionRegistry
+from stream_tokens import StreamTokenCodec
+from channel_directory import ChannelDirectory, DELETED_CHANNEL, stamp
+from access_codes import AccessCodeResolver, AccessCodeMinter, ResolvedAccessCode
+from expiry import ExpirySweeper
+from indexes import ensure_indexes, audit_query_plans
+from usage import UsageRecorder, USAGE_SCOPES, WriteBehindCounters
+from playlist_cache import PlaylistCache, RenderedPlaylist, etag_matches, choose_encoding
+from pagination import (
+    NDJSON_MEDIA_TYPE, KEYSET_SORT, model_projection, encode_cursor, keyset_query, ndjson_rows, trusted_list_response
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -26,15 +50,213 @@ client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
 # Initialize services
-iptv_generator = IPTVGenerator(os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001'))
-stream_proxy = StreamProxy()
+upstream_client = UpstreamClient(
+    limit=int(os.environ.get('UPSTREAM_POOL_LIMIT', 1000)),
+    limit_per_host=int(os.environ.get('UPSTREAM_POOL_LIMIT_PER_HOST', 100)),
+    dns_cache_ttl=int(os.environ.get('UPSTREAM_DNS_CACHE_TTL', 300)),
+    keepalive_timeout=float(os.environ.get('UPSTREAM_KEEPALIVE_TIMEOUT', 30)),
+    connect_timeout=float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 10)),
+    read_timeout=float(os.environ.get('UPSTREAM_READ_TIMEOUT', 30)),
+    max_queue_per_host=int(os.environ.get('UPSTREAM_MAX_QUEUE_PER_HOST', 200)),
+    queue_timeout=float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 5)),
+    retry_after=int(os.environ.get('UPSTREAM_RETRY_AFTER', 2))
+)
+# STREAM_TOKEN_KEYS is "key_id:secret,..." with key ids 0-255; retired keys stay
+# listed until their tokens expire. The codec refuses to start with other ids
+stream_token_keys = {
+    int(key_id): secret.encode()
+    for key_id, _, secret in (
+        item.partition(':') for item in os.environ.get('STREAM_TOKEN_KEYS', '').split(',') if item
+    )
+}
+if not stream_token_keys:
+    # Never the JWT secret itself, so a leaked stream key cannot sign API tokens
+    logging.getLogger(__name__).warning(
+        "STREAM_TOKEN_KEYS is not set; stream tokens are signed with a key derived from SECRET_KEY"
+    )
+    stream_token_keys = {1: hmac.new(SECRET_KEY.encode(), b"stream-tokens", hashlib.sha256).digest()}
+stream_tokens = StreamTokenCodec(
+    stream_token_keys,
+    active_key_id=int(os.environ.get('STREAM_TOKEN_KEY_ID', max(stream_token_keys))),
+    cache_size=int(os.environ.get('STREAM_TOKEN_CACHE_SIZE', 100000)),
+    # v1 tokens are signed with a public constant; enable only for a short cutover
+    accept_v1=os.environ.get('STREAM_TOKEN_ACCEPT_V1', 'false').lower() == 'true',
+    playlist_expiry_step=int(os.environ.get('STREAM_TOKEN_PLAYLIST_EXPIRY_STEP', 3600))
+)
+iptv_generator = IPTVGenerator(
+    os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001'),
+    upstream=upstream_client,
+    tokens=stream_tokens,
+    playlist_tokens=os.environ.get('PLAYLIST_SCOPED_TOKENS', 'true').lower() == 'true',
+    channel_urls=os.environ.get('PLAYLIST_CHANNEL_URLS', 'true').lower() == 'true'
+)
+segment_cache = SegmentCache(
+    max_bytes=int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+    max_entry_bytes=int(os.environ.get('SEGMENT_CACHE_MAX_ENTRY_BYTES', 8 * 1024 * 1024)),
+    default_ttl=float(os.environ.get('SEGMENT_CACHE_DEFAULT_TTL', 30)),
+    immutable_ttl=float(os.environ.get('SEGMENT_CACHE_IMMUTABLE_TTL', 600))
+)
+# Shared fetches keep whole bodies up to the same size the cache accepts
+fetch_coalescer = FetchCoalescer(max_buffer_bytes=segment_cache.max_entry_bytes)
+manifest_cache = ManifestCache(
+    max_entries=int(os.environ.get('MANIFEST_CACHE_MAX_ENTRIES', 10000)),
+    master_ttl=float(os.environ.get('MANIFEST_CACHE_MASTER_TTL', 30)),
+    endlist_ttl=float(os.environ.get('MANIFEST_CACHE_ENDLIST_TTL', 300))
+)
+# Optional disk tier behind the memory cache; enabled by SEGMENT_DISK_CACHE_DIR
+segment_store = None
+if os.environ.get('SEGMENT_DISK_CACHE_DIR'):
+    segment_store = DiskSegmentStore(
+        os.environ['SEGMENT_DISK_CACHE_DIR'],
+        max_bytes=int(os.environ.get('SEGMENT_DISK_CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+    )
+source_selector = SourceSelector(
+    window_seconds=float(os.environ.get('SOURCE_HEALTH_WINDOW', 60)),
+    error_penalty=float(os.environ.get('SOURCE_HEALTH_ERROR_PENALTY', 5))
+)
+# Channel URLs and playlist membership that stream tokens are checked against;
+# keeps the mirror sets in source_selector current across workers
+channel_directory = ChannelDirectory(
+    db.channels,
+    db.playlists,
+    refresh_interval=float(os.environ.get('CHANNEL_DIRECTORY_REFRESH_INTERVAL', 60)),
+    sources=source_selector,
+    deletions=db.directory_deletions,
+    full_reload_interval=float(os.environ.get('CHANNEL_DIRECTORY_FULL_RELOAD_INTERVAL', 3600))
+)
+stream_sessions = StreamSessionRegistry(
+    idle_timeout=float(os.environ.get('STREAM_SESSION_IDLE_TIMEOUT', 30))
+)
+# Bandwidth and watch time, written behind to the usage collection
+usage_recorder = UsageRecorder(
+    db.usage,
+    stream_sessions,
+    flush_interval=float(os.environ.get('USAGE_FLUSH_INTERVAL', 30))
+)
+stream_proxy = StreamProxy(
+    upstream=upstream_client,
+    cache=segment_cache,
+    coalescer=fetch_coalescer,
+    manifests=manifest_cache,
+    disk=segment_store,
+    sources=source_selector,
+    sessions=stream_sessions,
+    tokens=stream_tokens,
+    directory=channel_directory,
+    chunk_size=int(os.environ.get('STREAM_CHUNK_SIZE', 64 * 1024))
+)
+
+# Optional live HLS prefetching; HLS_PREFETCH_CHANNEL_DEPTHS is "channel_id:depth,..."
+segment_prefetcher = None
+if int(os.environ.get('HLS_PREFETCH_DEPTH', 0)) > 0:
+    segment_prefetcher = SegmentPrefetcher(
+        stream_proxy.warm_segment,
+        depth=int(os.environ.get('HLS_PREFETCH_DEPTH', 0)),
+        channel_depths={
+            channel_id: int(depth)
+            for channel_id, _, depth in (
+                item.partition(':') for item in os.environ.get('HLS_PREFETCH_CHANNEL_DEPTHS', '').split(',') if item
+            )
+        },
+        max_concurrency=int(os.environ.get('HLS_PREFETCH_MAX_CONCURRENCY', 16)),
+        max_bytes_per_second=int(os.environ.get('HLS_PREFETCH_MAX_BYTES_PER_SECOND', 0)),
+        idle_timeout=float(os.environ.get('HLS_PREFETCH_IDLE_TIMEOUT', 60))
+    )
+    stream_proxy.prefetcher = segment_prefetcher
+
+# Rendered playlists served to repeat fetches of an access code
+playlist_cache = PlaylistCache(
+    max_bytes=int(os.environ.get('PLAYLIST_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    max_entry_bytes=int(os.environ.get('PLAYLIST_CACHE_MAX_ENTRY_BYTES', 16 * 1024 * 1024)),
+    ttl=float(os.environ.get('PLAYLIST_CACHE_TTL', 3600)),
+    gzip_level=int(os.environ.get('PLAYLIST_GZIP_LEVEL', 6)),
+    brotli_quality=int(os.environ.get('PLAYLIST_BROTLI_QUALITY', 5))
+)
 
+# current_uses increments of unlimited access codes, flushed in one bulk write
+access_code_usage = WriteBehindCounters(
+    db.access_codes,
+    flush_interval=int(os.environ.get('ACCESS_CODE_USAGE_FLUSH_MS', 1000)) / 1000,
+    upsert=False
+)
+# Access code -> playlist resolutions reused by repeat playlist exports
+access_code_resolver = AccessCodeResolver(
+    db.access_codes,
+    ttl=float(os.environ.get('ACCESS_CODE_CACHE_TTL', 30)),
+    max_entries=int(os.environ.get('ACCESS_CODE_CACHE_MAX_ENTRIES', 100000)),
+    usage=access_code_usage
+)
+
+access_code_minter = AccessCodeMinter(
+    db.access_codes,
+    chunk_size=int(os.environ.get('ACCESS_CODE_BULK_CHUNK_SIZE', 1000))
+)
+ACCESS_CODE_CSV_FIELDS = ["id", "code", "playlist_id", "expires_at", "max_uses"]
+
+# Expired codes are deactivated at once; codes and playlists past their grace period are archived, then deleted
+expiry_archive = os.environ.get('EXPIRY_ARCHIVE', 'true').lower() == 'true'
+expiry_sweeper = ExpirySweeper(
+    db.access_codes,
+    db.playlists,
+    access_codes_archive=db.access_codes_archive if expiry_archive else None,
+    playlists_archive=db.playlists_archive if expiry_archive else None,
+    interval=float(os.environ.get('EXPIRY_SWEEP_INTERVAL', 300)),
+    code_grace=float(os.environ.get('ACCESS_CODE_EXPIRY_GRACE', 7 * 86400)),
+    playlist_grace=float(os.environ.get('PLAYLIST_EXPIRY_GRACE', 7 * 86400)),
+    batch_size=int(os.environ.get('EXPIRY_SWEEP_BATCH_SIZE', 500)),
+    max_batches=int(os.environ.get('EXPIRY_SWEEP_MAX_BATCHES', 20)),
+    batch_pause=float(os.environ.get('EXPIRY_SWEEP_BATCH_PAUSE', 0.1)),
+    access_code_resolver=access_code_resolver,
+    playlist_cache=playlist_cache,
+    channel_directory=channel_directory
+)
+
+# Channels fetched per cursor batch, and rendered per response chunk, by streamed playlists
+PLAYLIST_CURSOR_BATCH_SIZE = int(os.environ.get('PLAYLIST_CURSOR_BATCH_SIZE', 500))
+
+# List endpoints: default and largest JSON page, and rows per cursor batch when streaming NDJSON
+LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 1000))
+LIST_MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE', 10000))
+LIST_CURSOR_BATCH_SIZE = int(os.environ.get('LIST_CURSOR_BATCH_SIZE', 1000))
 # Create the main app without a prefix
 app = FastAPI(title="Secure IPTV Manager", version="1.0.0")
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+async def list_documents(request: Request, collection, model: Type[BaseModel], query: Dict[str, Any],
+                         limit: Optional[int], after: Optional[str]) -> Response:
+    """One keyset page of a collection as a JSON array, or NDJSON rows streamed from the cursor
+
+    Pages are ordered on (created_at, id); a full page carries the cursor of
+    the next one in X-Next-Cursor. NDJSON (Accept: application/x-ndjson)
+    streams every row after the cursor unless limit is given.
+    """
+    try:
+        query = keyset_query(query, after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    cursor = collection.find(query, model_projection(model)).sort(KEYSET_SORT)
+    
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        if limit:
+            cursor = cursor.limit(limit)
+        return StreamingResponse(
+            ndjson_rows(model, cursor.batch_size(LIST_CURSOR_BATCH_SIZE), LIST_CURSOR_BATCH_SIZE),
+            media_type=NDJSON_MEDIA_TYPE
+        )
+    
+    limit = limit or LIST_PAGE_SIZE
+    docs = await cursor.limit(limit).to_list(limit)
+    response = trusted_list_response(model, docs)
+    if len(docs) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    return response
+
+def trusted_channel(doc: Dict[str, Any]) -> IPTVChannel:
+    """IPTVChannel for a stored document, skipping validation"""
+    return IPTVChannel.model_construct(**{**doc, "category": ChannelCategory(doc["category"])})
+
 # =======================
 # AUTHENTICATION ROUTES
 # =======================
@@ -135,14 +357,19 @@ async def create_channel(
         raise HTTPException(status_code=400, detail=f"Invalid stream URL: {validation.get('error', 'URL not accessible')}")
     
     channel = IPTVChannel(**channel_data.dict(), created_by=current_user.id)
-    await db.channels.insert_one(channel.dict())
+    await db.channels.insert_one(stamp(channel.dict()))
+    channel_directory.put_channel(channel.id, channel.url, channel.mirror_urls)
+    playlist_cache.invalidate_channels([channel.id])
     
     return channel
 
 @api_router.get("/channels", response_model=List[IPTVChannel])
 async def get_channels(
+    request: Request,
     category: Optional[ChannelCategory] = None,
     country: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     """Get IPTV channels with optional filtering"""
@@ -153,8 +380,7 @@ async def get_channels(
     if country:
         query["country"] = country
     
-    channels_docs = await db.channels.find(query).to_list(1000)
-    return [IPTVChannel(**doc) for doc in channels_docs]
+    return await list_documents(request, db.channels, IPTVChannel, query, limit, after)
 
 @api_router.delete("/channels/{channel_id}")
 async def delete_channel(
@@ -165,6 +391,10 @@ async def delete_channel(
     result = await db.channels.delete_one({"id": channel_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Channel not found")
+    await channel_directory.record_deletions(DELETED_CHANNEL, [channel_id])
+    # Other workers see the change through the playlist version
+    await db.playlists.update_many({"channels": channel_id}, {"$inc": {"version": 1}})
+    playlist_cache.invalidate_channels([channel_id])
     
     return {"message": "Channel deleted successfully"}
 
@@ -178,7 +408,9 @@ async def create_bulk_channels(
     
     # Insert to database
     for channel in created_channels:
-        await db.channels.insert_one(channel.dict())
+        await db.channels.insert_one(stamp(channel.dict()))
+        channel_directory.put_channel(channel.id, channel.url, channel.mirror_urls)
+    playlist_cache.invalidate_channels([channel.id for channel in created_channels])
     
     return created_channels
 
@@ -210,15 +442,52 @@ async def create_playlist(
         expiry_date=expiry_date
     )
     
-    await db.playlists.insert_one(playlist.dict())
+    await db.playlists.insert_one(stamp(playlist.dict()))
+    channel_directory.put_playlist(playlist.id, playlist.channels)
     return playlist
 
+@api_router.put("/playlists/{playlist_id}", response_model=Playlist)
+async def update_playlist(
+    playlist_id: str,
+    playlist_data: PlaylistUpdate,
+    current_user: User = Depends(require_role(UserRole.USER))
+):
+    """Update playlist"""
+    playlist_doc = await db.playlists.find_one({"id": playlist_id})
+    if not playlist_doc:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    
+    playlist = Playlist(**playlist_doc)
+    if playlist.created_by != current_user.id and current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Access denied to this playlist")
+    
+    # Explicit nulls leave a field unchanged rather than blanking it in Mongo
+    changes = playlist_data.dict(exclude_unset=True, exclude_none=True)
+    for channel_id in changes.get("channels", []):
+        channel = await db.channels.find_one({"id": channel_id, "is_active": True})
+        if not channel:
+            raise HTTPException(status_code=400, detail=f"Channel {channel_id} not found or inactive")
+    
+    updated = await db.playlists.find_one_and_update(
+        {"id": playlist_id},
+        {"$set": stamp(changes), "$inc": {"version": 1}},
+        return_document=True
+    )
+    playlist_cache.invalidate_playlist(playlist_id)
+    access_code_resolver.invalidate_playlist(playlist_id)
+    channel_directory.put_playlist(playlist_id, updated["channels"])
+    return Playlist(**updated)
+
 @api_router.get("/playlists", response_model=List[Playlist])
-async def get_playlists(current_user: User = Depends(get_current_user)):
+async def get_playlists(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     """Get user's playlists"""
     query = {"created_by": current_user.id} if current_user.role != UserRole.ADMIN else {}
-    playlists_docs = await db.playlists.find(query).to_list(1000)
-    return [Playlist(**doc) for doc in playlists_docs]
+    return await list_documents(request, db.playlists, Playlist, query, limit, after)
 
 # =======================
 # ACCESS CODE GENERATION
@@ -254,113 +523,331 @@ async def generate_access_code(
     await db.access_codes.insert_one(access_code.dict())
     return access_code
 
+@api_router.post("/access-codes/bulk")
+async def generate_access_codes_bulk(
+    code_data: AccessCodeBulkCreate,
+    request: Request,
+    current_user: User = Depends(require_role(UserRole.USER))
+):
+    """Generate many access codes for a playlist, streamed as NDJSON or CSV (Accept: text/csv)
+
+    Codes are inserted batch by batch as the response is written. The first
+    batch is stored before the response starts, so a request that stores no
+    code at all fails with a 500. A later failure ends the body with an
+    error record (an NDJSON object with "error", or a CSV "# error" trailer
+    line) giving the number of codes already stored. A client that
+    disconnects leaves every code inserted so far in place.
+    """
+    playlist = await db.playlists.find_one({"id": code_data.playlist_id}, {"_id": 0, "created_by": 1})
+    if not playlist:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    if playlist.get("created_by") != current_user.id and current_user.role != UserRole.ADMIN:
+        raise HTTPException(status_code=403, detail="Access denied to this playlist")
+    
+    template = AccessCode(
+        code="",
+        playlist_id=code_data.playlist_id,
+        created_by=current_user.id,
+        expires_at=datetime.utcnow() + timedelta(hours=code_data.expiry_hours or 24),
+        max_uses=code_data.max_uses
+    ).dict()
+    # The first batch is stored before the response starts, so a request
+    # that stores nothing fails with a 5xx rather than a 200
+    batches = access_code_minter.mint(template, code_data.count)
+    try:
+        first_batch = await batches.__anext__()
+    except Exception as e:
+        logger.error(f"Bulk mint for playlist {code_data.playlist_id} failed before any code was stored: {e}")
+        raise HTTPException(status_code=500, detail="Access code generation failed")
+    outcome = {"minted": len(first_batch), "error": None}
+    
+    async def minted_batches():
+        """Stored batches; a failure ends them and is recorded in outcome"""
+        try:
+            yield first_batch
+            async for docs in batches:
+                outcome["minted"] += len(docs)
+                yield docs
+        except (asyncio.CancelledError, GeneratorExit):
+            logger.warning(
+                f"Bulk mint for playlist {code_data.playlist_id} interrupted by the client "
+                f"after {outcome['minted']} of {code_data.count} codes"
+            )
+            raise
+        except Exception as e:
+            outcome["error"] = str(e) or type(e).__name__
+            logger.error(
+                f"Bulk mint for playlist {code_data.playlist_id} failed "
+                f"after {outcome['minted']} of {code_data.count} codes: {outcome['error']}"
+            )
+        finally:
+            await batches.aclose()
+    
+    if "text/csv" in request.headers.get("accept", ""):
+        async def csv_rows():
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, ACCESS_CODE_CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            async for docs in minted_batches():
+                writer.writerows(docs)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if outcome["error"] is not None:
+                yield f"# error: {outcome['error']} (minted {outcome['minted']} of {code_data.count})\r\n"
+        return StreamingResponse(
+            csv_rows(), media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="access-codes-{code_data.playlist_id}.csv"'}
+        )
+    
+    async def ndjson_batches():
+        async for docs in minted_batches():
+            yield b"".join(orjson.dumps(doc) + b"\n" for doc in docs)
+        if outcome["error"] is not None:
+            yield orjson.dumps({
+                "error": outcome["error"],
+                "minted": outcome["minted"],
+                "requested": code_data.count
+            }) + b"\n"
+    return StreamingResponse(ndjson_batches(), media_type=NDJSON_MEDIA_TYPE)
+
 @api_router.get("/access-codes", response_model=List[AccessCode])
-async def get_access_codes(current_user: User = Depends(get_current_user)):
+async def get_access_codes(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     """Get user's access codes"""
     query = {"created_by": current_user.id} if current_user.role != UserRole.ADMIN else {}
-    codes_docs = await db.access_codes.find(query).to_list(1000)
-    return [AccessCode(**doc) for doc in codes_docs]
+    return await list_documents(request, db.access_codes, AccessCode, query, limit, after)
 
 # =======================
 # PLAYLIST EXPORT & STREAMING
 # =======================
 
-@api_router.get("/playlist/{access_code}/m3u8")
-async def get_m3u8_playlist(access_code: str):
-    """Get M3U8 playlist using access code"""
-    # Validate access code
-    code_doc = await db.access_codes.find_one({"code": access_code, "is_active": True})
-    if not code_doc:
+def rendered_playlist_response(request: Request, rendered: RenderedPlaylist) -> Response:
+    """Cached render as 304, precompressed or identity response"""
+    headers = {
+        "ETag": rendered.etag,
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "private, no-cache"
+    }
+    if etag_matches(request.headers.get("if-none-match"), rendered.etag):
+        return Response(status_code=304, headers=headers)
+    
+    encoding = choose_encoding(request.headers.get("accept-encoding"), rendered.encodings)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        return Response(content=rendered.encodings[encoding], media_type=rendered.media_type, headers=headers)
+    return Response(content=rendered.body, media_type=rendered.media_type, headers=headers)
+
+async def use_access_code(access_code: str) -> ResolvedAccessCode:
+    """Resolve an access code for a playlist export and count the use"""
+    resolved = await access_code_resolver.resolve(access_code)
+    if resolved is None:
         raise HTTPException(status_code=404, detail="Invalid access code")
     
-    access_code_obj = AccessCode(**code_doc)
-    
     # Check expiry
+    access_code_obj = resolved.access_code
     if access_code_obj.expires_at and datetime.utcnow() > access_code_obj.expires_at:
         raise HTTPException(status_code=410, detail="Access code expired")
     
-    # Check usage limit
-    if access_code_obj.max_uses and access_code_obj.current_uses >= access_code_obj.max_uses:
-        raise HTTPException(status_code=429, detail="Access code usage limit exceeded")
-    
-    # Get playlist and channels
-    playlist_doc = await db.playlists.find_one({"id": access_code_obj.playlist_id})
-    if not playlist_doc:
+    if resolved.playlist is None:
         raise HTTPException(status_code=404, detail="Playlist not found")
+    if resolved.playlist.expiry_date and datetime.utcnow() > resolved.playlist.expiry_date:
+        raise HTTPException(status_code=410, detail="Playlist expired")
     
-    playlist = Playlist(**playlist_doc)
-    
-    # Get channels
-    channels_docs = await db.channels.find({"id": {"$in": playlist.channels}, "is_active": True}).to_list(1000)
-    channels = [IPTVChannel(**doc) for doc in channels_docs]
-    
-    # Generate M3U8
-    m3u8_content = await iptv_generator.generate_m3u8_playlist(
-        playlist, channels, access_code_obj.created_by, secure=True
+    # Usage limit is checked and counted in one conditional update
+    if resolved.exhausted or not await access_code_resolver.count_use(resolved):
+        if resolved.exhausted:
+            raise HTTPException(status_code=429, detail="Access code usage limit exceeded")
+        raise HTTPException(status_code=404, detail="Invalid access code")
+    return resolved
+
+@api_router.get("/playlist/{access_code}/m3u8")
+async def get_m3u8_playlist(access_code: str, request: Request):
+    """Get M3U8 playlist using access code"""
+    resolved = await use_access_code(access_code)
+    access_code_obj = resolved.access_code
+    playlist = resolved.playlist
+    
+    # Repeat fetches are served from the rendered playlist cache
+    version = playlist_cache.version(playlist.id, playlist.version)
+    cached = playlist_cache.get(playlist.id, version, "m3u8", access_code)
+    if cached is not None:
+        return rendered_playlist_response(request, cached)
+    
+    # Channels are rendered as cursor batches arrive, so large playlists
+    # start immediately and are never held in memory whole
+    cursor = db.channels.find(
+        {"id": {"$in": playlist.channels}, "is_active": True}
+    ).batch_size(PLAYLIST_CURSOR_BATCH_SIZE)
+    channels = (IPTVChannel(**doc) async for doc in cursor)
+    
+    body = iptv_generator.stream_m3u8_playlist(
+        playlist, channels, access_code_obj.created_by, secure=True,
+        access_code_id=access_code_obj.id, batch_size=PLAYLIST_CURSOR_BATCH_SIZE
     )
-    
-    # Update usage count
-    await db.access_codes.update_one(
-        {"id": access_code_obj.id},
-        {"$inc": {"current_uses": 1}}
+    return StreamingResponse(
+        playlist_cache.tee(
+            body, playlist.id, version, "m3u8", access_code,
+            "application/vnd.apple.mpegurl", playlist.channels
+        ),
+        media_type="application/vnd.apple.mpegurl"
     )
-    
-    return PlainTextResponse(content=m3u8_content, media_type="application/vnd.apple.mpegurl")
 
 @api_router.get("/playlist/{access_code}/json")
-async def get_json_playlist(access_code: str):
+async def get_json_playlist(access_code: str, request: Request):
     """Get JSON playlist using access code"""
     # Same validation as M3U8
-    code_doc = await db.access_codes.find_one({"code": access_code, "is_active": True})
-    if not code_doc:
-        raise HTTPException(status_code=404, detail="Invalid access code")
-    
-    access_code_obj = AccessCode(**code_doc)
-    
-    if access_code_obj.expires_at and datetime.utcnow() > access_code_obj.expires_at:
-        raise HTTPException(status_code=410, detail="Access code expired")
-    
-    playlist_doc = await db.playlists.find_one({"id": access_code_obj.playlist_id})
-    playlist = Playlist(**playlist_doc)
-    
-    channels_docs = await db.channels.find({"id": {"$in": playlist.channels}, "is_active": True}).to_list(1000)
-    channels = [IPTVChannel(**doc) for doc in channels_docs]
-    
-    json_playlist = await iptv_generator.generate_json_playlist(
-        playlist, channels, access_code_obj.created_by
+    resolved = await use_access_code(access_code)
+    access_code_obj = resolved.access_code
+    playlist = resolved.playlist
+    
+    version = playlist_cache.version(playlist.id, playlist.version)
+    cached = playlist_cache.get(playlist.id, version, "json", access_code)
+    if cached is not None:
+        return rendered_playlist_response(request, cached)
+    
+    channels_query = {"id": {"$in": playlist.channels}, "is_active": True}
+    total_channels = await db.channels.count_documents(channels_query)
+    
+    # Rendered from the cursor like the M3U8 export, at constant memory
+    cursor = db.channels.find(
+        channels_query, model_projection(IPTVChannel)
+    ).batch_size(PLAYLIST_CURSOR_BATCH_SIZE)
+    channels = (trusted_channel(doc) async for doc in cursor)
+    
+    body = iptv_generator.stream_json_playlist(
+        playlist, channels, total_channels, access_code_obj.created_by,
+        access_code_id=access_code_obj.id, batch_size=PLAYLIST_CURSOR_BATCH_SIZE
     )
-    
-    await db.access_codes.update_one(
-        {"id": access_code_obj.id},
-        {"$inc": {"current_uses": 1}}
+    return StreamingResponse(
+        playlist_cache.tee(
+            body, playlist.id, version, "json", access_code,
+            "application/json", playlist.channels
+        ),
+        media_type="application/json"
     )
-    
-    return json_playlist
 
 # =======================
 # STREAM PROXY ROUTES
 # =======================
 
+# Addresses of the reverse proxies whose X-Forwarded-For is believed; none by default.
+# Used only to tell viewers apart
+STREAM_TRUSTED_PROXIES = {
+    item.strip() for item in os.environ.get('STREAM_TRUSTED_PROXIES', '').split(',') if item.strip()
+}
+
+def stream_viewer(request: Request) -> Tuple[str, str]:
+    """Client address and device of a stream request, for session accounting"""
+    client = request.client.host if request.client else ""
+    if client in STREAM_TRUSTED_PROXIES:
+        # Hops appended by trusted proxies are skipped; the rest is the viewer's to forge
+        forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        while forwarded and client in STREAM_TRUSTED_PROXIES:
+            client = forwarded.pop()
+        if client in STREAM_TRUSTED_PROXIES:
+            client = request.headers.get("x-real-ip", "") or client
+    user_agent = request.headers.get("user-agent", "")
+    device = hashlib.blake2b(user_agent.encode(), digest_size=6).hexdigest() if user_agent else ""
+    return client, device
+
+def proxied_stream_response(stream) -> Response:
+    """Relay an opened proxy stream to the client"""
+    headers = {
+        **stream.headers,
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": "no-cache"
+    }
+    return StreamingResponse(
+        stream.body,
+        status_code=stream.status_code,
+        media_type=stream.media_type,
+        headers=headers
+    )
+
+@api_router.get("/stream/c/{token}/{channel_id}")
+async def proxy_channel_stream(
+    token: str,
+    channel_id: str,
+    request: Request,
+    range_header: Optional[str] = Header(None, alias="Range")
+):
+    """Proxy a channel by id; the upstream URL stays on the server"""
+    client, device = stream_viewer(request)
+    try:
+        stream = await stream_proxy.proxy_channel(
+            token,
+            channel_id,
+            range_header=range_header,
+            client=client,
+            device=device
+        )
+    except StreamProxyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers or None)
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    
+    return proxied_stream_response(stream)
+
+@api_router.get("/stream/c/{token}/{channel_id}/{signature}/{encoded_url}")
+async def proxy_manifest_uri_stream(
+    token: str,
+    channel_id: str,
+    signature: str,
+    encoded_url: str,
+    request: Request,
+    range_header: Optional[str] = Header(None, alias="Range")
+):
+    """Proxy a variant, segment or key URI of a channel's manifest"""
+    client, device = stream_viewer(request)
+    try:
+        stream = await stream_proxy.proxy_manifest_uri(
+            token,
+            channel_id,
+            signature,
+            unquote(encoded_url),
+            range_header=range_header,
+            client=client,
+            device=device
+        )
+    except StreamProxyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers or None)
+    except Exception as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    
+    return proxied_stream_response(stream)
+
 @api_router.get("/stream/proxy/{token}/{encoded_url}")
-async def proxy_stream(token: str, encoded_url: str):
+async def proxy_stream(
+    token: str,
+    encoded_url: str,
+    request: Request,
+    range_header: Optional[str] = Header(None, alias="Range")
+):
     """Proxy stream through our server for security"""
+    client, device = stream_viewer(request)
     try:
         # Decode URL
         decoded_url = unquote(encoded_url)
         
-        # Proxy the stream
-        stream_data = await stream_proxy.proxy_stream(token, decoded_url)
-        
-        return StreamingResponse(
-            iter([stream_data]),
-            media_type="video/mp2t",
-            headers={
-                "Access-Control-Allow-Origin": "*",
-                "Cache-Control": "no-cache"
-            }
+        # Open the upstream stream; chunks are relayed as they arrive
+        stream = await stream_proxy.proxy_stream(
+            token,
+            decoded_url,
+            range_header=range_header,
+            client=client,
+            device=device
         )
+    except StreamProxyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers or None)
     except Exception as e:
         raise HTTPException(status_code=403, detail=str(e))
+    
+    return proxied_stream_response(stream)
 
 # =======================
 # ADMIN ROUTES
@@ -373,21 +860,95 @@ async def get_system_stats(current_user: User = Depends(admin_required)):
     total_channels = await db.channels.count_documents({"is_active": True})
     total_playlists = await db.playlists.count_documents({})
     total_access_codes = await db.access_codes.count_documents({"is_active": True})
+    streams_per_channel, streams_per_user = stream_sessions.counts()
     
     return SystemStats(
         total_users=total_users,
         total_channels=total_channels,
         total_playlists=total_playlists,
-        active_streams=0,  # TODO: Implement real-time stream counting
+        active_streams=stream_sessions.active_count,
+        streams_per_channel=streams_per_channel,
+        streams_per_user=streams_per_user,
         total_access_codes=total_access_codes,
         server_status={"status": "running", "timestamp": datetime.utcnow().isoformat()}
     )
 
+@api_router.get("/admin/proxy/stats")
+async def get_proxy_stats(current_user: User = Depends(admin_required)):
+    """Get stream proxy statistics - Admin only"""
+    return {
+        "upstream": upstream_client.get_stats(),
+        "limiter": upstream_client.limiter.get_stats(),
+        "segment_cache": segment_cache.get_stats(),
+        "coalescer": fetch_coalescer.get_stats(),
+        "manifest_cache": manifest_cache.get_stats(),
+        "prefetcher": segment_prefetcher.get_stats() if segment_prefetcher else None,
+        "disk_store": segment_store.get_stats() if segment_store else None,
+        "sources": source_selector.get_stats(),
+        "usage": usage_recorder.get_stats(),
+        "tokens": stream_tokens.get_stats(),
+        "playlist_cache": playlist_cache.get_stats(),
+        "channel_directory": channel_directory.get_stats(),
+        "access_codes": access_code_resolver.get_stats(),
+        "access_code_usage": access_code_usage.get_stats(),
+        "access_code_minter": access_code_minter.get_stats(),
+        "expiry_sweeper": expiry_sweeper.get_stats()
+    }
+
+@api_router.get("/admin/sessions")
+async def get_stream_sessions(
+    channel_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    limit: int = 1000,
+    current_user: User = Depends(admin_required)
+):
+    """Get active stream sessions - Admin only"""
+    return {
+        **stream_sessions.get_stats(),
+        "sessions": stream_sessions.list_sessions(channel_id=channel_id, user_id=user_id, limit=limit)
+    }
+
+@api_router.get("/admin/usage")
+async def get_usage(
+    scope: str = "user",
+    key: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    granularity: str = "total",
+    limit: int = 100,
+    current_user: User = Depends(admin_required)
+):
+    """Get bandwidth and watch time per user, access code or channel - Admin only"""
+    if scope not in USAGE_SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope must be one of {', '.join(USAGE_SCOPES)}")
+    if granularity not in ("total", "hour"):
+        raise HTTPException(status_code=400, detail="granularity must be total or hour")
+    
+    usage = await usage_recorder.query(scope, key=key, start=start, end=end, granularity=granularity, limit=limit)
+    return {"scope": scope, "granularity": granularity, "usage": usage}
+
+@api_router.get("/admin/indexes/audit")
+async def audit_indexes(current_user: User = Depends(admin_required)):
+    """Ensure the registered indexes and explain() the hot queries, flagging collection scans - Admin only"""
+    return {
+        **await ensure_indexes(db),
+        **await audit_query_plans(db)
+    }
+
+@api_router.post("/admin/expiry/sweep")
+async def run_expiry_sweep(current_user: User = Depends(admin_required)):
+    """Run one expiry sweep now, within the usual batch limits - Admin only"""
+    return await expiry_sweeper.sweep()
+
 @api_router.get("/admin/users", response_model=List[User])
-async def get_all_users(current_user: User = Depends(admin_required)):
+async def get_all_users(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=LIST_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: User = Depends(admin_required)
+):
     """Get all users - Admin only"""
-    users_docs = await db.users.find({}).to_list(1000)
-    return [User(**doc) for doc in users_docs]
+    return await list_documents(request, db.users, User, {}, limit, after)
 
 @api_router.put("/admin/users/{user_id}/role")
 async def update_user_role(
@@ -415,6 +976,8 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets browser clients page through list endpoints
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -424,6 +987,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_upstream_client():
+    await upstream_client.start()
+    await ensure_indexes(db)
+    # Also registers the mirror sets of multi-source channels
+    await channel_directory.start()
+    if segment_store:
+        await segment_store.start()
+    if segment_prefetcher:
+        await segment_prefetcher.start()
+    await stream_sessions.start()
+    await usage_recorder.start()
+    await access_code_usage.start()
+    await expiry_sweeper.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await channel_directory.stop()
+    await expiry_sweeper.stop()
+    await stream_sessions.stop()
+    # Final flushes before the database client goes away
+    await usage_recorder.stop()
+    await access_code_usage.stop()
+    if segment_prefetcher:
+        await segment_prefetcher.stop()
+    if segment_store:
+        # Hot segments only live in memory until evicted; keep them for the next start
+        spilled = stream_proxy.spill_cache()
+        logger.info(f"Spilled {spilled} cached segments to disk")
+        await segment_store.close()
+    await upstream_client.close()
     client.close()
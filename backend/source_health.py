@@ -0,0 +1,173 @@
+from typing import Dict, Any, Optional, List, Tuple
+from collections import deque
+import time
+
+class SourceHealth:
+    """Rolling window of time-to-first-byte and outcome samples for one source"""
+    __slots__ = ("samples", "window_seconds", "max_samples")
+
+    def __init__(self, window_seconds: float = 60.0, max_samples: int = 100):
+        self.samples: deque = deque()
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+
+    def record(self, ttfb: float, ok: bool):
+        self.samples.append((time.monotonic(), ttfb, ok))
+        if len(self.samples) > self.max_samples:
+            self.samples.popleft()
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.window_seconds
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+
+    def summary(self) -> Tuple[int, float, float]:
+        """(sample count, mean TTFB of successes in seconds, error rate)"""
+        self._prune()
+        if not self.samples:
+            return 0, 0.0, 0.0
+        successes = [ttfb for _, ttfb, ok in self.samples if ok]
+        errors = len(self.samples) - len(successes)
+        mean_ttfb = sum(successes) / len(successes) if successes else 0.0
+        return len(self.samples), mean_ttfb, errors / len(self.samples)
+
+    def score(self, error_penalty: float) -> Optional[float]:
+        """Expected cost of using this source (lower is better); None without recent data"""
+        count, mean_ttfb, error_rate = self.summary()
+        if not count:
+            return None
+        return mean_ttfb + error_rate * error_penalty
+
+class SourceGroup:
+    __slots__ = ("channel_id", "urls", "prefixes", "health")
+
+    def __init__(self, channel_id: str, urls: List[str], window_seconds: float):
+        self.channel_id = channel_id
+        # Exact source URLs, in configured order
+        self.urls = urls
+        # Directory of each source, for URIs found in its manifests
+        self.prefixes = [SourceSelector.prefix_of(url) for url in urls]
+        # Per channel, so channels sharing a directory never share a score
+        self.health = [SourceHealth(window_seconds) for _ in urls]
+
+# Mirror selection for multi-source channels
+class SourceSelector:
+    """Rank a channel's mirror URLs by recent TTFB and error rate
+
+    A channel's URL maps to its configured mirror URLs exactly, in order.
+    URIs found in a manifest fetched from one source (variant playlists,
+    segments, keys) map to the same path relative to each source's
+    directory; callers say so with ``derived``, since only they know
+    where a URI came from. Sources with recent samples and an error rate
+    below ``healthy_error_rate`` rank first, by score; sources without
+    recent samples follow in configured order, then unhealthy ones.
+    """
+    def __init__(self, window_seconds: float = 60.0, error_penalty: float = 5.0,
+                 healthy_error_rate: float = 0.5):
+        self.window_seconds = window_seconds
+        self.error_penalty = error_penalty
+        self.healthy_error_rate = healthy_error_rate
+        self._groups: Dict[str, SourceGroup] = {}
+        # Source URL -> groups listing it; several channels may share a source
+        self._url_groups: Dict[str, List[SourceGroup]] = {}
+
+    @staticmethod
+    def prefix_of(url: str) -> str:
+        return url.rsplit("/", 1)[0] + "/"
+
+    def register_channel(self, channel_id: str, urls: List[str]):
+        """Declare the ordered sources of a channel; single-source channels are ignored"""
+        self.unregister_channel(channel_id)
+        unique = list(dict.fromkeys(urls))
+        if len(unique) < 2:
+            return
+        group = self._groups[channel_id] = SourceGroup(channel_id, unique, self.window_seconds)
+        for url in unique:
+            self._url_groups.setdefault(url, []).append(group)
+
+    def unregister_channel(self, channel_id: str):
+        group = self._groups.pop(channel_id, None)
+        if group is None:
+            return
+        for url in group.urls:
+            groups = self._url_groups.get(url)
+            if groups is not None:
+                groups.remove(group)
+                if not groups:
+                    del self._url_groups[url]
+
+    def _group(self, url: str, channel_id: Optional[str]) -> Optional[SourceGroup]:
+        if channel_id is not None:
+            return self._groups.get(channel_id)
+        groups = self._url_groups.get(url)
+        return groups[0] if groups else None
+
+    def _locate(self, group: SourceGroup, url: str, derived: bool) -> Optional[Tuple[int, Optional[str]]]:
+        """(source index, path below its directory or None for the exact source URL)"""
+        if url in group.urls:
+            return group.urls.index(url), None
+        if derived:
+            # Longest directory first, so nested mirror layouts resolve correctly
+            matches = [(len(prefix), index) for index, prefix in enumerate(group.prefixes) if url.startswith(prefix)]
+            if matches:
+                length, index = max(matches, key=lambda match: (match[0], -match[1]))
+                return index, url[length:]
+        return None
+
+    def _rank_key(self, group: SourceGroup, index: int) -> Tuple[int, float, int]:
+        health = group.health[index]
+        count, _, error_rate = health.summary()
+        if not count:
+            return 1, 0.0, index
+        tier = 0 if error_rate < self.healthy_error_rate else 2
+        return tier, health.score(self.error_penalty), index
+
+    def candidates(self, url: str, channel_id: Optional[str] = None, derived: bool = False) -> List[str]:
+        """URL and its mirror equivalents, best source first
+
+        derived marks url as found in a manifest fetched from one of the
+        channel's sources.
+        """
+        group = self._group(url, channel_id)
+        located = self._locate(group, url, derived) if group is not None else None
+        if located is None:
+            return [url]
+        _, suffix = located
+
+        if suffix is None:
+            indices = range(len(group.urls))
+        else:
+            # Sources sharing a directory give the same URL; keep the first
+            seen = {}
+            for index, prefix in enumerate(group.prefixes):
+                seen.setdefault(prefix, index)
+            indices = seen.values()
+        ranked = sorted(indices, key=lambda index: self._rank_key(group, index))
+        if suffix is None:
+            return [group.urls[index] for index in ranked]
+        return [group.prefixes[index] + suffix for index in ranked]
+
+    def record(self, url: str, ttfb: float, ok: bool, channel_id: Optional[str] = None, derived: bool = False):
+        """Attribute a fetch outcome to the source serving url"""
+        group = self._group(url, channel_id)
+        located = self._locate(group, url, derived) if group is not None else None
+        if located is not None:
+            group.health[located[0]].record(ttfb, ok)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-channel source health"""
+        channels = {}
+        for channel_id, group in self._groups.items():
+            sources = []
+            for url, health in zip(group.urls, group.health):
+                count, mean_ttfb, error_rate = health.summary()
+                score = health.score(self.error_penalty)
+                sources.append({
+                    "source": url,
+                    "samples": count,
+                    "ttfb_ms": round(mean_ttfb * 1000, 1),
+                    "error_rate": round(error_rate, 4),
+                    "score": round(score, 4) if score is not None else None
+                })
+            channels[channel_id] = sources
+        return {"channels": channels}
@@ -0,0 +1,158 @@
+from typing import Dict, Any, Optional, List, Tuple, Callable
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import time
+
+# Media segment extensions; HLS segments are never rewritten once published
+IMMUTABLE_SEGMENT_EXTENSIONS = (".ts", ".m4s", ".mp4", ".m4a", ".m4v", ".aac", ".mp3", ".vtt", ".webvtt")
+
+def parse_byte_range(range_header: str, total: int) -> Optional[Tuple[int, int]]:
+    """Resolve a single-range Range header to inclusive (start, end) offsets
+
+    Returns None when the header should be ignored (malformed or multi-range,
+    answered with the full body) and raises ValueError when it is unsatisfiable.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, total - length), total - 1
+    start = int(first)
+    end = int(last) if last else total - 1
+    if start >= total:
+        raise ValueError("Unsatisfiable range")
+    if start > end:
+        return None
+    return start, min(end, total - 1)
+
+class CachedSegment:
+    __slots__ = ("body", "media_type", "expires_at")
+
+    def __init__(self, body: bytes, media_type: str, expires_at: float):
+        self.body = body
+        self.media_type = media_type
+        self.expires_at = expires_at
+
+# Segment cache shared by every viewer of a channel
+class SegmentCache:
+    """Byte-budgeted LRU cache of upstream segment bodies keyed on upstream URL"""
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, max_entry_bytes: int = 8 * 1024 * 1024,
+                 default_ttl: float = 30.0, immutable_ttl: float = 600.0):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.default_ttl = default_ttl
+        self.immutable_ttl = immutable_ttl
+        self._entries: "OrderedDict[str, CachedSegment]" = OrderedDict()
+        self.size = 0
+        # Optional callback receiving every entry evicted while still fresh
+        self.on_evict: Optional[Callable[[str, CachedSegment], None]] = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0
+        }
+
+    def ttl_for(self, url: str, cache_control: str = "") -> Optional[float]:
+        """Seconds an upstream response may be cached, or None when it must not be"""
+        directives = {}
+        for part in cache_control.lower().split(","):
+            name, _, value = part.strip().partition("=")
+            if name:
+                directives[name] = value.strip('"')
+
+        if "no-store" in directives or "private" in directives or "no-cache" in directives:
+            return None
+        if "immutable" in directives:
+            return self.immutable_ttl
+
+        # Shared-cache lifetime takes precedence over the browser lifetime
+        for name in ("s-maxage", "max-age"):
+            if name in directives:
+                try:
+                    ttl = float(directives[name])
+                except ValueError:
+                    return None
+                return ttl if ttl > 0 else None
+
+        if urlsplit(url).path.lower().endswith(IMMUTABLE_SEGMENT_EXTENSIONS):
+            return self.immutable_ttl
+        if "public" in directives:
+            return self.default_ttl
+        # Unknown resources (e.g. raw live TS endpoints) are only cached when
+        # the upstream says so explicitly
+        return None
+
+    def get(self, url: str) -> Optional[CachedSegment]:
+        """Return a fresh cached segment and mark it most recently used"""
+        entry = self._entries.get(url)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        if entry.expires_at <= time.monotonic():
+            self._remove(url)
+            self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            return None
+
+        self._entries.move_to_end(url)
+        self.stats["hits"] += 1
+        return entry
+
+    def peek(self, url: str) -> Optional[CachedSegment]:
+        """Fresh entry for url without touching LRU order or stats"""
+        entry = self._entries.get(url)
+        if entry is not None and entry.expires_at > time.monotonic():
+            return entry
+        return None
+
+    def fresh_entries(self) -> List[Tuple[str, CachedSegment]]:
+        """Fresh (url, entry) pairs, least recently used first"""
+        now = time.monotonic()
+        return [(url, entry) for url, entry in self._entries.items() if entry.expires_at > now]
+
+    def put(self, url: str, body: bytes, media_type: str, ttl: float) -> bool:
+        """Store a complete segment body, evicting least recently used entries"""
+        size = len(body)
+        if size > self.max_entry_bytes or size > self.max_bytes:
+            return False
+
+        if url in self._entries:
+            self._remove(url)
+
+        while self.size + size > self.max_bytes and self._entries:
+            oldest_url = next(iter(self._entries))
+            evicted = self._remove(oldest_url)
+            self.stats["evictions"] += 1
+            if self.on_evict is not None and evicted.expires_at > time.monotonic():
+                self.on_evict(oldest_url, evicted)
+
+        self._entries[url] = CachedSegment(body, media_type, time.monotonic() + ttl)
+        self.size += size
+        self.stats["stores"] += 1
+        return True
+
+    def _remove(self, url: str) -> CachedSegment:
+        entry = self._entries.pop(url)
+        self.size -= len(entry.body)
+        return entry
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters and current memory use"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "size_bytes": self.size,
+            "max_bytes": self.max_bytes
+        }
@@ -0,0 +1,169 @@
+from typing import Dict, Any, Optional, List, AsyncIterator, Tuple, Callable
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class StreamSession:
+    __slots__ = ("id", "user_id", "channel_id", "access_code_id", "client", "device", "started_at", "last_activity",
+                 "bytes_sent", "requests", "open_requests", "accounted_bytes", "accounted_requests", "accounted_at",
+                 "_swept_bytes")
+
+    def __init__(self, user_id: str, channel_id: str, client: str, access_code_id: Optional[str] = None,
+                 device: str = ""):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.access_code_id = access_code_id
+        self.client = client
+        self.device = device
+        self.started_at = time.time()
+        self.last_activity = self.started_at
+        self.bytes_sent = 0
+        self.requests = 0
+        # Responses currently being relayed; HLS viewers have gaps between them
+        self.open_requests = 0
+        # Usage already handed to the usage recorder
+        self.accounted_bytes = 0
+        self.accounted_requests = 0
+        self.accounted_at = self.started_at
+        self._swept_bytes = 0
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "channel_id": self.channel_id,
+            "access_code_id": self.access_code_id,
+            "client": self.client,
+            "device": self.device,
+            "started_at": self.started_at,
+            "duration_seconds": round(now - self.started_at, 1),
+            "idle_seconds": round(max(0.0, now - self.last_activity), 1),
+            "bytes_sent": self.bytes_sent,
+            "requests": self.requests,
+            "open_requests": self.open_requests
+        }
+
+# Registry of viewers currently pulling streams through the proxy
+class StreamSessionRegistry:
+    """Open stream sessions keyed on token, client, device and channel, reaped once idle
+
+    A session spans every request a viewer makes for one channel with one
+    token (a live TS connection, or the playlist and segment requests of an
+    HLS player); a playlist token opens one session per channel watched.
+    Every device exporting the same access code gets the same playlist
+    token, so viewers are told apart by client address and device (a
+    User-Agent digest); identical devices behind one address still share a
+    session, which makes the counts a lower bound.
+    Relaying a chunk only adds to ``bytes_sent``; activity is derived from
+    byte progress by the reaper instead of being timestamped per chunk.
+    """
+    def __init__(self, idle_timeout: float = 30.0):
+        self.idle_timeout = idle_timeout
+        self._sessions: Dict[Tuple[str, str, str, str], StreamSession] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        # Called with each session as it is reaped
+        self.on_close: Optional[Callable[[StreamSession], None]] = None
+        self.stats = {
+            "opened": 0,
+            "reaped": 0
+        }
+
+    async def start(self):
+        """Start the idle-session reaper"""
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+    def open(self, token: str, user_id: str, channel_id: str, client: str,
+             access_code_id: Optional[str] = None, device: str = "") -> StreamSession:
+        """Session for this token, client, device and channel, created on first use"""
+        key = (token, client, device, channel_id)
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = StreamSession(user_id, channel_id, client, access_code_id, device)
+            self.stats["opened"] += 1
+        session.requests += 1
+        session.last_activity = time.time()
+        return session
+
+    def sessions(self) -> List[StreamSession]:
+        return list(self._sessions.values())
+
+    async def relay(self, session: StreamSession, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """Pass body through, counting bytes against session"""
+        session.open_requests += 1
+        try:
+            async for chunk in body:
+                session.bytes_sent += len(chunk)
+                yield chunk
+        finally:
+            session.open_requests -= 1
+            session.last_activity = time.time()
+            aclose = getattr(body, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _sweep(self):
+        now = time.time()
+        cutoff = now - self.idle_timeout
+        for key, session in list(self._sessions.items()):
+            if session.bytes_sent != session._swept_bytes:
+                session._swept_bytes = session.bytes_sent
+                session.last_activity = now
+            elif session.open_requests == 0 and session.last_activity < cutoff:
+                del self._sessions[key]
+                self.stats["reaped"] += 1
+                if self.on_close is not None:
+                    self.on_close(session)
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 4))
+            try:
+                self._sweep()
+            except Exception as e:
+                logger.warning(f"Stream session sweep failed: {e}")
+
+    @property
+    def active_count(self) -> int:
+        return len(self._sessions)
+
+    def counts(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Active sessions per channel and per user"""
+        per_channel: Dict[str, int] = {}
+        per_user: Dict[str, int] = {}
+        for session in self._sessions.values():
+            per_channel[session.channel_id] = per_channel.get(session.channel_id, 0) + 1
+            per_user[session.user_id] = per_user.get(session.user_id, 0) + 1
+        return per_channel, per_user
+
+    def list_sessions(self, channel_id: Optional[str] = None, user_id: Optional[str] = None,
+                      limit: int = 1000) -> List[Dict[str, Any]]:
+        """Active sessions, busiest first"""
+        now = time.time()
+        sessions = [
+            session for session in self._sessions.values()
+            if (channel_id is None or session.channel_id == channel_id)
+            and (user_id is None or session.user_id == user_id)
+        ]
+        sessions.sort(key=lambda session: session.bytes_sent, reverse=True)
+        return [session.to_dict(now) for session in sessions[:limit]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Live session counts per channel and per user"""
+        per_channel, per_user = self.counts()
+        return {
+            **self.stats,
+            "active_sessions": len(self._sessions),
+            "open_requests": sum(session.open_requests for session in self._sessions.values()),
+            "per_channel": per_channel,
+            "per_user": per_user
+        }
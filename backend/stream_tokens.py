@@ -0,0 +1,270 @@
+from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import base64
+import hashlib
+import hmac
+import secrets
+import struct
+import time
+
+TOKEN_VERSION = 2
+# Same layout, but the id slot names a playlist and the token covers its channels
+PLAYLIST_TOKEN_VERSION = 3
+SCOPES = {TOKEN_VERSION: "channel", PLAYLIST_TOKEN_VERSION: "playlist"}
+# version, key id, expiry (epoch seconds)
+HEADER = struct.Struct(">BBI")
+MAX_KEY_ID = 0xFF
+MAC_BYTES = 16
+# Signatures of upstream URIs handed out in rewritten manifests
+URI_MAC_BYTES = 12
+MAX_FIELD_BYTES = 254
+# Length byte marking a canonical UUID packed as 16 raw bytes
+UUID_FIELD = 0xFF
+
+# Secret of the original (v1) "payload.signature" tokens; public, so v1 is off by default
+LEGACY_V1_SECRET = "SECRET_STREAM_KEY"
+# Lifetime the original generator issued; longer v1 tokens can only be forgeries
+LEGACY_V1_MAX_HOURS = 24
+
+def _pack_uuid(value: str) -> Optional[bytes]:
+    """16 raw bytes for a canonical lowercase UUID string, else None"""
+    if len(value) != 36 or value[8] != "-" or value[13] != "-" or value[18] != "-" or value[23] != "-":
+        return None
+    try:
+        packed = bytes.fromhex(value.replace("-", ""))
+    except ValueError:
+        return None
+    return packed if _unpack_uuid(packed) == value else None
+
+def _unpack_uuid(packed: bytes) -> str:
+    if len(packed) != 16:
+        raise ValueError("Truncated UUID field")
+    digits = packed.hex()
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+class StreamTokenCodec:
+    """Issue and verify HMAC-signed stream tokens
+
+    A v2 token is the unpadded URL-safe base64 of::
+
+        version (1) | key id (1) | expiry epoch (4) | user id | channel id | access code id | mac (16)
+
+    where each id is a length byte followed by UTF-8 (or ``0xFF`` and the 16
+    raw bytes of a canonical UUID) and the MAC is a truncated HMAC-SHA256
+    under the key named by the key id (0-255). Keeping retired keys in
+    ``keys`` lets tokens issued before a rotation verify until they expire.
+    Verified tokens are cached until their expiry, so a viewer's repeat
+    segment requests cost one dict lookup.
+
+    Legacy v1 tokens are signed with a public constant, so they are only
+    accepted with ``accept_v1``, for a cutover no longer than their 24 hour
+    lifetime.
+
+    Playlist tokens (version 3) authorize every channel of one playlist.
+    Their expiry is rounded up to ``playlist_expiry_step`` seconds, so
+    exports of an unchanged playlist within one step carry the same token.
+
+    URIs rewritten into a channel's manifests are signed with the same keys
+    (``sign_uri``), so any worker can tell they were handed out for that
+    channel without having served the manifest itself.
+    """
+    def __init__(self, keys: Optional[Dict[int, bytes]] = None, active_key_id: Optional[int] = None,
+                 cache_size: int = 100000, accept_v1: bool = False, playlist_expiry_step: int = 3600):
+        self.keys = keys or {1: secrets.token_bytes(32)}
+        invalid = sorted(key_id for key_id in self.keys if not 0 <= key_id <= MAX_KEY_ID)
+        if invalid:
+            # The key id is a single header byte
+            raise ValueError(f"Stream token key ids must be 0-{MAX_KEY_ID}, got {invalid}")
+        self.active_key_id = active_key_id if active_key_id is not None else max(self.keys)
+        if self.active_key_id not in self.keys:
+            raise ValueError(f"No stream token key with id {self.active_key_id}")
+        self.cache_size = cache_size
+        self.accept_v1 = accept_v1
+        self.playlist_expiry_step = max(1, playlist_expiry_step)
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {
+            "issued": 0,
+            "cache_hits": 0,
+            "verified": 0,
+            "verified_v1": 0,
+            "rejected": 0
+        }
+
+    def issue(self, user_id: str, channel_id: str, expires_in: int = 24 * 3600,
+              access_code_id: Optional[str] = None) -> str:
+        """Signed v2 token for a viewer of channel_id"""
+        return self._issue(TOKEN_VERSION, user_id, channel_id, int(time.time()) + expires_in, access_code_id)
+
+    def issue_playlist(self, user_id: str, playlist_id: str, expires_in: int = 24 * 3600,
+                       access_code_id: Optional[str] = None) -> str:
+        """Signed v3 token covering every channel of playlist_id"""
+        step = self.playlist_expiry_step
+        expires_at = -(-(int(time.time()) + expires_in) // step) * step
+        return self._issue(PLAYLIST_TOKEN_VERSION, user_id, playlist_id, expires_at, access_code_id)
+
+    def _issue(self, version: int, user_id: str, subject_id: str, expires_at: int,
+               access_code_id: Optional[str]) -> str:
+        body = bytearray(HEADER.pack(version, self.active_key_id, expires_at))
+        for value in (user_id, subject_id, access_code_id or ""):
+            packed = _pack_uuid(value)
+            if packed is not None:
+                body.append(UUID_FIELD)
+                body += packed
+                continue
+            encoded = value.encode()
+            if len(encoded) > MAX_FIELD_BYTES:
+                raise ValueError("Stream token field too long")
+            body.append(len(encoded))
+            body += encoded
+        body += self._mac(self.keys[self.active_key_id], body)
+        self.stats["issued"] += 1
+        return base64.urlsafe_b64encode(bytes(body)).rstrip(b"=").decode()
+
+    def verify(self, token: str) -> Optional[Dict[str, Any]]:
+        """Token claims, or None when the token is malformed, forged or expired"""
+        cached = self._cache.get(token)
+        if cached is not None:
+            if cached[0] > time.time():
+                self._cache.move_to_end(token)
+                self.stats["cache_hits"] += 1
+                return cached[1]
+            del self._cache[token]
+
+        if "." in token:
+            # Base64 of a v2 token never contains a dot
+            claims = self._decode_v1(token) if self.accept_v1 else None
+            if claims is not None:
+                self.stats["verified_v1"] += 1
+        else:
+            claims = self._decode_v2(token)
+            if claims is not None:
+                self.stats["verified"] += 1
+
+        if claims is None:
+            # Failures are not cached, so junk tokens cannot flush good entries
+            self.stats["rejected"] += 1
+            return None
+
+        if self.cache_size:
+            self._cache[token] = (claims["expires_at"], claims)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return claims
+
+    @staticmethod
+    def _mac(key: bytes, body: bytes) -> bytes:
+        return hmac.digest(key, body, "sha256")[:MAC_BYTES]
+
+    @staticmethod
+    def _uri_mac(key: bytes, channel_id: str, url: str) -> bytes:
+        # The "uri" prefix keeps these apart from token MACs, which start with a version byte
+        return hmac.digest(key, b"uri\0" + channel_id.encode() + b"\0" + url.encode(), "sha256")[:URI_MAC_BYTES]
+
+    def sign_uri(self, channel_id: str, url: str) -> str:
+        """Path-safe signature binding an upstream URL to channel_id"""
+        mac = self._uri_mac(self.keys[self.active_key_id], channel_id, url)
+        return base64.urlsafe_b64encode(bytes([self.active_key_id]) + mac).rstrip(b"=").decode()
+
+    def verify_uri(self, channel_id: str, url: str, signature: str) -> bool:
+        """Whether signature was issued by sign_uri for channel_id and url"""
+        try:
+            raw = base64.urlsafe_b64decode(signature + "=" * (-len(signature) % 4))
+        except ValueError:
+            return False
+        if len(raw) != 1 + URI_MAC_BYTES:
+            return False
+        key = self.keys.get(raw[0])
+        return key is not None and hmac.compare_digest(raw[1:], self._uri_mac(key, channel_id, url))
+
+    def _decode_v2(self, token: str) -> Optional[Dict[str, Any]]:
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except ValueError:
+            return None
+        if len(raw) < HEADER.size + 3 + MAC_BYTES:
+            return None
+
+        body, mac = raw[:-MAC_BYTES], raw[-MAC_BYTES:]
+        version, key_id, expires_at = HEADER.unpack_from(body)
+        key = self.keys.get(key_id)
+        if version not in SCOPES or key is None:
+            return None
+        if not hmac.compare_digest(mac, self._mac(key, body)):
+            return None
+        if expires_at <= time.time():
+            return None
+
+        fields = []
+        position = HEADER.size
+        try:
+            for _ in range(3):
+                length = body[position]
+                if length == UUID_FIELD:
+                    fields.append(_unpack_uuid(body[position + 1:position + 17]))
+                    position += 17
+                else:
+                    fields.append(body[position + 1:position + 1 + length].decode())
+                    position += 1 + length
+        except (IndexError, ValueError):
+            return None
+        if position != len(body):
+            return None
+
+        # "playlist_id" holds the channel id of channel-scoped tokens
+        user_id, subject_id, access_code_id = fields
+        return {
+            "user_id": user_id,
+            "playlist_id": subject_id,
+            "access_code_id": access_code_id or None,
+            "expires_at": expires_at,
+            "version": version,
+            "key_id": key_id,
+            "scope": SCOPES[version]
+        }
+
+    @staticmethod
+    def _decode_v1(token: str) -> Optional[Dict[str, Any]]:
+        """Legacy "base64(payload).sha256-prefix" tokens, accepted during migration"""
+        try:
+            encoded_part, signature = token.split('.')
+            expected_signature = hashlib.sha256(f"{encoded_part}:{LEGACY_V1_SECRET}".encode()).hexdigest()[:16]
+            if not hmac.compare_digest(signature, expected_signature):
+                return None
+            payload = base64.b64decode(encoded_part).decode()
+
+            # The ISO timestamp contains exactly two colons of its own
+            user_id, playlist_id, rest = payload.split(':', 2)
+            fields = rest.split(':')
+            created_time = datetime.fromisoformat(':'.join(fields[:3]))
+            expires_hours = int(fields[3])
+            if not 0 < expires_hours <= LEGACY_V1_MAX_HOURS:
+                return None
+            expiry_time = created_time + timedelta(hours=expires_hours)
+            access_code_id = fields[4] if len(fields) > 4 else None
+        except Exception:
+            return None
+
+        # Issued with naive UTC timestamps; a future creation time is a forgery
+        expires_at = (expiry_time - datetime(1970, 1, 1)).total_seconds()
+        now = time.time()
+        if not now < expires_at <= now + LEGACY_V1_MAX_HOURS * 3600:
+            return None
+        return {
+            "user_id": user_id,
+            "playlist_id": playlist_id,
+            "access_code_id": access_code_id,
+            "expires_at": expires_at,
+            "version": 1,
+            "key_id": None,
+            "scope": "channel"
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["cache_hits"] + self.stats["verified"] + self.stats["verified_v1"] + self.stats["rejected"]
+        return {
+            **self.stats,
+            "cache_hit_ratio": round(self.stats["cache_hits"] / lookups, 4) if lookups else 0.0,
+            "cache_entries": len(self._cache),
+            "active_key_id": self.active_key_id
+        }
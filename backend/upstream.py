@@ -0,0 +1,209 @@
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+import asyncio
+import time
+import aiohttp
+
+class UpstreamBusyError(Exception):
+    """An upstream host's wait queue is full or the wait timed out"""
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class HostState:
+    __slots__ = ("semaphore", "in_flight", "waiting", "acquired", "rejected", "wait_time", "max_waiting")
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.max_waiting = 0
+
+# Admission control for upstream fetches
+class HostLimiter:
+    """Global and per-host in-flight limits with bounded, timed wait queues"""
+    def __init__(self, max_in_flight: int = 1000, max_in_flight_per_host: int = 100,
+                 max_queue_per_host: int = 200, queue_timeout: float = 5.0, retry_after: int = 2):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_host = max_in_flight_per_host
+        self.max_queue_per_host = max_queue_per_host
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._global = asyncio.Semaphore(max_in_flight)
+        self._hosts: Dict[str, HostState] = {}
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    async def acquire(self, host: str):
+        """Take a slot for host, waiting in its queue; raises UpstreamBusyError when full"""
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState(self.max_in_flight_per_host)
+
+        if not state.semaphore.locked() and not self._global.locked():
+            await self._acquire_both(state)
+        else:
+            if state.waiting >= self.max_queue_per_host:
+                state.rejected += 1
+                raise UpstreamBusyError(f"Upstream {host} is busy", self.retry_after)
+            state.waiting += 1
+            state.max_waiting = max(state.max_waiting, state.waiting)
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(self._acquire_both(state), self.queue_timeout)
+            except asyncio.TimeoutError:
+                state.rejected += 1
+                raise UpstreamBusyError(f"Timed out waiting for upstream {host}", self.retry_after)
+            finally:
+                state.waiting -= 1
+                state.wait_time += time.monotonic() - started
+
+        state.in_flight += 1
+        state.acquired += 1
+        self.in_flight += 1
+
+    async def _acquire_both(self, state: HostState):
+        await state.semaphore.acquire()
+        try:
+            await self._global.acquire()
+        except BaseException:
+            state.semaphore.release()
+            raise
+
+    def release(self, host: str):
+        state = self._hosts[host]
+        state.in_flight -= 1
+        self.in_flight -= 1
+        state.semaphore.release()
+        self._global.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Global occupancy plus queue depth and wait time per host"""
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_in_flight_per_host": self.max_in_flight_per_host,
+            "max_queue_per_host": self.max_queue_per_host,
+            "hosts": {
+                host: {
+                    "in_flight": state.in_flight,
+                    "queue_depth": state.waiting,
+                    "max_queue_depth": state.max_waiting,
+                    "acquired": state.acquired,
+                    "rejected": state.rejected,
+                    "avg_wait_ms": round(state.wait_time * 1000 / state.acquired, 2) if state.acquired else 0.0
+                }
+                for host, state in self._hosts.items()
+            }
+        }
+
+# Shared HTTP client for upstream stream I/O
+class UpstreamClient:
+    """Application-lifetime aiohttp session with pooled keep-alive connections"""
+    def __init__(self, limit: int = 1000, limit_per_host: int = 100,
+                 dns_cache_ttl: int = 300, keepalive_timeout: float = 30.0,
+                 connect_timeout: float = 10.0, read_timeout: float = 30.0,
+                 max_queue_per_host: int = 200, queue_timeout: float = 5.0, retry_after: int = 2):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Same limits as the connector, so callers queue here with bounds
+        # instead of waiting unboundedly inside the connector
+        self.limiter = HostLimiter(
+            max_in_flight=limit,
+            max_in_flight_per_host=limit_per_host,
+            max_queue_per_host=max_queue_per_host,
+            queue_timeout=queue_timeout,
+            retry_after=retry_after
+        )
+        self.stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "dns_cache_hits": 0,
+            "dns_cache_misses": 0
+        }
+
+    async def start(self):
+        """Create the pooled session; call once from application startup"""
+        if self._session is not None and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        # No total timeout: live streams stay open indefinitely, so only
+        # connection setup and gaps between reads are bounded
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=self.connect_timeout,
+            sock_read=self.read_timeout
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            auto_decompress=False,
+            trace_configs=[self._trace_config()]
+        )
+
+    async def close(self):
+        """Close the session and every pooled connection"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the pooled session, starting it lazily outside the app lifecycle"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.stats["requests"] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.stats["connections_reused"] += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self.stats["dns_cache_hits"] += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self.stats["dns_cache_misses"] += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Connection reuse counters and pool configuration"""
+        connections = self.stats["connections_created"] + self.stats["connections_reused"]
+        return {
+            **self.stats,
+            "reuse_ratio": round(self.stats["connections_reused"] / connections, 4) if connections else 0.0,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "dns_cache_ttl": self.dns_cache_ttl
+        }
@@ -0,0 +1,190 @@
+from typing import Dict, Any, Optional, List, Tuple
+from datetime import datetime
+import asyncio
+import logging
+import time
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from stream_sessions import StreamSessionRegistry, StreamSession
+
+logger = logging.getLogger(__name__)
+
+# Dimensions usage is bucketed by
+USAGE_SCOPES = ("user", "access_code", "channel")
+
+# Filter fields identifying one counter document, as (name, value) pairs
+CounterKey = Tuple[Tuple[str, Any], ...]
+
+class WriteBehindCounters:
+    """In-process ``$inc`` accumulators flushed to a collection in one bulk write
+
+    Increments for the same document are merged in memory, so the number of
+    writes per flush depends on how many distinct documents changed, not on
+    how often they changed. Without ``upsert``, increments for documents
+    that no longer exist are dropped.
+    """
+    def __init__(self, collection, flush_interval: float = 30.0, upsert: bool = True):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.upsert = upsert
+        self._pending: Dict[CounterKey, Dict[str, float]] = {}
+        # When the oldest unflushed increment was added
+        self._pending_since: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.stats = {
+            "flushes": 0,
+            "documents_written": 0,
+            "flush_errors": 0,
+            "last_flush_ms": 0.0
+        }
+
+    async def start(self):
+        """Start the periodic flusher"""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the flusher and write out whatever is still pending"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def add(self, key: CounterKey, **increments: float):
+        counters = self._pending.get(key)
+        if counters is None:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            counters = self._pending[key] = {}
+        for field, value in increments.items():
+            counters[field] = counters.get(field, 0) + value
+
+    def collect(self):
+        """Fold externally held state into the accumulators; runs before every flush"""
+
+    async def flush(self) -> int:
+        """Write pending increments; returns the number of documents written"""
+        async with self._lock:
+            self.collect()
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            pending_since, self._pending_since = self._pending_since, None
+            keys = list(batch)
+            operations = [UpdateOne(dict(key), {"$inc": batch[key]}, upsert=self.upsert) for key in keys]
+
+            started = time.monotonic()
+            try:
+                await self.collection.bulk_write(operations, ordered=False)
+                failed = []
+            except BulkWriteError as e:
+                failed = [keys[error["index"]] for error in e.details.get("writeErrors", [])]
+            except Exception as e:
+                logger.warning(f"Counter flush to {self.collection.name} failed: {e}")
+                failed = keys
+            self.stats["last_flush_ms"] = round((time.monotonic() - started) * 1000, 2)
+
+            # Failed increments are merged back and retried on the next flush
+            for key in failed:
+                self.add(key, **batch[key])
+            if failed:
+                self._pending_since = min(pending_since, self._pending_since or pending_since)
+                self.stats["flush_errors"] += 1
+            self.stats["flushes"] += 1
+            self.stats["documents_written"] += len(keys) - len(failed)
+            return len(keys) - len(failed)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Counter flush to {self.collection.name} failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Flush counters, buffer size and the age of the oldest unflushed increment"""
+        lag = time.monotonic() - self._pending_since if self._pending and self._pending_since else 0.0
+        return {
+            **self.stats,
+            "pending_documents": len(self._pending),
+            "flush_lag_ms": round(lag * 1000, 2),
+            "flush_interval": self.flush_interval
+        }
+
+# Bandwidth and watch-time accounting
+class UsageRecorder(WriteBehindCounters):
+    """Hourly bytes, watch seconds and requests per user, access code and channel
+
+    Usage is read off the stream session registry when flushing (and when a
+    session is reaped), so relaying a chunk costs nothing extra. Time counts
+    towards a bucket only while the session was moving bytes.
+    """
+    def __init__(self, collection, sessions: StreamSessionRegistry, flush_interval: float = 30.0):
+        super().__init__(collection, flush_interval)
+        self.sessions = sessions
+        sessions.on_close = self._account
+
+    def collect(self):
+        for session in self.sessions.sessions():
+            self._account(session)
+
+    def _account(self, session: StreamSession):
+        now = time.time()
+        delta_bytes = session.bytes_sent - session.accounted_bytes
+        delta_requests = session.requests - session.accounted_requests
+        seconds = now - session.accounted_at if delta_bytes or session.open_requests else 0.0
+        session.accounted_bytes = session.bytes_sent
+        session.accounted_requests = session.requests
+        session.accounted_at = now
+        if not (delta_bytes or delta_requests or seconds):
+            return
+
+        hour = datetime.utcfromtimestamp(now).replace(minute=0, second=0, microsecond=0)
+        for scope, key in (("user", session.user_id), ("access_code", session.access_code_id),
+                           ("channel", session.channel_id)):
+            if key:
+                self.add(
+                    (("scope", scope), ("key", key), ("hour", hour)),
+                    bytes=delta_bytes,
+                    seconds=round(seconds, 3),
+                    requests=delta_requests
+                )
+
+    async def query(self, scope: str, key: Optional[str] = None, start: Optional[datetime] = None,
+                    end: Optional[datetime] = None, granularity: str = "total",
+                    limit: int = 100) -> List[Dict[str, Any]]:
+        """Flushed usage for scope, summed per key (and per hour), heaviest first"""
+        match: Dict[str, Any] = {"scope": scope}
+        if key is not None:
+            match["key"] = key
+        if start is not None or end is not None:
+            match["hour"] = {}
+            if start is not None:
+                match["hour"]["$gte"] = start
+            if end is not None:
+                match["hour"]["$lt"] = end
+
+        group_id: Any = "$key" if granularity == "total" else {"key": "$key", "hour": "$hour"}
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": group_id,
+                "bytes": {"$sum": "$bytes"},
+                "seconds": {"$sum": "$seconds"},
+                "requests": {"$sum": "$requests"}
+            }},
+            {"$sort": {"bytes": -1}},
+            {"$limit": limit}
+        ]
+
+        results = []
+        async for doc in self.collection.aggregate(pipeline):
+            group = doc.pop("_id")
+            if granularity == "total":
+                doc["key"] = group
+            else:
+                doc.update(group)
+            results.append(doc)
+        return results
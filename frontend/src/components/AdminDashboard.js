@@ -16,6 +16,7 @@ import {
 } from 'lucide-react';
 import { useAuth } from '../contexts/AuthContext';
 import axios from 'axios';
+import { fetchAllPages } from '../utils/pagination';
 
 const AdminDashboard = () => {
   const { user } = useAuth();
@@ -40,10 +41,10 @@ const AdminDashboard = () => {
     try {
       const [statsRes, channelsRes, playlistsRes, codesRes, usersRes] = await Promise.all([
         axios.get(`${API_BASE}/admin/stats`),
-        axios.get(`${API_BASE}/channels`),
-        axios.get(`${API_BASE}/playlists`),
-        axios.get(`${API_BASE}/access-codes`),
-        axios.get(`${API_BASE}/admin/users`)
+        fetchAllPages(`${API_BASE}/channels`),
+        fetchAllPages(`${API_BASE}/playlists`),
+        fetchAllPages(`${API_BASE}/access-codes`),
+        fetchAllPages(`${API_BASE}/admin/users`)
       ]);
 
       setStats(statsRes.data);
@@ -17,6 +17,7 @@ import {
 import { useAuth } from '../contexts/AuthContext';
 import VideoPlayer from './VideoPlayer';
 import axios from 'axios';
+import { fetchAllPages } from '../utils/pagination';
 
 const IPTVGenerator = () => {
   const { user } = useAuth();
@@ -41,9 +42,9 @@ const IPTVGenerator = () => {
     setLoading(true);
     try {
       const [channelsRes, playlistsRes, codesRes] = await Promise.all([
-        axios.get(`${API_BASE}/channels`),
-        axios.get(`${API_BASE}/playlists`),
-        axios.get(`${API_BASE}/access-codes`)
+        fetchAllPages(`${API_BASE}/channels`),
+        fetchAllPages(`${API_BASE}/playlists`),
+        fetchAllPages(`${API_BASE}/access-codes`)
       ]);
 
       setChannels(channelsRes.data);
@@ -0,0 +1,15 @@
+import axios from 'axios';
+
+// List endpoints return one keyset page at a time; a full page carries the
+// cursor of the next one in the X-Next-Cursor header.
+export const fetchAllPages = async (url, config = {}) => {
+  const rows = [];
+  let after = null;
+  do {
+    const params = after ? { ...config.params, after } : config.params;
+    const response = await axios.get(url, { ...config, params });
+    rows.push(...response.data);
+    after = response.headers['x-next-cursor'];
+  } while (after);
+  return { data: rows };
+};
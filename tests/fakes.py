@@ -0,0 +1,168 @@
+"""In-memory stand-ins for the Motor collections and upstream origins the backend talks to"""
+import copy
+import itertools
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+from pymongo.errors import BulkWriteError, OperationFailure
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for field, condition in query.items():
+        if field == "$and":
+            if not all(_matches(doc, part) for part in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(_matches(doc, part) for part in condition):
+                return False
+            continue
+        value = doc.get(field)
+        if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            for operator, operand in condition.items():
+                if operator == "$in":
+                    ok = value in operand or (isinstance(value, list) and any(item in operand for item in value))
+                elif operator == "$lt":
+                    ok = value is not None and value < operand
+                elif operator == "$gt":
+                    ok = value is not None and value > operand
+                elif operator == "$gte":
+                    ok = value is not None and value >= operand
+                else:
+                    raise NotImplementedError(operator)
+                if not ok:
+                    return False
+        elif isinstance(value, list) and not isinstance(condition, list):
+            if condition not in value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs: List[Dict[str, Any]]):
+        self._docs = docs
+
+    def limit(self, count: int) -> "FakeCursor":
+        self._docs = self._docs[:count] if count else self._docs
+        return self
+
+    def batch_size(self, size: int) -> "FakeCursor":
+        return self
+
+    async def to_list(self, length: Optional[int]) -> List[Dict[str, Any]]:
+        return self._docs[:length] if length else list(self._docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+
+class FakeCollection:
+    """Enough of a Motor collection for the code under test, with optional unique fields"""
+    def __init__(self, name: str = "fake", unique: tuple = ()):
+        self.name = name
+        self.unique = unique
+        self.docs: List[Dict[str, Any]] = []
+        self.indexes: List[Any] = []
+        self.calls: Dict[str, int] = {}
+        # Exceptions raised by the next calls of a method, oldest first
+        self.failures: Dict[str, List[Exception]] = {}
+        self._ids = itertools.count(1)
+
+    def _call(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        pending = self.failures.get(method)
+        if pending:
+            raise pending.pop(0)
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, int]] = None) -> FakeCursor:
+        self._call("find")
+        docs = [copy.deepcopy(doc) for doc in self.docs if _matches(doc, query or {})]
+        if projection:
+            keep = {field for field, flag in projection.items() if flag}
+            if keep:
+                docs = [{field: doc[field] for field in keep | {"_id"} if field in doc} for doc in docs]
+            if projection.get("_id") == 0:
+                for doc in docs:
+                    doc.pop("_id", None)
+        return FakeCursor(docs)
+
+    async def find_one(self, query: Dict[str, Any], projection: Optional[Dict[str, int]] = None):
+        docs = await self.find(query, projection).to_list(1)
+        return docs[0] if docs else None
+
+    async def insert_many(self, docs: List[Dict[str, Any]], ordered: bool = True):
+        self._call("insert_many")
+        errors = []
+        for index, doc in enumerate(docs):
+            if any(
+                field in doc and any(stored.get(field) == doc[field] for stored in self.docs)
+                for field in self.unique
+            ):
+                errors.append({"index": index, "code": DUPLICATE_KEY_ERROR, "errmsg": "duplicate key"})
+                continue
+            doc.setdefault("_id", next(self._ids))
+            self.docs.append(copy.deepcopy(doc))
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+    async def update_many(self, query: Dict[str, Any], update: Dict[str, Any]):
+        self._call("update_many")
+        for doc in self.docs:
+            if _matches(doc, query):
+                doc.update(update.get("$set", {}))
+                for field, value in update.get("$inc", {}).items():
+                    doc[field] = doc.get(field, 0) + value
+
+    async def delete_many(self, query: Dict[str, Any]):
+        self._call("delete_many")
+        self.docs = [doc for doc in self.docs if not _matches(doc, query)]
+
+    async def bulk_write(self, operations, ordered: bool = True):
+        self._call("bulk_write")
+        for operation in operations:
+            query, update = operation._filter, operation._doc
+            targets = [doc for doc in self.docs if _matches(doc, query)]
+            if not targets and operation._upsert:
+                target = dict(query)
+                target["_id"] = next(self._ids)
+                self.docs.append(target)
+                targets = [target]
+            for doc in targets[:1]:
+                for field, value in update.get("$inc", {}).items():
+                    doc[field] = doc.get(field, 0) + value
+
+    async def create_index(self, keys, **options):
+        self._call("create_index")
+        self.indexes.append((keys, options))
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name: str) -> FakeCollection:
+        collection = self[name] = FakeCollection(name)
+        return collection
+
+
+def operation_failure(message: str = "index build failed") -> OperationFailure:
+    return OperationFailure(message, 85)
+
+
+async def start_origin(routes: Dict[str, Any]):
+    """Serve aiohttp handlers on a free local port; returns (runner, base URL)"""
+    app = web.Application()
+    for path, handler in routes.items():
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
@@ -0,0 +1,160 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from access_codes import CODE_ALPHABET, AccessCodeMinter, AccessCodeResolver, generate_codes
+from tests.fakes import FakeCollection, FakeCursor
+from usage import WriteBehindCounters
+
+
+class AccessCodes(FakeCollection):
+    """Access codes with the playlist $lookup of AccessCodeResolver and its conditional use update"""
+    def __init__(self, playlists: FakeCollection):
+        super().__init__("access_codes")
+        self.playlists = playlists
+
+    def aggregate(self, pipeline):
+        self._call("aggregate")
+        docs = [dict(doc) for doc in self.docs if all(doc.get(k) == v for k, v in pipeline[0]["$match"].items())]
+        for doc in docs[:1]:
+            doc.pop("_id", None)
+            doc["playlists"] = [dict(p) for p in self.playlists.docs if p["id"] == doc["playlist_id"]]
+        return FakeCursor(docs[:1])
+
+    async def find_one_and_update(self, query, update, return_document=None):
+        self._call("find_one_and_update")
+        for doc in self.docs:
+            if doc["id"] == query["id"] and doc["is_active"] and (not doc.get("max_uses") or doc["current_uses"] < doc["max_uses"]):
+                doc["current_uses"] += update["$inc"]["current_uses"]
+                return dict(doc)
+        return None
+
+
+def setup(max_uses=None):
+    playlists = FakeCollection("playlists")
+    playlists.docs = [{"id": "p1", "name": "Sports", "created_by": "owner", "channels": ["c1"]}]
+    access_codes = AccessCodes(playlists)
+    access_codes.docs = [{"id": "a1", "code": "CODE", "playlist_id": "p1", "created_by": "owner",
+                          "max_uses": max_uses, "current_uses": 0, "is_active": True}]
+    return access_codes
+
+
+def test_code_and_playlist_resolve_in_one_round_trip_and_are_cached():
+    access_codes = setup()
+    resolver = AccessCodeResolver(access_codes)
+
+    async def scenario():
+        first = await resolver.resolve("CODE")
+        again = await resolver.resolve("CODE")
+        unknown = await resolver.resolve("NOPE")
+        return first, again, unknown
+
+    first, again, unknown = asyncio.run(scenario())
+    assert first is again and unknown is None
+    assert (first.access_code.id, first.playlist.channels) == ("a1", ["c1"])
+    assert access_codes.calls == {"aggregate": 2}
+    assert resolver.get_stats()["entries"] == 1
+
+
+def test_playlist_edits_drop_resolutions():
+    access_codes = setup()
+    resolver = AccessCodeResolver(access_codes)
+
+    async def scenario():
+        first = await resolver.resolve("CODE")
+        resolver.invalidate_playlist("p1")
+        return first, await resolver.resolve("CODE")
+
+    first, second = asyncio.run(scenario())
+    assert first is not second
+    assert access_codes.calls["aggregate"] == 2
+
+
+def test_limited_codes_are_refused_at_max_uses():
+    access_codes = setup(max_uses=1)
+    resolver = AccessCodeResolver(access_codes)
+
+    async def scenario():
+        resolved = await resolver.resolve("CODE")
+        return resolved, [await resolver.count_use(resolved) for _ in range(2)]
+
+    resolved, results = asyncio.run(scenario())
+    assert results == [True, False]
+    assert resolved.exhausted
+    assert access_codes.docs[0]["current_uses"] == 1
+
+
+def test_unlimited_uses_are_buffered_and_written_behind():
+    access_codes = setup()
+    usage = WriteBehindCounters(access_codes, upsert=False)
+    resolver = AccessCodeResolver(access_codes, usage=usage)
+
+    async def scenario():
+        resolved = await resolver.resolve("CODE")
+        results = [await resolver.count_use(resolved) for _ in range(3)]
+        buffered = access_codes.docs[0]["current_uses"]
+        await usage.flush()
+        return resolved, results, buffered
+
+    resolved, results, buffered = asyncio.run(scenario())
+    assert results == [True] * 3
+    assert buffered == 0
+    assert "find_one_and_update" not in access_codes.calls
+    assert access_codes.calls["bulk_write"] == 1
+    assert access_codes.docs[0]["current_uses"] == resolved.access_code.current_uses == 3
+    assert resolver.get_stats()["uses_buffered"] == 3
+
+
+def test_generated_codes_use_the_alphabet():
+    codes = generate_codes(500, length=10)
+
+    assert len(codes) == 500 and len(set(codes)) == 500
+    assert all(len(code) == 10 and set(code) <= set(CODE_ALPHABET.decode()) for code in codes)
+
+
+def collect_mint(minter, template, count):
+    async def scenario():
+        return [batch async for batch in minter.mint(template, count)]
+
+    return asyncio.run(scenario())
+
+
+def test_minter_retries_colliding_codes():
+    access_codes = FakeCollection("access_codes", unique=("code",))
+    access_codes.docs = [{"code": "TAKEN"}]
+    minter = AccessCodeMinter(access_codes, chunk_size=4)
+    template = {"playlist_id": "p1", "created_by": "owner"}
+    codes = iter([["TAKEN", "A1", "A2", "A3"], ["B1"], ["B2", "B3"]])
+
+    with patch("access_codes.generate_codes", lambda count, length: next(codes)):
+        batches = collect_mint(minter, template, 6)
+
+    assert [[doc["code"] for doc in batch] for batch in batches] == [["B1", "A1", "A2", "A3"], ["B2", "B3"]]
+    assert all("_id" not in doc and doc["playlist_id"] == "p1" for batch in batches for doc in batch)
+    assert len(access_codes.docs) == 7
+    assert minter.get_stats() == {"minted": 6, "batches": 2, "collisions": 1}
+
+
+def test_minter_gives_up_after_max_retries():
+    access_codes = FakeCollection("access_codes", unique=("code",))
+    access_codes.docs = [{"code": "TAKEN"}]
+    minter = AccessCodeMinter(access_codes, chunk_size=1, max_retries=2)
+
+    with patch("access_codes.generate_codes", lambda count, length: ["TAKEN"] * count):
+        with pytest.raises(RuntimeError):
+            collect_mint(minter, {}, 1)
+    assert access_codes.calls["insert_many"] == 3
+
+
+def test_minter_raises_other_write_errors():
+    access_codes = FakeCollection("access_codes")
+    access_codes.failures["insert_many"] = [
+        BulkWriteError({"writeErrors": [{"index": 0, "code": 121, "errmsg": "validation"}]})
+    ]
+    minter = AccessCodeMinter(access_codes)
+
+    with pytest.raises(BulkWriteError):
+        collect_mint(minter, {}, 3)
+    assert access_codes.calls["insert_many"] == 1
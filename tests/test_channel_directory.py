@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from channel_directory import DELETED_CHANNEL, ChannelDirectory, stamp
+from source_health import SourceSelector
+from tests.fakes import FakeCollection
+
+
+def test_patches_track_urls_and_membership():
+    directory = ChannelDirectory(None, None)
+    directory.put_channel("news", "http://o/news.m3u8", ["http://mirror/news.m3u8"])
+    directory.put_channel("news-hd", "http://o/news.m3u8")
+    directory.put_playlist("p1", ["news", "gone"])
+
+    assert directory.channel_url("news") == "http://o/news.m3u8"
+    assert directory.channels_for_url("http://o/news.m3u8") == {"news", "news-hd"}
+    assert directory.channels_for_url("http://mirror/news.m3u8") == {"news"}
+    assert directory.in_playlist("p1", "news")
+    # Members without an active channel are not streamable
+    assert not directory.in_playlist("p1", "gone")
+
+    directory.put_channel("news", "http://o/moved.m3u8")
+    assert directory.channels_for_url("http://mirror/news.m3u8") == set()
+    directory.remove_channel("news")
+    directory.remove_playlist("p1")
+    assert directory.channel_url("news") is None
+    assert not directory.in_playlist("p1", "news")
+    assert directory.get_stats()["urls"] == 1
+
+
+def test_reload_mirrors_the_database():
+    channels, playlists = FakeCollection("channels"), FakeCollection("playlists")
+    channels.docs = [
+        {"id": "news", "url": "http://o/news.m3u8", "mirror_urls": ["http://mirror/news.m3u8"], "is_active": True},
+        {"id": "off", "url": "http://o/off.m3u8", "is_active": False},
+    ]
+    playlists.docs = [{"id": "p1", "channels": ["news", "off"]}]
+    directory = ChannelDirectory(channels, playlists, refresh_interval=0)
+    directory.put_channel("stale", "http://o/stale.m3u8")
+
+    asyncio.run(directory.start())
+
+    assert directory.channel_url("stale") is None
+    assert directory.channel_url("off") is None
+    assert directory.channels_for_url("http://mirror/news.m3u8") == {"news"}
+    assert directory.in_playlist("p1", "news") and not directory.in_playlist("p1", "off")
+    assert directory.get_stats()["reloads"] == 1
+
+
+def test_reload_keeps_mirror_sets_registered():
+    channels, playlists = FakeCollection("channels"), FakeCollection("playlists")
+    # Written by another worker
+    channels.docs = [{"id": "news", "url": "http://a/news.m3u8", "mirror_urls": ["http://b/news.m3u8"],
+                      "is_active": True}]
+    sources = SourceSelector()
+    directory = ChannelDirectory(channels, playlists, refresh_interval=0, sources=sources)
+
+    asyncio.run(directory.reload())
+    sources.record("http://a/news.m3u8", 0.1, False, "news")
+    asyncio.run(directory.reload())
+    # Health recorded since the first reload is kept while the URLs are unchanged
+    assert sources.candidates("http://a/news.m3u8", "news") == ["http://b/news.m3u8", "http://a/news.m3u8"]
+
+    channels.docs[0]["mirror_urls"] = ["http://c/news.m3u8"]
+    asyncio.run(directory.reload())
+    assert sources.candidates("http://a/news.m3u8", "news") == ["http://a/news.m3u8", "http://c/news.m3u8"]
+
+    channels.docs[0]["is_active"] = False
+    asyncio.run(directory.reload())
+    assert sources.candidates("http://a/news.m3u8", "news") == ["http://a/news.m3u8"]
+
+
+def test_refresh_reads_only_what_changed_since_the_last_sync():
+    channels, playlists, deletions = FakeCollection("channels"), FakeCollection("playlists"), FakeCollection("deletions")
+    old = datetime.utcnow() - timedelta(hours=1)
+    channels.docs = [{"id": "news", "url": "http://o/news.m3u8", "is_active": True, "updated_at": old},
+                     {"id": "kids", "url": "http://o/kids.m3u8", "is_active": True, "updated_at": old}]
+    playlists.docs = [{"id": "p1", "channels": ["news"], "updated_at": old}]
+    directory = ChannelDirectory(channels, playlists, refresh_interval=0, deletions=deletions)
+    other_worker = ChannelDirectory(channels, playlists, refresh_interval=0, deletions=deletions)
+
+    async def scenario():
+        await directory.reload()
+        # Writes made by another worker
+        channels.docs.append(stamp({"id": "sport", "url": "http://o/sport.m3u8", "is_active": True}))
+        channels.docs[0].update(stamp({"url": "http://o/moved.m3u8"}))
+        playlists.docs[0].update(stamp({"channels": ["news", "sport"]}))
+        channels.docs = [doc for doc in channels.docs if doc["id"] != "kids"]
+        await other_worker.record_deletions(DELETED_CHANNEL, ["kids"])
+        await directory.refresh()
+
+    asyncio.run(scenario())
+    assert channels.calls["find"] == 2 and playlists.calls["find"] == 2
+    assert directory.channel_url("news") == "http://o/moved.m3u8"
+    assert directory.in_playlist("p1", "sport")
+    assert directory.channel_url("kids") is None
+    # Only the stamped documents and the deletion were read
+    assert directory.get_stats()["documents_refreshed"] == 4
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from channel_directory import ChannelDirectory
+from expiry import ExpirySweeper
+from playlist_cache import PlaylistCache
+from tests.fakes import FakeCollection
+
+
+def code_doc(index: int, expires_at: datetime):
+    return {"_id": index, "id": f"a{index}", "code": f"CODE{index}", "playlist_id": "p1",
+            "expires_at": expires_at, "is_active": True}
+
+
+def test_expired_codes_are_deactivated_in_bounded_batches():
+    now = datetime.utcnow()
+    access_codes = FakeCollection("access_codes")
+    access_codes.docs = [code_doc(index, now - timedelta(minutes=1)) for index in range(7)]
+    access_codes.docs.append(code_doc(99, now + timedelta(days=1)))
+    sweeper = ExpirySweeper(access_codes, FakeCollection("playlists"), batch_size=2, max_batches=3, batch_pause=0)
+
+    first = asyncio.run(sweeper.sweep())
+    second = asyncio.run(sweeper.sweep())
+
+    # Three batches of two per pass; the rest waits for the next one
+    assert first["codes_deactivated"] == 6 and second["codes_deactivated"] == 1
+    assert access_codes.calls["update_many"] == 4
+    assert [doc["id"] for doc in access_codes.docs if doc["is_active"]] == ["a99"]
+    assert sweeper.get_stats()["codes_deactivated"] == 7
+
+
+def test_long_expired_documents_are_archived_deleted_and_forgotten():
+    now = datetime.utcnow()
+    access_codes, playlists = FakeCollection("access_codes"), FakeCollection("playlists")
+    codes_archive = FakeCollection("access_codes_archive", unique=("_id",))
+    playlists_archive = FakeCollection("playlists_archive", unique=("_id",))
+    access_codes.docs = [code_doc(1, now - timedelta(days=30)), code_doc(2, now - timedelta(hours=1))]
+    playlists.docs = [
+        {"_id": 1, "id": "old", "channels": ["c1"], "expiry_date": now - timedelta(days=30)},
+        {"_id": 2, "id": "live", "channels": ["c1"], "expiry_date": now + timedelta(days=1)},
+    ]
+    # A previous pass archived this playlist but failed before deleting it
+    playlists_archive.docs = [dict(playlists.docs[0])]
+    cache, directory = PlaylistCache(), ChannelDirectory(None, None)
+    version = cache.version("old", 0)
+    cache.put("old", version, "m3u8", "CODE", b"#EXTM3U\n", "text/plain", ["c1"])
+    directory.put_channel("c1", "http://o/c1.m3u8")
+    directory.put_playlist("old", ["c1"])
+    sweeper = ExpirySweeper(access_codes, playlists, codes_archive, playlists_archive, batch_pause=0,
+                            playlist_cache=cache, channel_directory=directory)
+
+    result = asyncio.run(sweeper.sweep())
+
+    assert result == {"codes_deactivated": 2, "codes_deleted": 1, "playlists_deleted": 1}
+    assert [doc["id"] for doc in access_codes.docs] == ["a2"]
+    assert [doc["id"] for doc in codes_archive.docs] == ["a1"] and "archived_at" in codes_archive.docs[0]
+    assert [doc["id"] for doc in playlists.docs] == ["live"]
+    assert len(playlists_archive.docs) == 1
+    assert cache.get("old", version, "m3u8", "CODE") is None
+    assert not directory.in_playlist("old", "c1")
@@ -0,0 +1,87 @@
+import asyncio
+
+from fetch_coalescer import FetchCoalescer
+
+
+def test_late_joiner_replays_from_first_byte():
+    async def scenario():
+        coalescer = FetchCoalescer()
+        release = asyncio.Event()
+
+        async def fetch(inflight):
+            inflight.set_headers("video/mp2t", {}, None)
+            await inflight.append(b"first")
+            await release.wait()
+            await inflight.append(b"second")
+
+        early = coalescer.join("http://origin/seg.ts", fetch)
+        await early.inflight.wait_headers()
+        assert await early.__anext__() == b"first"
+
+        late = coalescer.join("http://origin/seg.ts", fetch)
+        assert late.inflight is early.inflight
+        release.set()
+        return [chunk async for chunk in early], [chunk async for chunk in late], coalescer.stats
+
+    early_rest, late_body, stats = asyncio.run(scenario())
+    assert early_rest == [b"second"]
+    assert late_body == [b"first", b"second"]
+    assert stats == {"fetches": 1, "joins": 1}
+
+
+def test_last_viewer_leaving_cancels_upstream_fetch():
+    async def scenario():
+        coalescer = FetchCoalescer()
+        cancelled = asyncio.Event()
+
+        async def fetch(inflight):
+            inflight.set_headers("video/mp2t", {}, None)
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = coalescer.join("http://origin/live.ts", fetch)
+        second = coalescer.join("http://origin/live.ts", fetch)
+        await first.inflight.wait_headers()
+        first.close()
+        await asyncio.sleep(0)
+        still_running = not cancelled.is_set()
+        second.close()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return still_running, coalescer.get_stats()
+
+    still_running, stats = asyncio.run(scenario())
+    assert still_running
+    assert stats["inflight"] == 0
+
+
+def test_unbounded_body_becomes_sliding_live_window():
+    async def scenario():
+        coalescer = FetchCoalescer(max_buffer_bytes=10)
+        release = asyncio.Event()
+
+        async def fetch(inflight):
+            inflight.set_headers("video/mp2t", {}, None)
+            for index in range(6):
+                await inflight.append(bytes([index]) * 4)
+            await release.wait()
+
+        first = coalescer.join("http://origin/channel", fetch)
+        await first.inflight.wait_headers()
+        await asyncio.sleep(0)
+        inflight = first.inflight
+        late = coalescer.join("http://origin/channel", fetch)
+        head = await late.__anext__()
+        release.set()
+        first.close()
+        late.close()
+        return inflight, late.inflight, head
+
+    inflight, joined, head = asyncio.run(scenario())
+    assert joined is inflight
+    assert inflight.live and not inflight.retain_all
+    assert inflight.buffered <= 10
+    # The late viewer starts at the oldest chunk still in the window
+    assert head == bytes([inflight.base_index]) * 4
@@ -0,0 +1,81 @@
+from hls import HLSManifest, ManifestCache, decode_upstream_url
+
+MEDIA_PLAYLIST = """#EXTM3U
+#EXT-X-TARGETDURATION:6
+#EXT-X-KEY:METHOD=AES-128,URI="keys/k1.bin"
+#EXT-X-MAP:URI="init.mp4"
+#EXTINF:6.0,
+seg1.ts
+
+#EXTINF:6.0,
+https://cdn.example.com/abs/seg2.ts
+#EXT-X-ENDLIST
+"""
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="aud",URI="audio/en.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=800000
+low/index.m3u8
+"""
+
+
+def test_media_playlist_uris_are_rewritten():
+    manifest = HLSManifest.parse(MEDIA_PLAYLIST, "http://origin/live/index.m3u8")
+
+    assert manifest.target_duration == 6.0
+    assert not manifest.is_master
+    assert manifest.is_endlist
+    assert manifest.segment_urls == ["http://origin/live/seg1.ts", "https://cdn.example.com/abs/seg2.ts"]
+    assert manifest.uris == [
+        "http://origin/live/keys/k1.bin",
+        "http://origin/live/init.mp4",
+        "http://origin/live/seg1.ts",
+        "https://cdn.example.com/abs/seg2.ts",
+    ]
+    assert [decode_upstream_url(part) for part in manifest.parts[1::2]] == manifest.uris
+
+
+def test_render_places_prefix_before_every_uri():
+    manifest = HLSManifest.parse(MEDIA_PLAYLIST, "http://origin/live/index.m3u8")
+
+    rendered = manifest.render("p/")
+    encoded = manifest.parts[1::2]
+    assert f'URI="p/{encoded[0]}"' in rendered
+    assert f"\np/{encoded[2]}\n" in rendered
+    assert "#EXT-X-TARGETDURATION:6\n" in rendered
+    assert rendered.count("p/") == len(encoded)
+
+
+def test_render_places_prefix_and_signatures():
+    manifest = HLSManifest.parse(MEDIA_PLAYLIST, "http://origin/live/index.m3u8")
+    signatures = [f"sig{index}" for index in range(len(manifest.uris))]
+
+    rendered = manifest.render("ch/", signatures)
+    encoded = manifest.parts[1::2]
+    assert f'URI="ch/sig0/{encoded[0]}"' in rendered
+    assert f"\nch/sig2/{encoded[2]}\n" in rendered
+
+
+def test_manifest_cache_ttl():
+    cache = ManifestCache(endlist_ttl=300.0, min_ttl=1.0)
+    live = HLSManifest.parse("#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6,\ns.ts\n", "http://o/i.m3u8")
+    vod = HLSManifest.parse(MEDIA_PLAYLIST, "http://o/i.m3u8")
+
+    assert cache.ttl_for(live) == 3.0
+    assert cache.ttl_for(vod) == 300.0
+    assert cache.put("http://o/i.m3u8", live) is cache.peek("http://o/i.m3u8")
+
+
+def test_master_playlist_variants_are_not_segments():
+    manifest = HLSManifest.parse(MASTER_PLAYLIST, "http://origin/master.m3u8")
+
+    assert manifest.is_master
+    assert manifest.segment_urls == []
+    assert manifest.uris == ["http://origin/audio/en.m3u8", "http://origin/low/index.m3u8"]
+
+
+def test_non_http_uris_are_left_alone():
+    manifest = HLSManifest.parse('#EXTM3U\n#EXT-X-KEY:METHOD=SAMPLE-AES,URI="skd://key"\n', "http://origin/a.m3u8")
+
+    assert manifest.uris == []
+    assert 'URI="skd://key"' in manifest.render("p/")
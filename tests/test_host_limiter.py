@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from channel_directory import ChannelDirectory
+from hls import encode_upstream_url
+from iptv_generator import StreamProxy, StreamProxyError
+from stream_tokens import StreamTokenCodec
+from upstream import HostLimiter, UpstreamBusyError, UpstreamClient
+
+
+def test_full_host_queue_is_rejected_at_once():
+    async def scenario():
+        limiter = HostLimiter(max_in_flight_per_host=1, max_queue_per_host=0, retry_after=7)
+        await limiter.acquire("origin")
+        with pytest.raises(UpstreamBusyError) as busy:
+            await limiter.acquire("origin")
+        # Other hosts are unaffected
+        await limiter.acquire("other")
+        return limiter, busy.value
+
+    limiter, error = asyncio.run(scenario())
+    assert error.retry_after == 7
+    stats = limiter.get_stats()
+    assert stats["in_flight"] == 2
+    assert stats["hosts"]["origin"]["rejected"] == 1
+
+
+def test_queued_request_times_out():
+    async def scenario():
+        limiter = HostLimiter(max_in_flight_per_host=1, max_queue_per_host=5, queue_timeout=0.05)
+        await limiter.acquire("origin")
+        with pytest.raises(UpstreamBusyError):
+            await limiter.acquire("origin")
+        return limiter.get_stats()["hosts"]["origin"]
+
+    host = asyncio.run(scenario())
+    assert host["queue_depth"] == 0
+    assert host["rejected"] == 1
+
+
+def test_release_admits_the_next_waiter():
+    async def scenario():
+        limiter = HostLimiter(max_in_flight_per_host=1, max_queue_per_host=5)
+        await limiter.acquire("origin")
+        waiter = asyncio.create_task(limiter.acquire("origin"))
+        await asyncio.sleep(0)
+        queued = limiter.get_stats()["hosts"]["origin"]["queue_depth"]
+        limiter.release("origin")
+        await asyncio.wait_for(waiter, 1)
+        return queued, limiter.get_stats()["hosts"]["origin"]
+
+    queued, host = asyncio.run(scenario())
+    assert queued == 1
+    assert host["in_flight"] == 1
+    assert host["acquired"] == 2
+
+
+def test_global_limit_applies_across_hosts():
+    async def scenario():
+        limiter = HostLimiter(max_in_flight=1, max_queue_per_host=0)
+        await limiter.acquire("a")
+        with pytest.raises(UpstreamBusyError):
+            await limiter.acquire("b")
+
+    asyncio.run(scenario())
+
+
+def test_busy_upstream_is_answered_with_503():
+    async def scenario():
+        url = "http://busy.example.com/live.ts"
+        codec = StreamTokenCodec({1: b"k" * 32})
+        directory = ChannelDirectory(None, None)
+        directory.put_channel("news", url)
+        upstream = UpstreamClient(limit_per_host=1, max_queue_per_host=0, retry_after=3)
+        proxy = StreamProxy(upstream=upstream, tokens=codec, directory=directory)
+        await upstream.limiter.acquire("busy.example.com")
+        try:
+            with pytest.raises(StreamProxyError) as busy:
+                await proxy.proxy_stream(codec.issue("viewer", "news"), encode_upstream_url(url))
+        finally:
+            await upstream.close()
+        return busy.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.headers == {"Retry-After": "3"}
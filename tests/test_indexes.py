@@ -0,0 +1,75 @@
+import asyncio
+
+from indexes import (HOT_QUERIES, INDEXES, IndexSpec, QueryProbe, audit_query_plans, ensure_indexes,
+                     plan_indexes, plan_stages)
+from tests.fakes import FakeDatabase, operation_failure
+
+SORTED_IXSCAN = {"stage": "LIMIT", "inputStage": {
+    "stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "created_by_1_created_at_1_id_1"}}}
+OR_PLAN = {"stage": "SUBPLAN", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "OR", "inputStages": [
+    {"stage": "IXSCAN", "indexName": "username_1"}, {"stage": "IXSCAN", "indexName": "email_1"}]}}}
+COLLSCAN = {"stage": "LIMIT", "inputStage": {"stage": "SORT", "inputStage": {"stage": "COLLSCAN"}}}
+
+
+class ExplainedCursor:
+    def __init__(self, plan):
+        self.plan = plan
+        self.sorted_by = None
+
+    def limit(self, count):
+        return self
+
+    def sort(self, keys):
+        self.sorted_by = keys
+        return self
+
+    async def explain(self):
+        return {"queryPlanner": {"winningPlan": self.plan}}
+
+
+class PlannedCollection:
+    def __init__(self, plans):
+        self.plans = plans
+
+    def find(self, query):
+        return ExplainedCursor(self.plans.get(next(iter(query), None), COLLSCAN))
+
+
+def test_plan_walk_covers_nested_and_branching_stages():
+    assert plan_stages(SORTED_IXSCAN) == ["LIMIT", "FETCH", "IXSCAN"]
+    assert plan_stages(OR_PLAN) == ["SUBPLAN", "FETCH", "OR", "IXSCAN", "IXSCAN"]
+    assert plan_indexes(OR_PLAN) == ["username_1", "email_1"]
+    assert plan_indexes(COLLSCAN) == []
+
+
+def test_audit_flags_collection_scans():
+    db = {"playlists": PlannedCollection({"created_by": SORTED_IXSCAN})}
+    probes = [
+        QueryProbe("own playlists", "playlists", {"created_by": "u"}, [("created_at", 1), ("id", 1)]),
+        QueryProbe("unindexed", "playlists", {"name": "x"}),
+    ]
+
+    audit = asyncio.run(audit_query_plans(db, probes))
+
+    assert audit["collscans"] == ["unindexed"]
+    assert audit["queries"][0]["indexes"] == ["created_by_1_created_at_1_id_1"]
+    assert audit["queries"][1]["stages"] == ["LIMIT", "SORT", "COLLSCAN"]
+
+
+def test_failed_indexes_are_reported_and_the_rest_created():
+    db = FakeDatabase()
+    db["access_codes"].failures["create_index"] = [operation_failure("E11000 duplicate key")]
+    specs = [IndexSpec("access_codes", [("code", 1)], unique=True), IndexSpec("access_codes", [("expires_at", 1)])]
+
+    ensured = asyncio.run(ensure_indexes(db, specs))
+
+    assert ensured["indexes"] == ["expires_at_1"]
+    assert ensured["failed"][0]["keys"] == [("code", 1)]
+    assert "duplicate key" in ensured["failed"][0]["error"]
+
+
+def test_every_hot_query_collection_has_indexes():
+    indexed = {spec.collection for spec in INDEXES}
+
+    assert {probe.collection for probe in HOT_QUERIES} <= indexed
+    assert all(spec.options.get("unique") for spec in INDEXES if spec.keys == [("id", 1)])
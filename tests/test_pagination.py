@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime
+
+import orjson
+import pytest
+
+from models import ChannelCategory, IPTVChannel
+from pagination import (decode_cursor, encode_cursor, fill_defaults, keyset_query, model_projection, ndjson_rows,
+                        trusted_list_response)
+from tests.fakes import FakeCollection
+
+
+def channel_doc(index: int, created_at: datetime):
+    return {"id": f"ch{index}", "name": f"Channel {index}", "url": f"http://o/{index}.m3u8",
+            "category": "news", "created_by": "owner", "created_at": created_at}
+
+
+def test_projection_and_defaults_rebuild_the_model():
+    projection = model_projection(IPTVChannel)
+    doc = fill_defaults(IPTVChannel, {"id": "ch1", "name": "News", "url": "http://o/1.m3u8",
+                                      "category": "news", "created_by": "owner"})
+
+    assert projection["_id"] == 0 and projection.keys() - {"_id"} == IPTVChannel.model_fields.keys()
+    assert doc.keys() == IPTVChannel.model_fields.keys()
+    assert IPTVChannel(**doc).category == ChannelCategory.NEWS
+
+
+def test_defaults_are_fresh_per_document():
+    first = fill_defaults(IPTVChannel, {"id": "a"})
+    second = fill_defaults(IPTVChannel, {"id": "b"})
+
+    assert first["mirror_urls"] is not second["mirror_urls"]
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30)
+
+    assert decode_cursor(encode_cursor({"created_at": created_at, "id": "ch|7"})) == (created_at, "ch|7")
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_keyset_pages_cover_every_row_once_despite_ties():
+    collection = FakeCollection("channels")
+    tied = datetime(2024, 5, 1)
+    collection.docs = [channel_doc(index, tied if index < 4 else datetime(2024, 5, index)) for index in range(7)]
+
+    seen, after = [], None
+    while True:
+        page = asyncio.run(collection.find(keyset_query({"created_by": "owner"}, after)).to_list(None))
+        docs = sorted(page, key=lambda doc: (doc["created_at"], doc["id"]))[:3]
+        if not docs:
+            break
+        seen.extend(doc["id"] for doc in docs)
+        after = encode_cursor(docs[-1])
+
+    assert seen == [f"ch{index}" for index in range(7)]
+    assert keyset_query({"created_by": "owner"}, None) == {"created_by": "owner"}
+
+
+def test_ndjson_rows_batches_lines():
+    async def cursor():
+        for index in range(5):
+            yield {"id": f"ch{index}", "name": "n", "url": "http://o", "category": "news", "created_by": "owner"}
+
+    async def collect():
+        return [chunk async for chunk in ndjson_rows(IPTVChannel, cursor(), batch_size=2)]
+
+    chunks = asyncio.run(collect())
+    lines = b"".join(chunks).splitlines()
+
+    assert len(chunks) == 3 and all(chunk.endswith(b"\n") for chunk in chunks)
+    assert [orjson.loads(line)["id"] for line in lines] == [f"ch{index}" for index in range(5)]
+    assert orjson.loads(lines[0])["is_active"] is True
+
+
+def test_trusted_list_response_matches_the_model_schema():
+    response = trusted_list_response(IPTVChannel, [{"id": "ch1", "name": "News", "url": "http://o/1.m3u8",
+                                                    "category": "news", "created_by": "owner"}])
+    [row] = orjson.loads(response.body)
+
+    assert row.keys() == IPTVChannel.model_fields.keys()
+    assert row["mirror_urls"] == [] and row["quality"] == "HD"
@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+
+from playlist_cache import PlaylistCache, choose_encoding, etag_matches
+
+
+def store(cache, playlist_id="p1", stored_version=0, body=b"#EXTM3U\n", channels=("c1", "c2")):
+    version = cache.version(playlist_id, stored_version)
+    return version, cache.put(playlist_id, version, "m3u8", "CODE", body, "application/vnd.apple.mpegurl", channels)
+
+
+def test_hit_under_current_version():
+    cache = PlaylistCache()
+    version, entry = store(cache)
+
+    assert cache.get("p1", cache.version("p1", 0), "m3u8", "CODE") is entry
+    assert cache.get("p1", version, "json", "CODE") is None
+    assert entry.etag.startswith(f'"{version}-')
+
+
+def test_newer_stored_version_misses():
+    cache = PlaylistCache()
+    store(cache, stored_version=3)
+
+    # Another worker edited the playlist and bumped its version in Mongo
+    assert cache.get("p1", cache.version("p1", 4), "m3u8", "CODE") is None
+
+
+def test_render_started_before_invalidation_is_discarded():
+    cache = PlaylistCache()
+    version = cache.version("p1", 0)
+    cache.invalidate_playlist("p1")
+
+    assert cache.put("p1", version, "m3u8", "CODE", b"stale", "text/plain", ["c1"]) is None
+    assert cache.version("p1", 0) == version + 1
+
+
+def test_channel_change_invalidates_containing_playlists():
+    cache = PlaylistCache()
+    store(cache, "p1", channels=["c1"])
+    store(cache, "p2", channels=["c2"])
+    cache.invalidate_channels(["c1"])
+
+    assert cache.get("p1", cache.version("p1"), "m3u8", "CODE") is None
+    assert cache.get("p2", cache.version("p2"), "m3u8", "CODE") is not None
+
+
+def test_byte_budget_evicts_least_recently_used():
+    cache = PlaylistCache(max_bytes=20)
+    store(cache, "p1", body=b"a" * 10)
+    store(cache, "p2", body=b"b" * 10)
+    cache.get("p1", cache.version("p1"), "m3u8", "CODE")
+    store(cache, "p3", body=b"c" * 10)
+
+    assert cache.get("p2", cache.version("p2"), "m3u8", "CODE") is None
+    assert cache.get("p1", cache.version("p1"), "m3u8", "CODE") is not None
+    assert cache.size <= 20
+
+
+def test_etag_matching_is_weak():
+    assert etag_matches('"3-abc"', '"3-abc"')
+    assert etag_matches('W/"3-abc", "4-def"', '"3-abc"')
+    assert etag_matches("*", '"3-abc"')
+    assert not etag_matches('"3-abd"', '"3-abc"')
+    assert not etag_matches(None, '"3-abc"')
+
+
+def test_encoding_negotiation():
+    assert choose_encoding("gzip, br", {"gzip", "br"}) == "br"
+    assert choose_encoding("gzip, br;q=0", {"gzip", "br"}) == "gzip"
+    assert choose_encoding("*", {"gzip"}) == "gzip"
+    assert choose_encoding("identity", {"gzip", "br"}) is None
+    assert choose_encoding("br", {"gzip"}) is None
+
+
+def test_large_bodies_are_compressed_after_the_first_serve():
+    async def scenario():
+        cache = PlaylistCache()
+        body = b"#EXTINF:-1,Channel\nhttp://srv/stream\n" * 200
+        version, entry = store(cache, body=body)
+        # Served uncompressed until the background task attaches the encodings
+        assert entry.encodings == {}
+        await asyncio.sleep(0)
+        while cache._compressing:
+            await asyncio.gather(*cache._compressing)
+        return cache, entry, body
+
+    cache, entry, body = asyncio.run(scenario())
+    assert gzip.decompress(entry.encodings["gzip"]) == body
+    assert cache.stats["compressions"] == 1
+    assert cache.size == entry.size
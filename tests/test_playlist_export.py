@@ -0,0 +1,52 @@
+import asyncio
+
+import orjson
+
+from iptv_generator import IPTVGenerator
+from models import ChannelCategory, IPTVChannel, Playlist
+from stream_tokens import StreamTokenCodec
+
+
+def make_channels(count: int):
+    return [
+        IPTVChannel(id=f"ch{index}", name=f"Channel {index}", url=f"http://o/{index}.m3u8",
+                    category=ChannelCategory.NEWS, created_by="owner")
+        for index in range(count)
+    ]
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+async def cursor(channels):
+    for channel in channels:
+        yield channel
+
+
+def test_streamed_m3u8_matches_the_whole_render():
+    channels = make_channels(5)
+    # ch4 is not a member: a stale cursor row must not leak into the export
+    playlist = Playlist(id="pl", name="p", channels=[channel.id for channel in channels[:4]], created_by="owner")
+    generator = IPTVGenerator("http://srv", tokens=StreamTokenCodec({1: b"k" * 32}))
+
+    chunks = asyncio.run(collect(generator.stream_m3u8_playlist(playlist, cursor(channels), "owner", batch_size=2)))
+    whole = asyncio.run(generator.generate_m3u8_playlist(playlist, channels, "owner"))
+
+    assert chunks[0] == generator.m3u8_header()
+    assert len(chunks) == 3
+    assert "".join(chunks) == whole
+    assert whole.count("#EXTINF") == 4
+    assert "ch4" not in whole
+
+
+def test_streamed_json_is_one_document():
+    channels = make_channels(3)
+    playlist = Playlist(id="pl", name="p", channels=[channel.id for channel in channels], created_by="owner")
+    generator = IPTVGenerator("http://srv", tokens=StreamTokenCodec({1: b"k" * 32}))
+
+    chunks = asyncio.run(collect(generator.stream_json_playlist(playlist, cursor(channels), 3, "owner", batch_size=2)))
+    document = orjson.loads("".join(chunk if isinstance(chunk, str) else chunk.decode() for chunk in chunks))
+
+    assert document["playlist_info"]["total_channels"] == 3
+    assert [channel["id"] for channel in document["channels"]] == ["ch0", "ch1", "ch2"]
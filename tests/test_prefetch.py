@@ -0,0 +1,74 @@
+import asyncio
+
+from hls import HLSManifest
+from prefetch import SegmentPrefetcher
+
+
+def live_manifest(first: int, count: int = 5) -> HLSManifest:
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:4"]
+    for index in range(first, first + count):
+        lines += ["#EXTINF:4,", f"seg{index}.ts"]
+    return HLSManifest.parse("\n".join(lines) + "\n", "http://origin/live/index.m3u8")
+
+
+def test_newest_segments_are_warmed_once():
+    async def scenario():
+        warmed = []
+
+        async def warm(url, channel_key):
+            warmed.append((url, channel_key))
+            return 100
+
+        prefetcher = SegmentPrefetcher(warm, depth=2)
+        prefetcher.on_manifest("news", live_manifest(1))
+        prefetcher.on_manifest("news", live_manifest(1))
+        prefetcher.on_manifest("news", live_manifest(2))
+        await asyncio.sleep(0.01)
+        return warmed, prefetcher.get_stats()
+
+    warmed, stats = asyncio.run(scenario())
+    assert warmed == [
+        ("http://origin/live/seg4.ts", "news"),
+        ("http://origin/live/seg5.ts", "news"),
+        ("http://origin/live/seg6.ts", "news"),
+    ]
+    assert stats["completed"] == 3
+    assert stats["bytes"] == 300
+    assert stats["in_flight"] == 0
+
+
+def test_vod_and_master_playlists_are_not_prefetched():
+    async def scenario():
+        calls = []
+
+        async def warm(url, channel_key):
+            calls.append(url)
+            return 0
+
+        prefetcher = SegmentPrefetcher(warm)
+        prefetcher.on_manifest("vod", HLSManifest.parse("#EXTM3U\n#EXTINF:4,\na.ts\n#EXT-X-ENDLIST\n", "http://o/v.m3u8"))
+        prefetcher.on_manifest("master", HLSManifest.parse("#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\nlow.m3u8\n", "http://o/m.m3u8"))
+        await asyncio.sleep(0.01)
+        return calls
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_concurrency_budget_skips_excess_segments():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def warm(url, channel_key):
+            await release.wait()
+            return 0
+
+        prefetcher = SegmentPrefetcher(warm, depth=3, max_concurrency=1)
+        prefetcher.on_manifest("news", live_manifest(1))
+        stats = dict(prefetcher.get_stats())
+        release.set()
+        await prefetcher.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["scheduled"] == 1
+    assert stats["skipped_budget"] == 2
@@ -0,0 +1,192 @@
+import asyncio
+import time
+
+from aiohttp import web
+
+from channel_directory import ChannelDirectory
+from fetch_coalescer import FetchCoalescer
+from hls import encode_upstream_url
+from iptv_generator import StreamProxy
+from segment_store import DiskSegmentStore, SegmentWriter
+from stream_cache import SegmentCache
+from stream_tokens import StreamTokenCodec
+from tests.fakes import start_origin
+
+
+def test_segments_survive_a_restart(tmp_path):
+    async def scenario():
+        store = DiskSegmentStore(str(tmp_path))
+        await store.start()
+        store.put("http://o/a.ts", b"a" * 10, "video/mp2t", 600)
+        store.put("http://o/b.ts", b"b" * 10, "video/mp4", 600)
+        await store.close()
+
+        # Leftovers of an interrupted write and a body whose sidecar never landed
+        (tmp_path / ".tmp-interrupted").write_bytes(b"partial")
+        (tmp_path / "ff").mkdir(exist_ok=True)
+        (tmp_path / "ff" / "orphan.seg").write_bytes(b"orphan")
+
+        restarted = DiskSegmentStore(str(tmp_path))
+        await restarted.start()
+        return restarted
+
+    store = asyncio.run(scenario())
+    entry = store.get("http://o/b.ts")
+    assert entry.media_type == "video/mp4"
+    assert entry.path.read_bytes() == b"b" * 10
+    assert store.stats["recovered"] == 2
+    assert not (tmp_path / ".tmp-interrupted").exists()
+    assert not (tmp_path / "ff" / "orphan.seg").exists()
+
+
+def test_expired_segments_are_not_recovered(tmp_path):
+    async def scenario():
+        store = DiskSegmentStore(str(tmp_path))
+        await store.start()
+        store.put("http://o/a.ts", b"a", "video/mp2t", 600)
+        await store.close()
+        store._index["http://o/a.ts"].expires_at = time.time() - 1
+        missed = store.get("http://o/a.ts") is None
+        store.put("http://o/old.ts", b"o", "video/mp2t", -1)
+        await store.close()
+
+        restarted = DiskSegmentStore(str(tmp_path))
+        await restarted.start()
+        return missed, restarted
+
+    missed, store = asyncio.run(scenario())
+    assert missed
+    assert store.stats["recovered"] == 0
+
+
+def test_least_recently_used_segments_are_evicted(tmp_path):
+    async def scenario():
+        store = DiskSegmentStore(str(tmp_path), max_bytes=20)
+        await store.start()
+        for name in "abc":
+            store.put(f"http://o/{name}.ts", name.encode() * 10, "video/mp2t", 600)
+            await store.close()
+            if name == "b":
+                store.get("http://o/a.ts")
+        return store
+
+    store = asyncio.run(scenario())
+    assert store.get("http://o/b.ts") is None
+    assert store.get("http://o/a.ts") is not None
+    assert store.get("http://o/c.ts") is not None
+    assert store.size == 20
+    assert len(list(tmp_path.rglob("*.seg"))) == 2
+
+
+def test_segments_evicted_from_memory_are_served_from_disk(tmp_path):
+    async def scenario():
+        store = DiskSegmentStore(str(tmp_path))
+        await store.start()
+        proxy = StreamProxy(cache=SegmentCache(max_bytes=15), disk=store)
+        proxy.cache.put("http://o/a.ts", b"a" * 10, "video/mp2t", 600)
+        proxy.cache.put("http://o/b.ts", b"b" * 10, "video/mp2t", 600)
+        await store.close()
+
+        stream = await proxy._disk_stream("http://o/a.ts", store.get("http://o/a.ts"))
+        body = b"".join([chunk async for chunk in stream.body])
+        await proxy.upstream.close()
+        return stream, body
+
+    stream, body = asyncio.run(scenario())
+    assert stream.headers["x-cache"] == "HIT-DISK"
+    assert body == b"a" * 10
+
+
+def test_missing_file_falls_through(tmp_path):
+    async def scenario():
+        store = DiskSegmentStore(str(tmp_path))
+        await store.start()
+        store.put("http://o/a.ts", b"a" * 10, "video/mp2t", 600)
+        await store.close()
+        entry = store.get("http://o/a.ts")
+        entry.path.unlink()
+
+        proxy = StreamProxy(disk=store)
+        stream = await proxy._disk_stream("http://o/a.ts", entry)
+        await proxy.upstream.close()
+        return stream, store
+
+    stream, store = asyncio.run(scenario())
+    assert stream is None
+    assert store.get("http://o/a.ts") is None
+
+
+def test_memory_cache_is_spilled_at_shutdown_and_recovered(tmp_path):
+    async def shutdown():
+        store = DiskSegmentStore(str(tmp_path))
+        await store.start()
+        proxy = StreamProxy(cache=SegmentCache(), disk=store)
+        proxy.cache.put("http://o/hot.ts", b"h" * 10, "video/mp2t", 600)
+        # Too close to expiry to be worth keeping
+        proxy.cache.put("http://o/live.ts", b"l" * 10, "video/mp2t", 2)
+        spilled = proxy.spill_cache()
+        await store.close()
+        await proxy.upstream.close()
+        return spilled
+
+    async def restart():
+        store = DiskSegmentStore(str(tmp_path))
+        await store.start()
+        return store
+
+    spilled = asyncio.run(shutdown())
+    store = asyncio.run(restart())
+    assert spilled == 1
+    assert store.get("http://o/hot.ts").size == 10
+    assert store.get("http://o/live.ts") is None
+
+
+def test_bodies_too_large_for_memory_are_written_through(tmp_path):
+    movie = bytes(range(256)) * (12 * 1024)
+
+    async def scenario():
+        async def vod(request):
+            return web.Response(body=movie, content_type="video/mp4")
+
+        runner, base = await start_origin({"/movie.mp4": vod})
+        url = f"{base}/movie.mp4"
+        store = DiskSegmentStore(str(tmp_path))
+        await store.start()
+        codec = StreamTokenCodec({1: b"k" * 32})
+        directory = ChannelDirectory(None, None)
+        directory.put_channel("vod", url)
+        proxy = StreamProxy(cache=SegmentCache(max_entry_bytes=64 * 1024), coalescer=FetchCoalescer(64 * 1024),
+                            disk=store, tokens=codec, directory=directory)
+        token = codec.issue("viewer", "vod")
+        try:
+            first = await proxy.proxy_stream(token, encode_upstream_url(url))
+            first_body = b"".join([chunk async for chunk in first.body])
+            again = await proxy.proxy_stream(token, encode_upstream_url(url))
+            again_body = b"".join([chunk async for chunk in again.body])
+        finally:
+            await proxy.upstream.close()
+            await runner.cleanup()
+        return first, first_body, again, again_body, store
+
+    first, first_body, again, again_body, store = asyncio.run(scenario())
+    assert first.headers["x-cache"] == "MISS" and first_body == movie
+    assert again.headers["x-cache"] == "HIT-DISK" and again_body == movie
+    assert store.get_stats()["pending_writes"] == 0
+    assert not list(tmp_path.rglob(".tmp-*"))
+
+
+def test_aborted_writes_leave_nothing_behind(tmp_path):
+    async def scenario():
+        store = DiskSegmentStore(str(tmp_path))
+        await store.start()
+        writer = store.open_writer("http://o/movie.mp4", "video/mp4", 600)
+        duplicate = store.open_writer("http://o/movie.mp4", "video/mp4", 600)
+        await writer.write(b"m" * (SegmentWriter.WRITE_BYTES + 1))
+        await writer.abort()
+        too_large = store.open_writer("http://o/huge.mp4", "video/mp4", 600, size=store.max_bytes + 1)
+        return store, duplicate, too_large
+
+    store, duplicate, too_large = asyncio.run(scenario())
+    assert duplicate is None and too_large is None
+    assert store.get("http://o/movie.mp4") is None
+    assert not [path for path in tmp_path.rglob("*") if path.is_file()]
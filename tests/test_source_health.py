@@ -0,0 +1,104 @@
+import asyncio
+
+from aiohttp import web
+
+from channel_directory import ChannelDirectory
+from iptv_generator import StreamProxy
+from source_health import SourceSelector
+from stream_tokens import StreamTokenCodec
+from tests.fakes import start_origin
+
+PRIMARY = "http://primary.example.com/live/news/index.m3u8"
+MIRROR = "http://mirror.example.com/hls/news-backup.m3u8"
+SPARE = "http://spare.example.com/news.m3u8"
+
+
+def selector():
+    sources = SourceSelector()
+    sources.register_channel("news", [PRIMARY, MIRROR, SPARE])
+    return sources
+
+
+def test_exact_urls_map_to_configured_mirrors_in_order():
+    assert selector().candidates(PRIMARY, "news") == [PRIMARY, MIRROR, SPARE]
+
+
+def test_unrelated_url_under_a_source_directory_is_not_mirrored():
+    assert selector().candidates("http://primary.example.com/live/news/other.m3u8", "news") == [
+        "http://primary.example.com/live/news/other.m3u8"
+    ]
+
+
+def test_derived_uris_map_relative_to_each_source_directory():
+    assert selector().candidates("http://primary.example.com/live/news/seg-1.ts", "news", derived=True) == [
+        "http://primary.example.com/live/news/seg-1.ts",
+        "http://mirror.example.com/hls/seg-1.ts",
+        "http://spare.example.com/seg-1.ts",
+    ]
+
+
+def test_healthy_sampled_sources_rank_before_unsampled_then_unhealthy():
+    sources = selector()
+    sources.record(SPARE, 0.2, True, "news")
+    for _ in range(3):
+        sources.record(PRIMARY, 0.1, False, "news")
+
+    assert sources.candidates(PRIMARY, "news") == [SPARE, MIRROR, PRIMARY]
+
+    sources.record(MIRROR, 0.05, True, "news")
+    assert sources.candidates(PRIMARY, "news") == [MIRROR, SPARE, PRIMARY]
+
+
+def test_health_is_kept_per_channel():
+    sources = selector()
+    sources.register_channel("news-hd", [PRIMARY, SPARE])
+    sources.record(PRIMARY, 0.1, False, "news")
+
+    assert sources.candidates(PRIMARY, "news-hd") == [PRIMARY, SPARE]
+    assert sources.candidates(PRIMARY, "news") == [MIRROR, SPARE, PRIMARY]
+
+
+def test_unregister_channel_sharing_sources():
+    sources = selector()
+    sources.register_channel("news-hd", [PRIMARY, SPARE])
+    sources.unregister_channel("news")
+    sources.unregister_channel("news")
+
+    assert sources.candidates(PRIMARY) == [PRIMARY, SPARE]
+    assert list(sources.get_stats()["channels"]) == ["news-hd"]
+
+
+def test_single_source_channels_are_ignored():
+    sources = SourceSelector()
+    sources.register_channel("solo", [PRIMARY, PRIMARY])
+
+    assert sources.candidates(PRIMARY, "solo") == [PRIMARY]
+
+
+def test_stream_fails_over_to_mirror():
+    async def scenario():
+        async def broken(request):
+            return web.Response(status=500)
+
+        async def healthy(request):
+            return web.Response(body=b"mirror body", content_type="video/mp2t")
+
+        runner, base = await start_origin({"/primary/live.ts": broken, "/backup/other.ts": healthy})
+        primary, mirror = f"{base}/primary/live.ts", f"{base}/backup/other.ts"
+        codec = StreamTokenCodec({1: b"k" * 32})
+        directory = ChannelDirectory(None, None)
+        directory.put_channel("news", primary, [mirror])
+        sources = SourceSelector()
+        sources.register_channel("news", [primary, mirror])
+        proxy = StreamProxy(tokens=codec, directory=directory, sources=sources)
+        try:
+            stream = await proxy.proxy_channel(codec.issue("viewer", "news"), "news")
+            body = b"".join([chunk async for chunk in stream.body])
+        finally:
+            await proxy.upstream.close()
+            await runner.cleanup()
+        return body, sources.candidates(primary, "news"), [primary, mirror]
+
+    body, ranked, (primary, mirror) = asyncio.run(scenario())
+    assert body == b"mirror body"
+    assert ranked == [mirror, primary]
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+
+from iptv_generator import StreamProxy
+from stream_cache import SegmentCache, parse_byte_range
+
+
+def test_ttl_follows_cache_control_and_segment_extensions():
+    cache = SegmentCache(default_ttl=30, immutable_ttl=600)
+
+    assert cache.ttl_for("http://o/a.ts") == 600
+    assert cache.ttl_for("http://o/a.ts", "no-store") is None
+    assert cache.ttl_for("http://o/a.ts", "private, max-age=60") is None
+    assert cache.ttl_for("http://o/live", "public, s-maxage=5, max-age=60") == 5
+    assert cache.ttl_for("http://o/live", "max-age=0") is None
+    assert cache.ttl_for("http://o/live", "public") == 30
+    assert cache.ttl_for("http://o/live", "immutable") == 600
+    assert cache.ttl_for("http://o/live") is None
+
+
+def test_byte_budget_evicts_least_recently_used():
+    cache = SegmentCache(max_bytes=30, max_entry_bytes=20)
+    cache.put("a", b"a" * 10, "video/mp2t", 60)
+    cache.put("b", b"b" * 10, "video/mp2t", 60)
+    cache.put("c", b"c" * 10, "video/mp2t", 60)
+    cache.get("a")
+    cache.put("d", b"d" * 10, "video/mp2t", 60)
+
+    assert cache.peek("b") is None
+    assert [url for url in "acd" if cache.peek(url)] == ["a", "c", "d"]
+    assert cache.size == 30
+    assert cache.stats["evictions"] == 1
+    assert not cache.put("huge", b"x" * 21, "video/mp2t", 60)
+
+
+def test_expired_entries_miss():
+    cache = SegmentCache()
+    cache.put("a", b"body", "video/mp2t", 60)
+    cache._entries["a"].expires_at = time.monotonic() - 1
+
+    assert cache.get("a") is None
+    assert cache.stats["expirations"] == 1
+    assert cache.size == 0
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    ("BYTES = 0-0", (0, 0)),
+])
+def test_satisfiable_ranges(header, expected):
+    assert parse_byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-10",
+    "bytes=0-10,20-30",
+    "bytes=a-b",
+    "bytes=-",
+    "bytes=50-10",
+])
+def test_ignored_ranges(header):
+    assert parse_byte_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_byte_range(header, 1000)
+
+
+def test_cached_segment_answers_range_with_206():
+    async def scenario():
+        proxy = StreamProxy(cache=SegmentCache())
+        proxy.cache.put("http://o/vod.mp4", bytes(range(100)), "video/mp4", 60)
+        stream = proxy._cached_stream(proxy.cache.get("http://o/vod.mp4"), "bytes=10-19")
+        body = b"".join([chunk async for chunk in stream.body])
+        await proxy.upstream.close()
+        return stream, body
+
+    stream, body = asyncio.run(scenario())
+    assert stream.status_code == 206
+    assert stream.headers["content-range"] == "bytes 10-19/100"
+    assert body == bytes(range(10, 20))
@@ -0,0 +1,103 @@
+import asyncio
+
+from aiohttp import web
+
+from channel_directory import ChannelDirectory
+from hls import encode_upstream_url
+from iptv_generator import StreamProxy, StreamProxyError
+from stream_tokens import StreamTokenCodec
+from tests.fakes import start_origin
+
+
+def test_chunks_are_relayed_before_the_upstream_body_completes():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def live(request):
+            response = web.StreamResponse(headers={"Content-Type": "video/mp2t"})
+            await response.prepare(request)
+            await response.write(b"first")
+            await release.wait()
+            await response.write(b"second")
+            await response.write_eof()
+            return response
+
+        runner, base = await start_origin({"/live.ts": live})
+        url = f"{base}/live.ts"
+        codec = StreamTokenCodec({1: b"k" * 32})
+        directory = ChannelDirectory(None, None)
+        directory.put_channel("news", url)
+        proxy = StreamProxy(tokens=codec, directory=directory)
+        try:
+            stream = await proxy.proxy_stream(codec.issue("viewer", "news"), encode_upstream_url(url))
+            first = await stream.body.__anext__()
+            release.set()
+            rest = [chunk async for chunk in stream.body]
+        finally:
+            await proxy.upstream.close()
+            await runner.cleanup()
+        return stream.media_type, first, b"".join(rest)
+
+    media_type, first, rest = asyncio.run(scenario())
+    assert media_type == "video/mp2t"
+    assert first == b"first"
+    assert rest == b"second"
+
+
+def test_manifest_uris_are_signed_for_their_channel():
+    async def scenario():
+        async def index(request):
+            return web.Response(text="#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6,\nseg1.ts\n",
+                                content_type="application/vnd.apple.mpegurl")
+
+        async def segment(request):
+            return web.Response(body=b"segment", content_type="video/mp2t")
+
+        runner, base = await start_origin({"/live/index.m3u8": index, "/live/seg1.ts": segment})
+        codec = StreamTokenCodec({1: b"k" * 32})
+        directory = ChannelDirectory(None, None)
+        directory.put_channel("news", f"{base}/live/index.m3u8")
+        proxy = StreamProxy(tokens=codec, directory=directory)
+        token = codec.issue("viewer", "news")
+        try:
+            manifest = await proxy.proxy_channel(token, "news")
+            body = b"".join([chunk async for chunk in manifest.body]).decode()
+            signature, encoded = body.strip().splitlines()[-1].split("/")[1:]
+            stream = await proxy.proxy_manifest_uri(token, "news", signature, encoded)
+            segment_body = b"".join([chunk async for chunk in stream.body])
+            rejected = []
+            for channel_id, forged in (("news", ("B" if signature[0] == "A" else "A") + signature[1:]), ("sports", signature)):
+                try:
+                    await proxy.proxy_manifest_uri(codec.issue("viewer", channel_id), channel_id, forged, encoded)
+                except StreamProxyError as e:
+                    rejected.append(str(e))
+        finally:
+            await proxy.upstream.close()
+            await runner.cleanup()
+        return body, segment_body, rejected
+
+    body, segment_body, rejected = asyncio.run(scenario())
+    assert "seg1.ts" not in body
+    assert segment_body == b"segment"
+    assert rejected == ["Invalid stream signature", "Invalid stream signature"]
+
+
+def test_channel_tokens_only_open_their_channels_urls():
+    async def scenario():
+        codec = StreamTokenCodec({1: b"k" * 32})
+        directory = ChannelDirectory(None, None)
+        directory.put_channel("news", "http://origin/news.m3u8")
+        directory.put_channel("sports", "http://origin/sports.m3u8")
+        proxy = StreamProxy(tokens=codec, directory=directory)
+        rejected = []
+        try:
+            for url in ("http://169.254.169.254/latest/meta-data/", "http://origin/sports.m3u8"):
+                try:
+                    await proxy.proxy_stream(codec.issue("viewer", "news"), encode_upstream_url(url))
+                except StreamProxyError as e:
+                    rejected.append(str(e))
+        finally:
+            await proxy.upstream.close()
+        return rejected
+
+    assert asyncio.run(scenario()) == ["Stream not in playlist", "Stream not in playlist"]
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from stream_sessions import StreamSessionRegistry
+
+
+async def relay_all(registry, session, chunks):
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    return [chunk async for chunk in registry.relay(session, body())]
+
+
+def test_requests_of_one_viewer_share_a_session():
+    registry = StreamSessionRegistry()
+    first = registry.open("token", "alice", "news", "10.0.0.1", access_code_id="code")
+    again = registry.open("token", "alice", "news", "10.0.0.1")
+    other_channel = registry.open("token", "alice", "sports", "10.0.0.1")
+    other_viewer = registry.open("token-2", "bob", "news", "10.0.0.2")
+
+    assert first is again
+    assert first.requests == 2
+    assert registry.active_count == 3
+    assert registry.counts() == ({"news": 2, "sports": 1}, {"alice": 2, "bob": 1})
+    assert other_channel is not first and other_viewer is not first
+
+
+def test_relay_counts_bytes():
+    registry = StreamSessionRegistry()
+    session = registry.open("token", "alice", "news", "10.0.0.1")
+
+    assert asyncio.run(relay_all(registry, session, [b"abc", b"de"])) == [b"abc", b"de"]
+    assert session.bytes_sent == 5
+    assert session.open_requests == 0
+    assert registry.list_sessions()[0]["bytes_sent"] == 5
+
+
+def test_idle_sessions_are_reaped_and_reported():
+    registry = StreamSessionRegistry(idle_timeout=30)
+    closed = []
+    registry.on_close = closed.append
+    idle = registry.open("token", "alice", "news", "10.0.0.1")
+    busy = registry.open("token", "bob", "news", "10.0.0.2")
+    idle.last_activity = busy.last_activity = time.time() - 60
+    busy.bytes_sent = 1000
+
+    registry._sweep()
+
+    assert closed == [idle]
+    assert registry.sessions() == [busy]
+    assert registry.stats["reaped"] == 1
+
+
+def test_devices_sharing_an_address_get_their_own_sessions():
+    registry = StreamSessionRegistry()
+    phone = registry.open("token", "alice", "news", "10.0.0.1", device="phone")
+    tv = registry.open("token", "alice", "news", "10.0.0.1", device="tv")
+
+    assert phone is not tv
+    assert registry.open("token", "alice", "news", "10.0.0.1", device="tv") is tv
+    assert {session["device"] for session in registry.list_sessions()} == {"phone", "tv"}
@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from stream_tokens import StreamTokenCodec, LEGACY_V1_SECRET
+
+USER_ID = str(uuid.uuid4())
+CHANNEL_ID = str(uuid.uuid4())
+ACCESS_CODE_ID = str(uuid.uuid4())
+
+
+def legacy_token(user_id, channel_id, hours=24, created=None, access_code_id=None):
+    created = created or datetime.utcnow()
+    payload = f"{user_id}:{channel_id}:{created.isoformat()}:{hours}"
+    if access_code_id:
+        payload += f":{access_code_id}"
+    encoded = base64.b64encode(payload.encode()).decode()
+    signature = hashlib.sha256(f"{encoded}:{LEGACY_V1_SECRET}".encode()).hexdigest()[:16]
+    return f"{encoded}.{signature}"
+
+
+def test_channel_token_round_trip():
+    codec = StreamTokenCodec({1: b"k" * 32})
+    claims = codec.verify(codec.issue(USER_ID, CHANNEL_ID, access_code_id=ACCESS_CODE_ID))
+
+    assert claims["user_id"] == USER_ID
+    assert claims["playlist_id"] == CHANNEL_ID
+    assert claims["access_code_id"] == ACCESS_CODE_ID
+    assert (claims["version"], claims["scope"], claims["key_id"]) == (2, "channel", 1)
+
+
+def test_legacy_tokens():
+    codec = StreamTokenCodec({1: b"k" * 32}, accept_v1=True)
+    claims = codec.verify(legacy_token(USER_ID, CHANNEL_ID, access_code_id=ACCESS_CODE_ID))
+
+    assert claims["version"] == 1
+    assert claims["playlist_id"] == CHANNEL_ID
+    assert claims["access_code_id"] == ACCESS_CODE_ID
+    assert codec.verify(legacy_token(USER_ID, CHANNEL_ID, created=datetime(2000, 1, 1))) is None
+    # Anyone can sign v1 tokens, so lifetimes the old generator never issued are refused
+    assert codec.verify(legacy_token(USER_ID, CHANNEL_ID, hours=999999, created=datetime(2020, 1, 1))) is None
+    assert codec.verify(legacy_token(USER_ID, CHANNEL_ID, created=datetime.utcnow() + timedelta(days=365))) is None
+    assert StreamTokenCodec({1: b"k" * 32}).verify(legacy_token(USER_ID, CHANNEL_ID)) is None
+
+
+def test_forged_expired_and_truncated_tokens_are_rejected():
+    codec = StreamTokenCodec({1: b"k" * 32})
+    token = codec.issue(USER_ID, CHANNEL_ID)
+    raw = bytearray(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    raw[-1] ^= 1
+    forged = base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode()
+
+    assert codec.verify(forged) is None
+    assert codec.verify(token[:10]) is None
+    assert codec.verify(codec.issue(USER_ID, CHANNEL_ID, expires_in=-1)) is None
+    assert StreamTokenCodec({1: b"x" * 32}).verify(token) is None
+
+
+def test_key_rotation_keeps_old_tokens_valid():
+    old = StreamTokenCodec({1: b"old" * 11})
+    token = old.issue(USER_ID, CHANNEL_ID)
+    rotated = StreamTokenCodec({1: b"old" * 11, 2: b"new" * 11}, active_key_id=2)
+
+    assert rotated.verify(token)["key_id"] == 1
+    assert rotated.verify(rotated.issue(USER_ID, CHANNEL_ID))["key_id"] == 2
+    assert StreamTokenCodec({2: b"new" * 11}).verify(token) is None
+
+
+def test_repeat_verifications_hit_the_cache():
+    codec = StreamTokenCodec({1: b"k" * 32}, cache_size=1)
+    first, second = codec.issue(USER_ID, CHANNEL_ID), codec.issue(USER_ID, "other")
+    codec.verify(first)
+    codec.verify(first)
+    codec.verify("junk")
+    codec.verify(second)
+
+    assert codec.stats["cache_hits"] == 1
+    assert codec.stats["rejected"] == 1
+    assert list(codec._cache) == [second]
+
+
+def test_playlist_token_is_stable_within_expiry_step():
+    codec = StreamTokenCodec({1: b"k" * 32}, playlist_expiry_step=3600)
+    first = codec.issue_playlist(USER_ID, "playlist-1")
+    second = codec.issue_playlist(USER_ID, "playlist-1")
+    claims = codec.verify(first)
+
+    assert first == second
+    assert (claims["version"], claims["scope"], claims["playlist_id"]) == (3, "playlist", "playlist-1")
+    assert claims["expires_at"] % 3600 == 0
+
+
+def test_uri_signatures_bind_channel_and_url():
+    codec = StreamTokenCodec({1: b"k" * 32})
+    signature = codec.sign_uri(CHANNEL_ID, "http://origin/seg.ts")
+
+    assert codec.verify_uri(CHANNEL_ID, "http://origin/seg.ts", signature)
+    assert not codec.verify_uri(CHANNEL_ID, "http://origin/other.ts", signature)
+    assert not codec.verify_uri("another-channel", "http://origin/seg.ts", signature)
+    assert not codec.verify_uri(CHANNEL_ID, "http://origin/seg.ts", "not-a-signature")
+
+
+def test_key_ids_must_fit_the_header_byte():
+    with pytest.raises(ValueError):
+        StreamTokenCodec({256: b"k" * 32})
+    with pytest.raises(ValueError):
+        StreamTokenCodec({-1: b"k" * 32, 1: b"k" * 32}, active_key_id=1)
+
+    codec = StreamTokenCodec({0: b"a" * 32, 255: b"b" * 32})
+    assert codec.verify(codec.issue(USER_ID, CHANNEL_ID))["key_id"] == 255
@@ -0,0 +1,45 @@
+import asyncio
+
+from aiohttp import web
+
+from tests.fakes import start_origin
+from upstream import UpstreamClient
+
+
+def test_one_pooled_session_reuses_connections():
+    async def scenario():
+        async def ok(request):
+            return web.Response(body=b"ok")
+
+        runner, base = await start_origin({"/ok": ok})
+        client = UpstreamClient()
+        try:
+            session = await client.get_session()
+            for _ in range(3):
+                async with (await client.get_session()).get(f"{base}/ok") as response:
+                    await response.read()
+            same_session = await client.get_session() is session
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return same_session, client.get_stats()
+
+    same_session, stats = asyncio.run(scenario())
+    assert same_session
+    assert stats["requests"] == 3
+    assert stats["connections_created"] == 1
+    assert stats["connections_reused"] == 2
+
+
+def test_closed_session_is_restarted_lazily():
+    async def scenario():
+        client = UpstreamClient()
+        first = await client.get_session()
+        await client.close()
+        second = await client.get_session()
+        await client.close()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is not second
+    assert first.closed
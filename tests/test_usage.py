@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+from stream_sessions import StreamSessionRegistry
+from tests.fakes import FakeCollection
+from usage import UsageRecorder, WriteBehindCounters
+
+
+def test_increments_are_merged_into_one_write_per_document():
+    async def scenario():
+        collection = FakeCollection("counters")
+        counters = WriteBehindCounters(collection)
+        for _ in range(3):
+            counters.add((("id", "a"),), uses=1, bytes=10)
+        counters.add((("id", "b"),), uses=1)
+        written = await counters.flush()
+        return written, collection
+
+    written, collection = asyncio.run(scenario())
+    assert written == 2
+    assert collection.calls["bulk_write"] == 1
+    assert sorted((doc["id"], doc["uses"]) for doc in collection.docs) == [("a", 3), ("b", 1)]
+    assert next(doc for doc in collection.docs if doc["id"] == "a")["bytes"] == 30
+
+
+def test_failed_flush_is_retried_with_later_increments():
+    async def scenario():
+        collection = FakeCollection("counters")
+        collection.failures["bulk_write"] = [ConnectionError("primary stepped down")]
+        counters = WriteBehindCounters(collection)
+        counters.add((("id", "a"),), uses=2)
+        first = await counters.flush()
+        lag = counters.get_stats()["pending_documents"]
+        counters.add((("id", "a"),), uses=1)
+        second = await counters.flush()
+        return first, lag, second, counters.stats, collection.docs
+
+    first, pending, second, stats, docs = asyncio.run(scenario())
+    assert (first, pending, second) == (0, 1, 1)
+    assert stats["flush_errors"] == 1
+    assert docs[0]["uses"] == 3
+
+
+def test_only_failed_documents_of_a_bulk_write_are_retried():
+    async def scenario():
+        collection = FakeCollection("counters")
+        collection.failures["bulk_write"] = [
+            BulkWriteError({"writeErrors": [{"index": 1, "code": 2, "errmsg": "bad"}]})
+        ]
+        counters = WriteBehindCounters(collection)
+        counters.add((("id", "a"),), uses=1)
+        counters.add((("id", "b"),), uses=1)
+        written = await counters.flush()
+        return written, counters._pending
+
+    written, pending = asyncio.run(scenario())
+    assert written == 1
+    assert pending == {(("id", "b"),): {"uses": 1}}
+
+
+def test_usage_is_bucketed_per_scope_and_hour():
+    async def scenario():
+        collection = FakeCollection("usage")
+        sessions = StreamSessionRegistry()
+        recorder = UsageRecorder(collection, sessions)
+        session = sessions.open("token", "alice", "news", "10.0.0.1", access_code_id="code")
+        session.bytes_sent = 500
+        await recorder.flush()
+        session.bytes_sent = 800
+        await recorder.flush()
+        return collection.docs
+
+    docs = asyncio.run(scenario())
+    assert sorted((doc["scope"], doc["key"], doc["bytes"], doc["requests"]) for doc in docs) == [
+        ("access_code", "code", 800, 1),
+        ("channel", "news", 800, 1),
+        ("user", "alice", 800, 1),
+    ]
+    assert all(isinstance(doc["hour"], datetime) and doc["hour"].minute == 0 for doc in docs)